@@ -0,0 +1,77 @@
+"""Микробенчмарк отрисовки экранов: стоимость текста и клавиатуры на одно нажатие
+
+Сравнивает готовые экраны каталога (rendering.py) со сборкой того же
+шаблона заново на каждое нажатие — так, как обработчики собирали текст и
+InlineKeyboardMarkup раньше. Telegram и база не нужны.
+
+Пример:
+    python benchmarks/bench_render.py --iterations 20000
+"""
+import argparse
+import os
+import sys
+import time
+import tomllib
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from rendering import Catalog, Markup, Template  # noqa: E402
+
+PARAMS = {'ref_link': 'https://www.tbank.ru/baf/7Yzkluz5kaS', 'support_url': 'https://t.me/moneytreerefbot'}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=20000, help='повторов на каждый сценарий')
+    parser.add_argument('--locales', default=os.path.join(ROOT, 'locales'), help='каталог шаблонов')
+    return parser.parse_args()
+
+
+def measure(func, iterations):
+    """Среднее время одного вызова в микросекундах"""
+    func()
+    started = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - started) / iterations * 1e6
+
+
+def main():
+    args = parse_args()
+
+    started = time.perf_counter()
+    catalog = Catalog(args.locales, **PARAMS)
+    load_ms = (time.perf_counter() - started) * 1000
+
+    with open(os.path.join(args.locales, 'ru.toml'), 'rb') as f:
+        source = tomllib.load(f)
+
+    def rebuild(name, **fields):
+        item = source[name]
+        return Template(name, item['text'], item.get('keyboard'), PARAMS).render(fields)
+
+    card = {
+        'app_id': 12345, 'user_id': 955084910, 'username': 'ivan_petrov', 'full_name': 'Иван *Петров*',
+        'contact_info': Markup('4111 1111 1111 1111'), 'created_at': datetime.now(),
+    }
+    scenarios = [
+        ('условия (без полей)', lambda: catalog.render('terms', 'ru'), lambda: rebuild('terms')),
+        ('инструкция (без полей)', lambda: catalog.render('instruction', 'en-US'), lambda: rebuild('instruction')),
+        ('приветствие (имя)', lambda: catalog.render('start', 'ru', first_name='Иван_1'),
+         lambda: rebuild('start', first_name='Иван_1')),
+        ('карточка заявки', lambda: catalog.render('inbox_card', **card), lambda: rebuild('inbox_card', **card)),
+    ]
+
+    print(f"Загрузка и сборка шаблонов ({', '.join(catalog.locales)}): {load_ms:.1f} мс")
+    print(f"{'экран':<26}{'каталог, мкс':>14}{'заново, мкс':>14}{'выигрыш':>10}")
+    print("-" * 64)
+    for title, cached, rebuilt in scenarios:
+        cached_us = measure(cached, args.iterations)
+        rebuilt_us = measure(rebuilt, args.iterations)
+        print(f"{title:<26}{cached_us:>14.2f}{rebuilt_us:>14.2f}{rebuilt_us / cached_us:>9.1f}×")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+import asyncio
+import itertools
+import json
+import random
+import time
+from collections import Counter
+
+from telegram.request import BaseRequest
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}
+
+
+class FakeBotAPI(BaseRequest):
+    """Локальная заглушка Bot API для бенчмарков
+
+    Ничего не отправляет в сеть: записывает вызовы, отвечает правдоподобными
+    объектами, добавляет задержку latency (секунды, ± jitter) и с вероятностью
+    flood_rate отвечает 429 с retry_after, как настоящий Telegram.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, flood_rate=0.0, retry_after=1, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.flood_rate = flood_rate
+        self.retry_after = retry_after
+        self.calls = Counter()
+        self.flood_errors = 0
+        self.log = []
+        self._random = random.Random(seed)
+        self._message_ids = itertools.count(1)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        api_method = url.rsplit('/', 1)[-1]
+        params = request_data.parameters if request_data else {}
+        self.calls[api_method] += 1
+        self.log.append((time.monotonic(), api_method, params.get('chat_id')))
+
+        delay = self.latency + self._random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        if api_method != 'getMe' and self.flood_rate and self._random.random() < self.flood_rate:
+            self.flood_errors += 1
+            return 429, self._dump({
+                'ok': False,
+                'error_code': 429,
+                'description': f'Too Many Requests: retry after {self.retry_after}',
+                'parameters': {'retry_after': self.retry_after},
+            })
+
+        return 200, self._dump({'ok': True, 'result': self._result(api_method, params)})
+
+    @staticmethod
+    def _dump(data):
+        return json.dumps(data).encode()
+
+    def _message(self, params, **extra):
+        chat_id = params.get('chat_id', 0)
+        message = {
+            'message_id': next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': BOT_USER,
+        }
+        message.update(extra)
+        return message
+
+    def _result(self, api_method, params):
+        if api_method == 'getMe':
+            return BOT_USER
+        if api_method in ('answerCallbackQuery', 'setWebhook', 'deleteWebhook'):
+            return True
+        if api_method == 'sendPhoto':
+            photo = params.get('photo')
+            return self._message(params, photo=[{
+                'file_id': photo if isinstance(photo, str) else 'uploaded',
+                'file_unique_id': 'u', 'width': 1, 'height': 1,
+            }], caption=params.get('caption'))
+        if api_method == 'sendMediaGroup':
+            return [
+                self._message(params, photo=[{'file_id': 'f', 'file_unique_id': 'u', 'width': 1, 'height': 1}])
+                for _ in params.get('media', [])
+            ]
+        if api_method == 'sendDocument':
+            return self._message(params, document={'file_id': 'd', 'file_unique_id': 'du'})
+        # sendMessage, editMessageText и прочие методы, возвращающие Message
+        return self._message(params, text=params.get('text', ''))
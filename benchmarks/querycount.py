@@ -0,0 +1,54 @@
+import contextvars
+import sqlite3
+
+import psycopg2.extensions
+
+from storage import SQLiteStorage
+
+# Статистика обрабатываемого сейчас обновления (словарь) или None вне обновлений
+current_update = contextvars.ContextVar('current_update', default=None)
+
+total_queries = 0
+
+
+def count_query():
+    """Учет одного запроса к базе данных"""
+    global total_queries
+    total_queries += 1
+    stats = current_update.get()
+    if stats is not None:
+        stats['queries'] += 1
+
+
+class CountingCursor(psycopg2.extensions.cursor):
+    """Курсор psycopg2, считающий выполненные запросы"""
+
+    def execute(self, query, vars=None):
+        count_query()
+        return super().execute(query, vars)
+
+    def executemany(self, query, vars_list):
+        count_query()
+        return super().executemany(query, vars_list)
+
+
+class CountingConnection(sqlite3.Connection):
+    """Подключение sqlite3, считающее вызовы execute/executemany
+
+    Считаются только запросы, отправленные кодом хранилища: выражения
+    триггеров и FTS5, которые SQLite выполняет внутри, в счет не идут.
+    """
+
+    def execute(self, sql, parameters=()):
+        count_query()
+        return super().execute(sql, parameters)
+
+    def executemany(self, sql, parameters):
+        count_query()
+        return super().executemany(sql, parameters)
+
+
+class CountingSQLiteStorage(SQLiteStorage):
+    """Встроенное хранилище SQLite, считающее выполненные запросы"""
+
+    connection_factory = CountingConnection
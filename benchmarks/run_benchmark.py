@@ -0,0 +1,250 @@
+"""Нагрузочный бенчмарк обработчиков бота без Telegram и без Railway
+
+Прогоняет через настоящие обработчики из bot.py синтетические обновления:
+/start → условия → ссылка → инструкция → скриншот → реквизиты для каждого
+пользователя, затем /view_applications и одобрение/отклонение заявок
+администратором. Bot API заменен локальной заглушкой (FakeBotAPI),
+база — временным файлом SQLite или локальным PostgreSQL (--database-url).
+
+Пример:
+    python benchmarks/run_benchmark.py --users 500 --api-latency-ms 40
+    python benchmarks/run_benchmark.py --database-url postgresql://localhost/bench
+"""
+import argparse
+import asyncio
+import itertools
+import logging
+import os
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=200, help='число пользователей, проходящих сценарий')
+    parser.add_argument('--api-latency-ms', type=float, default=30.0, help='задержка ответа Bot API')
+    parser.add_argument('--api-jitter-ms', type=float, default=10.0, help='разброс задержки Bot API')
+    parser.add_argument('--flood-rate', type=float, default=0.0, help='доля ответов 429 Too Many Requests')
+    parser.add_argument('--database-url', help='локальный PostgreSQL вместо временной базы SQLite')
+    parser.add_argument('--max-concurrent-updates', type=int, default=32)
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args()
+
+
+def configure_environment(args):
+    """Настройки бота задаются через окружение до импорта bot.py"""
+    os.environ['BOT_TOKEN'] = '123456:BENCHMARK'
+    os.environ['DATABASE_URL'] = args.database_url or ''
+    os.environ['MAX_CONCURRENT_UPDATES'] = str(args.max_concurrent_updates)
+    os.environ['BOT_MODE'] = 'polling'
+    # Заглушка Bot API не отдает файлы: перцептивный хеш скриншотов не считаем
+    os.environ['FRAUD_PHASH'] = '0'
+    # Бенчмарк не вызывает application.start(), поэтому состояние пользователей на диск не пишется
+    os.environ['STATE_PATH'] = ''
+    # Пользователи не должны упираться в лимит чата администратора
+    os.environ.setdefault('SEND_GLOBAL_RATE', '1000')
+
+
+class UpdateFactory:
+    """Синтетические обновления Telegram"""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+
+    @staticmethod
+    def user(user_id):
+        return {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}',
+                'last_name': 'Bench', 'username': f'user{user_id}', 'language_code': 'ru'}
+
+    def _message(self, user_id, **fields):
+        message = {
+            'message_id': next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': self.user(user_id),
+        }
+        message.update(fields)
+        return message
+
+    def _update(self, **fields):
+        from telegram import Update
+        return Update.de_json({'update_id': next(self._update_ids), **fields}, self.bot)
+
+    def command(self, user_id, text):
+        command = text.split()[0]
+        return self._update(message=self._message(
+            user_id, text=text,
+            entities=[{'type': 'bot_command', 'offset': 0, 'length': len(command)}],
+        ))
+
+    def text(self, user_id, text):
+        return self._update(message=self._message(user_id, text=text))
+
+    def photo(self, user_id):
+        return self._update(message=self._message(user_id, photo=[
+            {'file_id': f'photo-{user_id}-small', 'file_unique_id': f's{user_id}', 'width': 90, 'height': 160},
+            {'file_id': f'photo-{user_id}', 'file_unique_id': f'p{user_id}', 'width': 720, 'height': 1280},
+        ]))
+
+    def callback(self, user_id, data):
+        return self._update(callback_query={
+            'id': str(next(self._update_ids)),
+            'from': self.user(user_id),
+            'chat_instance': str(user_id),
+            'data': data,
+            'message': {
+                'message_id': next(self._message_ids),
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'from': {'id': 1, 'is_bot': True, 'first_name': 'Bench'},
+                'text': '...',
+            },
+        })
+
+
+def percentile(values, fraction):
+    """Перцентиль методом ближайшего ранга"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(fraction * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+class Benchmark:
+    def __init__(self, application, factory, querycount):
+        self.application = application
+        self.factory = factory
+        self.querycount = querycount
+        self.samples = defaultdict(list)
+        self.errors = 0
+
+    async def on_error(self, update, context):
+        self.errors += 1
+        logging.debug(f"Ошибка обработчика: {context.error!r}")
+
+    async def process(self, scenario, update):
+        """Обработка обновления так же, как это делает Application при concurrent_updates"""
+        stats = {'queries': 0}
+        token = self.querycount.current_update.set(stats)
+        started = time.perf_counter()
+        try:
+            await self.application.update_processor.process_update(
+                update, self.application.process_update(update)
+            )
+        finally:
+            elapsed = time.perf_counter() - started
+            self.querycount.current_update.reset(token)
+        self.samples[scenario].append((elapsed, stats['queries']))
+
+    async def user_journey(self, user_id):
+        factory = self.factory
+        await self.process('start', factory.command(user_id, '/start'))
+        await self.process('show_terms', factory.callback(user_id, 'show_terms'))
+        await self.process('get_link', factory.callback(user_id, 'get_link'))
+        await self.process('instruction', factory.callback(user_id, 'instruction'))
+        await self.process('screenshot', factory.photo(user_id))
+        await self.process('contact', factory.text(user_id, f'Карта 2200 0000 0000 {user_id % 10000:04d}'))
+
+    async def admin_review(self, admin_id, app_ids):
+        factory = self.factory
+        await self.process('view_applications', factory.command(admin_id, '/view_applications'))
+        for index, app_id in enumerate(app_ids):
+            action = 'approve' if index % 2 == 0 else 'reject'
+            await self.process(f'button_{action}', factory.callback(admin_id, f'{action}_{app_id}'))
+
+
+def print_report(benchmark, fake_api, elapsed):
+    header = f"{'сценарий':<20}{'кол-во':>8}{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}{'запр./обн.':>12}"
+    print(header)
+    print('-' * len(header))
+    total_updates = 0
+    total_queries = 0
+    for scenario, samples in benchmark.samples.items():
+        latencies = [elapsed_s * 1000 for elapsed_s, _queries in samples]
+        queries = sum(q for _elapsed, q in samples)
+        total_updates += len(samples)
+        total_queries += queries
+        print(f"{scenario:<20}{len(samples):>8}{percentile(latencies, 0.50):>10.2f}"
+              f"{percentile(latencies, 0.95):>10.2f}{percentile(latencies, 0.99):>10.2f}"
+              f"{queries / len(samples):>12.2f}")
+    all_latencies = [s[0] * 1000 for samples in benchmark.samples.values() for s in samples]
+    print('-' * len(header))
+    print(f"{'всего':<20}{total_updates:>8}{percentile(all_latencies, 0.50):>10.2f}"
+          f"{percentile(all_latencies, 0.95):>10.2f}{percentile(all_latencies, 0.99):>10.2f}"
+          f"{total_queries / max(total_updates, 1):>12.2f}")
+    print()
+    print(f"Пропускная способность: {total_updates / elapsed:.1f} обновлений/с ({total_updates} за {elapsed:.2f} с)")
+    api_calls = sum(fake_api.calls.values())
+    print(f"Вызовы Bot API: {api_calls} ({api_calls / max(total_updates, 1):.2f} на обновление): "
+          + ', '.join(f"{method}={count}" for method, count in fake_api.calls.most_common()))
+    print(f"Ответов 429: {fake_api.flood_errors}, ошибок обработчиков: {benchmark.errors}")
+
+
+async def run(args):
+    import bot
+    import querycount
+    from db_pool import DatabasePool
+    from fake_bot_api import FakeBotAPI
+    from storage import PostgresStorage
+
+    logging.getLogger().setLevel(logging.WARNING)
+
+    if args.database_url:
+        bot.storage = PostgresStorage(DatabasePool(args.database_url, maxconn=bot.DB_POOL_MAX,
+                                                   cursor_factory=querycount.CountingCursor))
+        # Пользователи из отдельного диапазона, чтобы не пересекаться с реальными данными
+        first_user_id = 10 ** 12 + int(time.time())
+    else:
+        workdir = tempfile.mkdtemp(prefix='bot-bench-')
+        bot.storage = querycount.CountingSQLiteStorage(os.path.join(workdir, 'bench.db'))
+        first_user_id = 10_000
+    bot.init_db()
+
+    fake_api = FakeBotAPI(
+        latency=args.api_latency_ms / 1000,
+        jitter=args.api_jitter_ms / 1000,
+        flood_rate=args.flood_rate,
+        seed=args.seed,
+    )
+    application = bot.build_application(request=fake_api)
+    factory = UpdateFactory(application.bot)
+    benchmark = Benchmark(application, factory, querycount)
+    application.add_error_handler(benchmark.on_error)
+
+    await application.initialize()
+    await application.post_init(application)
+    try:
+        started = time.perf_counter()
+        user_ids = [first_user_id + index for index in range(args.users)]
+        await asyncio.gather(*(benchmark.user_journey(user_id) for user_id in user_ids))
+
+        app_ids = []
+        for user_id in user_ids:
+            app = bot.storage.pending_by_user(user_id)
+            if app:
+                app_ids.append(app[0])
+        await benchmark.admin_review(bot.ADMIN_ID, app_ids)
+        elapsed = time.perf_counter() - started
+    finally:
+        await application.shutdown()
+        await application.post_shutdown(application)
+
+    print_report(benchmark, fake_api, elapsed)
+
+
+def main():
+    args = parse_args()
+    configure_environment(args)
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,40 @@
 import os
+import asyncio
+import contextvars
+import functools
 import logging
-import psycopg2
-from datetime import datetime
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Application, CommandHandler, CallbackContext, CallbackQueryHandler, MessageHandler, filters
+import secrets
+import tempfile
+import uuid
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from pathlib import Path
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputMediaPhoto
+from telegram.ext import (
+    Application, ApplicationHandlerStop, CommandHandler, CallbackContext, CallbackQueryHandler, MessageHandler,
+    TypeHandler, filters,
+)
+from telegram.request import BaseRequest
+
+import fraud
+import metrics
+from cache import TTLCache, idle_keys
+from coordination import CHANNEL, EventBus, LeaderElection
+from db_pool import DatabasePool, PoolUnavailableError
+from export import FORMAT_CSV, FORMATS, export_applications
+from journal import Journal
+from stats import EVENTS, WINDOW_MONTH, WINDOWS, FunnelCounters, rollup, windows
+from metrics import CallbackMetric, InstrumentedRequest, instrument_db, instrument_handler, metrics_endpoint
+from storage import PostgresStorage, SQLiteStorage, add_months, month_start
+from notifications import AdminNotifier
+from persistence import SQLitePersistence
+from rendering import PARSE_MODE, Catalog, Markup, code_block, escape
+from ratelimit import InboundLimiter
+from sender import OutboundSender
+from update_processor import PerUserUpdateProcessor
+from webhook import HTTPServer, WebhookServer
 
 # Настройка логирования
 logging.basicConfig(
@@ -17,438 +48,1232 @@ REF_LINK = "https://www.tbank.ru/baf/7Yzkluz5kaS"  # ЗАМЕНИТЕ
 SUPPORT_USERNAME = "@moneytreerefbot"    # ЗАМЕНИТЕ
 ADMIN_ID = 955084910                  # ЗАМЕНИТЕ НА ВАШ USER_ID
 
+# Режим работы: polling (по умолчанию) или webhook
+# WEBHOOK_URL — публичный адрес бота (например, https://bot.up.railway.app).
+# Если он не задан, а BOT_MODE=webhook, сервер работает как локальная заглушка
+# без регистрации вебхука в Telegram.
+# WEBHOOK_SECRET — секрет заголовка X-Telegram-Bot-Api-Secret-Token; если не задан,
+# создается случайный на время работы процесса (при MULTI_INSTANCE=1 обязателен).
+WEBHOOK_URL = os.environ.get('WEBHOOK_URL')
+WEBHOOK_PATH = os.environ.get('WEBHOOK_PATH', '/telegram')
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET') or secrets.token_urlsafe(32)
+BOT_MODE = os.environ.get('BOT_MODE', 'webhook' if WEBHOOK_URL else 'polling')
+PORT = int(os.environ.get('PORT', 8080))
+
+# Лимиты исходящих сообщений (Telegram: ~30 сообщений в секунду на бота, ~1 в секунду на чат)
+SEND_GLOBAL_RATE = float(os.environ.get('SEND_GLOBAL_RATE', 30))
+SEND_PER_CHAT_RATE = float(os.environ.get('SEND_PER_CHAT_RATE', 1))
+SEND_PER_CHAT_BURST = int(os.environ.get('SEND_PER_CHAT_BURST', 3))
+
+# Тексты и клавиатуры бота по языкам (locales/<язык>.toml); язык пользователя
+# берется из его настроек Telegram, для остальных — DEFAULT_LOCALE
+LOCALES_DIR = os.environ.get('LOCALES_DIR') or Path(__file__).with_name('locales')
+DEFAULT_LOCALE = os.environ.get('DEFAULT_LOCALE', 'ru')
+
+# Сколько заявок показывать на одной странице /view_applications
+INBOX_PAGE_SIZE = int(os.environ.get('INBOX_PAGE_SIZE', 5))
+
+# Сколько найденных заявок показывать на одной странице /find
+FIND_PAGE_SIZE = int(os.environ.get('FIND_PAGE_SIZE', 5))
+
+# Сколько скриншотов в одном альбоме /all_screenshots (максимум Telegram — 10)
+MEDIA_GROUP_SIZE = min(int(os.environ.get('MEDIA_GROUP_SIZE', 10)), 10)
+
+# Уведомления администратора о новых заявках: digest (пачками) или immediate (по одной).
+# Дайджест отправляется раз в ADMIN_DIGEST_INTERVAL секунд или при ADMIN_DIGEST_MAX_ITEMS заявках.
+ADMIN_NOTIFY_MODE = os.environ.get('ADMIN_NOTIFY_MODE', 'digest')
+ADMIN_DIGEST_INTERVAL = float(os.environ.get('ADMIN_DIGEST_INTERVAL', 60))
+ADMIN_DIGEST_MAX_ITEMS = int(os.environ.get('ADMIN_DIGEST_MAX_ITEMS', 10))
+
+# Сколько обновлений обрабатывается одновременно (обновления одного пользователя — по очереди)
+MAX_CONCURRENT_UPDATES = int(os.environ.get('MAX_CONCURRENT_UPDATES', 32))
+
+# Входящий лимит на пользователя: в среднем INBOUND_RATE обновлений в секунду,
+# всплеск до INBOUND_BURST; лишние отбрасываются до обращения к базе (0 — выключено).
+# Память ограничена INBOUND_MAX_USERS корзинами, простаивающие удаляются сами.
+INBOUND_RATE = float(os.environ.get('INBOUND_RATE', 1))
+INBOUND_BURST = int(os.environ.get('INBOUND_BURST', 10))
+INBOUND_MAX_USERS = int(os.environ.get('INBOUND_MAX_USERS', 20000))
+
+# Метрики Prometheus: в режиме вебхука — GET /metrics на том же порту,
+# при polling — отдельный сервер, если задан METRICS_PORT
+METRICS_PORT = int(os.environ.get('METRICS_PORT', 0)) or None
+# Операции дольше порога (мс) пишутся в журнал с trace id обновления; 0 — выключено
+SLOW_OP_THRESHOLD_MS = float(os.environ.get('SLOW_OP_THRESHOLD_MS', 0))
+if SLOW_OP_THRESHOLD_MS > 0:
+    metrics.slow_threshold = SLOW_OP_THRESHOLD_MS / 1000
+
+# Состояние подачи заявки у пользователей (user_data) хранится в локальном файле SQLite
+# и пишется на диск пачками раз в STATE_FLUSH_INTERVAL секунд; пустой STATE_PATH — только в памяти.
+# На Railway файл нужно держать на подключенном томе, как и SQLITE_PATH.
+STATE_PATH = os.environ.get('STATE_PATH', 'state.db')
+STATE_FLUSH_INTERVAL = float(os.environ.get('STATE_FLUSH_INTERVAL', 5))
+# Состояние, к которому не обращались SUBMISSION_TTL секунд, вытесняется (при следующем
+# сообщении оно определится по базе); сверх SUBMISSION_MAX_USERS вытесняются самые давние.
+# Проверка — раз в SUBMISSION_EVICT_INTERVAL секунд.
+SUBMISSION_TTL = float(os.environ.get('SUBMISSION_TTL', 24 * 3600))
+SUBMISSION_MAX_USERS = int(os.environ.get('SUBMISSION_MAX_USERS', 50000))
+SUBMISSION_EVICT_INTERVAL = float(os.environ.get('SUBMISSION_EVICT_INTERVAL', 600))
+
+# Несколько процессов бота за одним вебхуком (только с PostgreSQL): разовые задачи
+# выполняет ведущий процесс (advisory-блокировка, проверка раз в LEADER_CHECK_INTERVAL
+# секунд), состояние подачи заявки сбрасывается событиями LISTEN/NOTIFY, повторно доставленные
+# обновления отсекаются по update_id, отметки о них хранятся PROCESSED_UPDATES_TTL часов.
+# В режиме polling второй процесс не нужен: getUpdates отдает обновления одному получателю.
+MULTI_INSTANCE = os.environ.get('MULTI_INSTANCE', '0') == '1'
+LEADER_CHECK_INTERVAL = float(os.environ.get('LEADER_CHECK_INTERVAL', 5))
+PROCESSED_UPDATES_TTL = float(os.environ.get('PROCESSED_UPDATES_TTL', 24))
+
 # Получаем URL базы данных из переменных окружения Railway
 DATABASE_URL = os.environ.get('DATABASE_URL')
+# Без DATABASE_URL заявки хранятся во встроенной базе SQLite.
+# На Railway файл нужно держать на подключенном томе, иначе он пропадет при передеплое.
+SQLITE_PATH = os.environ.get('SQLITE_PATH', 'applications.db')
+
+# Журнал заявок на время недоступности базы: каталог (пустой — выключен),
+# размер сегмента в байтах, период переноса в базу в секундах и размер пачки
+JOURNAL_DIR = os.environ.get('JOURNAL_DIR', 'journal')
+JOURNAL_SEGMENT_SIZE = int(os.environ.get('JOURNAL_SEGMENT_SIZE', 4 * 1024 * 1024))
+JOURNAL_REPLAY_INTERVAL = float(os.environ.get('JOURNAL_REPLAY_INTERVAL', 5))
+JOURNAL_BATCH_SIZE = int(os.environ.get('JOURNAL_BATCH_SIZE', 100))
+
+# Хранение завершенных заявок: через RETENTION_DAYS дней после решения заявка
+# уходит из рабочей таблицы в архив — без персональных данных (anonymize) или
+# целиком (archive). Архив старше ARCHIVE_RETENTION_MONTHS месяцев удаляется (0 — хранить).
+RETENTION_DAYS = float(os.environ.get('RETENTION_DAYS', 90))
+RETENTION_MODE = os.environ.get('RETENTION_MODE', 'anonymize')
+ARCHIVE_RETENTION_MONTHS = int(os.environ.get('ARCHIVE_RETENTION_MONTHS', 12))
+RETENTION_INTERVAL = float(os.environ.get('RETENTION_INTERVAL', 3600))
+RETENTION_BATCH_SIZE = int(os.environ.get('RETENTION_BATCH_SIZE', 500))
+
+# Повторно использованные скриншоты: точные повторы — по file_unique_id, похожие —
+# по перцептивному хешу (нужен Pillow) с расстоянием не больше FRAUD_HASH_DISTANCE бит.
+# FRAUD_PHASH=0 оставляет только поиск точных повторов.
+FRAUD_PHASH = os.environ.get('FRAUD_PHASH', '1') == '1'
+FRAUD_HASH_DISTANCE = int(os.environ.get('FRAUD_HASH_DISTANCE', 6))
+
+# Как часто (в секундах) счетчики воронки из памяти сбрасываются в таблицу funnel_stats
+STATS_FLUSH_INTERVAL = float(os.environ.get('STATS_FLUSH_INTERVAL', 60))
 
 if not DATABASE_URL:
-    logging.error("❌ DATABASE_URL не найден в переменных окружения!")
-    logging.error("Пожалуйста, создайте базу данных PostgreSQL в Railway")
+    logging.warning(f"⚠️ DATABASE_URL не найден: заявки хранятся локально в SQLite ({SQLITE_PATH})")
     DATABASE_URL = None
 
 if not TOKEN:
     logging.error("❌ BOT_TOKEN не найден!")
     exit(1)
 
-# ===== БАЗА ДАННЫХ PostgreSQL =====
+# Вебхук у бота один: если каждый процесс придумает свой секрет, Telegram будет
+# присылать секрет последнего запущенного, и остальные начнут отвечать 403
+if MULTI_INSTANCE and BOT_MODE == 'webhook' and not os.environ.get('WEBHOOK_SECRET'):
+    logging.error("❌ При MULTI_INSTANCE=1 нужен общий для всех процессов WEBHOOK_SECRET!")
+    exit(1)
 
-def get_connection():
-    """Создание подключения к PostgreSQL"""
-    if not DATABASE_URL:
-        return None
-    try:
-        conn = psycopg2.connect(DATABASE_URL, sslmode='require')
-        return conn
-    except Exception as e:
-        logging.error(f"❌ Ошибка подключения к базе данных: {e}")
-        return None
+# ===== ХРАНИЛИЩЕ ЗАЯВОК =====
+
+# Размеры пула подключений
+DB_POOL_MIN = int(os.environ.get('DB_POOL_MIN', 1))
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', 10))
+# Railway принимает только SSL; для локального PostgreSQL — DB_SSLMODE=disable или prefer
+DB_SSLMODE = os.environ.get('DB_SSLMODE', 'require')
+
+# PostgreSQL, если задан DATABASE_URL, иначе встроенный SQLite (storage.py)
+storage = None
+
+def init_storage():
+    """Создание хранилища заявок (один раз при запуске)"""
+    global storage
+    if DATABASE_URL:
+        pool = DatabasePool(DATABASE_URL, minconn=DB_POOL_MIN, maxconn=DB_POOL_MAX, sslmode=DB_SSLMODE)
+        try:
+            pool.open()
+        except PoolUnavailableError as e:
+            # Пул переподключится сам при первом запросе
+            logging.error(f"❌ Ошибка подключения к базе данных: {e}")
+        storage = PostgresStorage(pool)
+    else:
+        storage = SQLiteStorage(SQLITE_PATH)
+    return storage
+
+def close_storage():
+    """Закрытие хранилища при остановке бота"""
+    global storage
+    if storage:
+        storage.close()
+        storage = None
 
 def init_db():
-    """Инициализация базы данных"""
-    conn = get_connection()
-    if not conn:
-        logging.warning("⚠️ База данных не доступна, работаем без нее")
+    """Инициализация хранилища: применение миграций схемы"""
+    if not storage:
+        logging.warning("⚠️ Хранилище не доступно, работаем без него")
         return
     
     try:
-        cur = conn.cursor()
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS applications (
-                id SERIAL PRIMARY KEY,
-                user_id BIGINT,
-                username TEXT,
-                full_name TEXT,
-                screenshot_file_id TEXT,
-                contact_info TEXT,
-                status TEXT DEFAULT 'pending',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE(user_id, status)  -- Защита от дублирования
-            )
-        ''')
-        conn.commit()
-        conn.close()
-        logging.info("✅ База данных PostgreSQL инициализирована")
+        version = storage.migrate()
+        logging.info(f"✅ Хранилище {storage.name} инициализировано (версия схемы {version})")
     except Exception as e:
         logging.error(f"❌ Ошибка инициализации базы данных: {e}")
 
-def add_application(user_id, username, full_name, screenshot_file_id, contact_info):
-    """Добавление новой заявки с защитой от дублирования"""
-    conn = get_connection()
-    if not conn:
+# ----- Журнал записей -----
+#
+# Если база недоступна, создание заявки и реквизиты пишутся в локальный
+# журнал (journal.py) и позже переносятся в базу пачками. Пока в журнале
+# есть записи, новые записи тоже идут в журнал — так сохраняется их порядок
+# (реквизиты не обгонят заявку, которая еще не попала в базу).
+
+# Результат перехода, отложенного в журнал: id заявки появится после переноса
+JOURNALED = 'journaled'
+
+journal = None
+
+def init_journal():
+    """Открытие журнала (один раз при запуске)"""
+    global journal
+    if JOURNAL_DIR:
+        journal = Journal(JOURNAL_DIR, segment_size=JOURNAL_SEGMENT_SIZE)
+    return journal
+
+def write_to_journal(record, user_id):
+    """Запись перехода в журнал; возвращает JOURNALED или False при ошибке диска"""
+    record['key'] = uuid.uuid4().hex
+    record['user_id'] = user_id
+    try:
+        journal.append(record)
+    except OSError as e:
+        logging.error(f"❌ Ошибка записи в журнал: {e}")
+        return False
+    return JOURNALED
+
+def should_journal(error):
+    """Ошибку можно пережить, отложив запись в журнал"""
+    return journal is not None and storage.is_transient(error)
+
+def replay_journal():
+    """Перенос журнала в базу (выполняется в пуле потоков БД)
+
+    Возвращает события для администратора по реквизитам, дошедшим до базы,
+    и пользователей перенесенных записей: их состояние подачи нужно определить
+    заново (запись могла не примениться, например если заявку уже рассмотрели).
+    """
+    applied = journal.replay(storage.apply_journal, JOURNAL_BATCH_SIZE)
+    events = []
+    for record, app_id in applied:
+        if record['op'] == 'contact' and app_id:
+            events.append(new_application_event(
+                app_id, record['user_id'], record['username'], record['full_name'], record['contact_info']
+            ))
+    if applied:
+        logging.info(f"✅ Из журнала в базу перенесено записей: {len(applied)}")
+    user_ids = {record['user_id'] for record, _app_id in applied}
+    broadcast_invalidation(user_ids)
+    return events, user_ids
+
+# ----- Несколько процессов -----
+#
+# При MULTI_INSTANCE изменения, после которых состояние подачи в других процессах устарело,
+# рассылаются им событиями (coordination.py). Без шины функции ничего не делают.
+
+# Выборы ведущего и шина событий, создаются при запуске бота (on_startup)
+leader = None
+event_bus = None
+
+def broadcast(event_type, **fields):
+    """Событие для остальных процессов; ошибка отправки не отменяет уже сделанную запись
+
+    Возвращает True, если событие отправлено.
+    """
+    if not event_bus:
+        return False
+    
+    try:
+        storage.publish(CHANNEL, event_bus.encode(event_type, **fields))
+    except Exception as e:
+        logging.error(f"❌ Ошибка отправки события {event_type} другим процессам: {e}")
+        return False
+    return True
+
+def broadcast_invalidation(user_ids, chunk=500):
+    """Сброс состояния подачи этих пользователей в других процессах"""
+    if not event_bus:
+        return
+    user_ids = list(user_ids)
+    for start in range(0, len(user_ids), chunk):
+        broadcast('invalidate', user_ids=user_ids[start:start + chunk])
+
+def claim_update(update_id):
+    """Отметка обновления: True — обрабатываем, None — его уже взял другой процесс, False — ошибка базы"""
+    try:
+        return True if storage.claim_update(update_id) else None
+    except Exception as e:
+        logging.error(f"❌ Ошибка отметки обновления {update_id}: {e}")
+        return False
+
+# ----- Переходы состояний заявки -----
+#
+# created → contact_added → approved / rejected
+#
+# В таблице created и contact_added — это status = 'pending' без реквизитов
+# и с реквизитами. Каждый переход — один атомарный запрос, который сам
+# проверяет текущее состояние, поэтому проверка и изменение не разделены
+# во времени и гонок «проверил, а потом записал» нет.
+#
+# Функции переходов возвращают результат RETURNING при успехе, None, если
+# переход из текущего состояния невозможен, и False при ошибке базы данных.
+
+STAGE_APPROVED = 'approved'
+STAGE_REJECTED = 'rejected'
+
+# Итоговый статус -> статус, из которого в него можно перейти
+FINAL_TRANSITIONS = {
+    STAGE_APPROVED: 'pending',
+    STAGE_REJECTED: 'pending',
+}
+
+def create_application(user_id, username, full_name, screenshot_file_id):
+    """Переход → created: новая заявка, если у пользователя нет ожидающей
+
+    Возвращает id новой заявки или JOURNALED, если заявка отложена в журнал.
+    """
+    if not storage:
         logging.info(f"📝 Заявка от {username} (без сохранения в БД)")
         return True
     
+    record = {
+        'op': 'create',
+        'username': username,
+        'full_name': full_name,
+        'screenshot_file_id': screenshot_file_id,
+        'created_at': datetime.now().isoformat(),
+    }
+    if journal and journal.backlog:
+        logging.info(f"📒 Заявка от {username} записана в журнал")
+        return write_to_journal(record, user_id)
+    
     try:
-        cur = conn.cursor()
-        
-        # Проверяем, есть ли уже активная заявка от этого пользователя
-        cur.execute('SELECT id FROM applications WHERE user_id = %s AND status = %s', (user_id, 'pending'))
-        existing_app = cur.fetchone()
-        
-        if existing_app:
-            logging.info(f"⚠️ У пользователя {username} уже есть активная заявка #{existing_app[0]}")
-            conn.close()
-            return False
-        
-        # Добавляем новую заявку
-        cur.execute('''
-            INSERT INTO applications (user_id, username, full_name, screenshot_file_id, contact_info)
-            VALUES (%s, %s, %s, %s, %s)
-        ''', (user_id, username, full_name, screenshot_file_id, contact_info))
-        conn.commit()
-        conn.close()
-        logging.info(f"✅ Заявка добавлена для пользователя {username}")
-        return True
-    except psycopg2.IntegrityError:
-        # Обрабатываем нарушение уникальности
-        conn.rollback()
-        conn.close()
-        logging.warning(f"⚠️ Попытка создания дублирующей заявки от {username}")
-        return False
+        app_id = storage.create_pending(user_id, username, full_name, screenshot_file_id)
     except Exception as e:
+        if should_journal(e):
+            logging.warning(f"⚠️ База недоступна ({e}), заявка от {username} записана в журнал")
+            return write_to_journal(record, user_id)
         logging.error(f"❌ Ошибка добавления заявки: {e}")
-        conn.close()
         return False
+    
+    if app_id is None:
+        logging.info(f"⚠️ У пользователя {username} уже есть активная заявка")
+        return None
+    broadcast_invalidation([user_id])
+    logging.info(f"✅ Заявка #{app_id} добавлена для пользователя {username}")
+    return app_id
 
-def get_pending_applications():
-    """Получение всех ожидающих заявок"""
-    conn = get_connection()
-    if not conn:
-        return []
+def attach_contact_info(user_id, contact_info, username=None, full_name=None):
+    """Переход created/contact_added → contact_added: сохранение реквизитов
+
+    Возвращает id заявки, в которую записаны реквизиты, или JOURNALED.
+    username и full_name нужны, чтобы уведомить администратора после переноса журнала.
+    """
+    if not storage:
+        return None
+    
+    record = {'op': 'contact', 'username': username, 'full_name': full_name, 'contact_info': contact_info}
+    if journal and journal.backlog:
+        return write_to_journal(record, user_id)
     
     try:
-        cur = conn.cursor()
-        cur.execute('SELECT * FROM applications WHERE status = %s ORDER BY created_at DESC', ('pending',))
-        applications = cur.fetchall()
-        conn.close()
-        return applications
+        app_id = storage.attach_contact(user_id, contact_info)
     except Exception as e:
-        logging.error(f"❌ Ошибка получения заявок: {e}")
-        return []
+        if should_journal(e):
+            logging.warning(f"⚠️ База недоступна ({e}), реквизиты записаны в журнал")
+            return write_to_journal(record, user_id)
+        logging.error(f"❌ Ошибка обновления реквизитов: {e}")
+        return False
+    
+    if app_id:
+        broadcast_invalidation([user_id])
+    return app_id
+
+def finalize_application(app_id, status):
+    """Переход pending → approved/rejected
 
-def get_all_applications():
-    """Получение всех заявок"""
-    conn = get_connection()
-    if not conn:
-        return []
+    Возвращает user_id владельца заявки, чтобы уведомить его без отдельного SELECT.
+    """
+    if status not in FINAL_TRANSITIONS:
+        raise ValueError(f"Недопустимый итоговый статус: {status}")
+    if not storage:
+        return False
     
     try:
-        cur = conn.cursor()
-        cur.execute('SELECT * FROM applications ORDER BY created_at DESC')
-        applications = cur.fetchall()
-        conn.close()
-        return applications
+        user_id = storage.set_status(app_id, status, FINAL_TRANSITIONS[status])
     except Exception as e:
-        logging.error(f"❌ Ошибка получения всех заявок: {e}")
-        return []
+        logging.error(f"❌ Ошибка обновления статуса: {e}")
+        return False
+    
+    if user_id is None:
+        logging.info(f"⚠️ Заявка #{app_id} не найдена или уже обработана")
+        return None
+    broadcast_invalidation([user_id])
+    logging.info(f"✅ Статус заявки #{app_id} изменен на {status}")
+    return user_id
+
+def finalize_applications(app_ids, status, older_than=None):
+    """Массовый переход pending → approved/rejected одним запросом
 
-def update_application_status(app_id, status):
-    """Обновление статуса заявки"""
-    conn = get_connection()
-    if not conn:
+    Обрабатывает заявки из app_ids или, если передан older_than (timedelta),
+    все ожидающие заявки старше этого срока. Возвращает список (id, user_id)
+    реально измененных заявок или False при ошибке базы данных.
+    """
+    if status not in FINAL_TRANSITIONS:
+        raise ValueError(f"Недопустимый итоговый статус: {status}")
+    if not storage:
         return False
     
     try:
-        cur = conn.cursor()
-        cur.execute('UPDATE applications SET status = %s WHERE id = %s', (status, app_id))
-        conn.commit()
-        conn.close()
-        logging.info(f"✅ Статус заявки #{app_id} изменен на {status}")
-        return True
+        rows = storage.set_status_many(app_ids, status, FINAL_TRANSITIONS[status], older_than)
     except Exception as e:
-        logging.error(f"❌ Ошибка обновления статуса: {e}")
+        logging.error(f"❌ Ошибка массового обновления статуса: {e}")
         return False
+    
+    broadcast_invalidation(user_id for _app_id, user_id in rows)
+    logging.info(f"✅ Статус {len(rows)} заявок изменен на {status}")
+    return rows
+
+def get_pending_page(cursor=None, direction='next', limit=10):
+    """Страница ожидающих заявок (keyset-пагинация по created_at, id)
+
+    cursor — (created_at, id) последней заявки предыдущей страницы при
+    direction='next' или первой заявки следующей страницы при direction='prev'.
+    Возвращает (заявки, есть_еще_в_этом_направлении, всего_ожидающих); False при ошибке.
+    """
+    if not storage:
+        return [], False, 0
+    
+    try:
+        return storage.pending_page(cursor, direction, limit)
+    except Exception as e:
+        logging.error(f"❌ Ошибка получения страницы заявок: {e}")
+        return False
+
+def search_applications(text, offset=0, limit=10):
+    """Поиск заявок для /find: (страница заявок, всего найдено); False при ошибке"""
+    if not storage:
+        return [], 0
+    
+    try:
+        return storage.search(text, limit, offset)
+    except Exception as e:
+        logging.error(f"❌ Ошибка поиска заявок: {e}")
+        return False
+
+def iter_applications_with_screenshots(status=None, date_from=None, date_to=None, batch_size=10):
+    """Поток заявок со скриншотами пачками по batch_size
+
+    Строки читаются через серверный курсор, поэтому в памяти одновременно
+    находится только одна пачка. date_to не включается в интервал.
+    """
+    if not storage:
+        return
+    
+    try:
+        yield from storage.iter_with_screenshots(status, date_from, date_to, batch_size)
+    except Exception as e:
+        logging.error(f"❌ Ошибка чтения заявок со скриншотами: {e}")
 
 def get_application_by_user_id(user_id):
-    """Получение заявки по user_id"""
-    conn = get_connection()
-    if not conn:
+    """Ожидающая заявка пользователя: строка, None, если ее нет, или False при ошибке базы"""
+    if not storage:
         return None
     
     try:
-        cur = conn.cursor()
-        cur.execute('SELECT * FROM applications WHERE user_id = %s AND status = %s', (user_id, 'pending'))
-        application = cur.fetchone()
-        conn.close()
-        return application
+        return storage.pending_by_user(user_id)
     except Exception as e:
         logging.error(f"❌ Ошибка поиска заявки: {e}")
-        return None
+        return False
 
 def get_application_by_id(app_id):
     """Получение заявки по ID"""
-    conn = get_connection()
-    if not conn:
+    if not storage:
         return None
     
     try:
-        cur = conn.cursor()
-        cur.execute('SELECT * FROM applications WHERE id = %s', (app_id,))
-        application = cur.fetchone()
-        conn.close()
-        return application
+        return storage.by_id(app_id)
     except Exception as e:
         logging.error(f"❌ Ошибка поиска заявки по ID: {e}")
         return None
 
-# ===== ОСНОВНЫЕ ФУНКЦИИ БОТА =====
+# ----- Повторно использованные скриншоты -----
 
-async def start(update: Update, context: CallbackContext) -> None:
-    user = update.effective_user
+# Индекс хешей скриншотов в памяти, заполняется при запуске (load_screenshot_index)
+screenshot_index = None
+
+def load_screenshot_index():
+    """Загрузка хешей скриншотов из базы в BK-дерево"""
+    global screenshot_index
+    if not storage or not FRAUD_PHASH:
+        return None
+    if fraud.Image is None:
+        logging.warning("⚠️ Pillow не установлен: ищем только точные повторы скриншотов")
+        return None
+    index = fraud.ScreenshotIndex(max_distance=FRAUD_HASH_DISTANCE)
+    try:
+        index.load(storage.screenshot_hashes())
+    except Exception as e:
+        logging.error(f"❌ Ошибка загрузки хешей скриншотов: {e}")
+        return None
+    screenshot_index = index
+    logging.info(f"✅ Индекс скриншотов загружен: {len(index)} хешей")
+    return index
+
+def register_screenshot(file_unique_id, app_id):
+    """Запоминание файла скриншота заявки
+
+    Возвращает id более ранней заявки с тем же файлом, None для нового
+    файла и False при ошибке базы данных.
+    """
+    if not storage:
+        return None
     
-    welcome_text = f"""
-👋 Привет, {user.first_name}!
+    try:
+        first_app_id = storage.register_screenshot(file_unique_id, app_id)
+    except Exception as e:
+        logging.error(f"❌ Ошибка проверки скриншота: {e}")
+        return False
+    return first_app_id if first_app_id != app_id else None
 
-Я помогаю получить 1000 рублей за оформление карты T-Bank Black.
+def save_screenshot_hash(file_unique_id, phash, app_id=None):
+    if not storage:
+        return
+    
+    try:
+        storage.set_screenshot_hash(file_unique_id, fraud.to_signed(phash))
+    except Exception as e:
+        logging.error(f"❌ Ошибка сохранения хеша скриншота: {e}")
+        return
+    # Другие процессы добавят хеш в свои индексы похожих скриншотов
+    broadcast('screenshot_hash', phash=fraud.to_signed(phash), app_id=app_id)
 
-💰 *Как это работает:*
-• Ты получаешь 500₽ от банка за оформление карты
-• Плюс 500₽ от меня после первой покупки
-• Итого: 1000₽ на руки!
+def mark_duplicate(app_id, duplicate_of):
+    if not storage:
+        return
+    
+    try:
+        storage.mark_duplicate(app_id, duplicate_of)
+    except Exception as e:
+        logging.error(f"❌ Ошибка отметки повтора заявки: {e}")
 
-📋 *Прежде чем начать, ознакомься с условиями нашего сотрудничества:*
+def run_retention():
+    """Перенос завершенных заявок в архив пачками и удаление старого архива
+
+    Каждая пачка — отдельная транзакция, поэтому рабочая таблица не
+    блокируется надолго. Возвращает число перенесенных заявок.
     """
+    if not storage:
+        return 0
     
-    keyboard = [
-        [InlineKeyboardButton("📄 Показать условия", callback_data='show_terms')],
-        [InlineKeyboardButton("💬 Поддержка", url=f'https://t.me/{SUPPORT_USERNAME[1:]}')]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    now = datetime.now()
+    cutoff = now - timedelta(days=RETENTION_DAYS)
+    storage.prepare_archive(cutoff)
+    moved = 0
+    while True:
+        count = storage.archive_batch(cutoff, RETENTION_BATCH_SIZE, RETENTION_MODE == 'anonymize')
+        moved += count
+        if count < RETENTION_BATCH_SIZE:
+            break
+    if moved:
+        logging.info(f"🗄 В архив перенесено заявок: {moved}")
     
-    await update.message.reply_text(welcome_text, reply_markup=reply_markup, parse_mode='Markdown')
+    if ARCHIVE_RETENTION_MONTHS:
+        dropped = storage.purge_archive(add_months(month_start(now), -ARCHIVE_RETENTION_MONTHS))
+        if dropped:
+            logging.info(f"🗑 Удален старый архив: {', '.join(dropped)}")
+    return moved
 
-async def show_terms(update: Update, context: CallbackContext) -> None:
-    query = update.callback_query
-    await query.answer()
+# ----- Статистика воронки -----
+
+# Счетчики событий, накопленные с последнего сброса в базу
+funnel = FunnelCounters()
+
+def flush_funnel_stats():
+    """Сброс накопленных счетчиков в базу одной пачкой; при ошибке они остаются в памяти"""
+    items = funnel.drain()
+    if not items or not storage:
+        funnel.restore(items)
+        return 0
     
-    terms_text = """
-🔒 *Политика конфиденциальности:*
-• Мы НЕ передаем ваши личные данные третьим лицам
-• Мы НЕ используем вашу информацию в корыстных целях
-• Ваш username, фамилия имя и реквизиты для выплаты используются *исключительно* для учета выплат
-• Все данные удаляются после завершения наших обязательств
-
-*✅ Условия сотрудничества*
-
-*Нажимая «Я согласен», вы подтверждаете, что:*
-
-1. *Действуете добровольно* — мы ни к чему не принуждаем
-2. *Ознакомились с условиями акции банка* на официальном сайте (https://acdn.t-static.ru/static/documents/promo-baf-common.pdf)
-3. *Понимаете что:* 
-   - Вы получаете 1000₽ (500₽ от банка + 500₽ от меня)
-   - Я получаю 1000₽ от банка за ваше приглашение
-4. *Осознаете,* что это частное предложение, а не оферта банка
-5. *Соглашаетесь* на обработку username и ваших реквезитов для учета выплат
-6. *Знаете,* что выплата от меня происходит только после успешного выполнения всех условий акции в течении 7 дней.
-7. *Гарантируем конфиденциальность:* 
-   - Ваши данные (username, реквизиты, ФИ) не передаются третьим лицам
-   - Информация не используется в корыстных или мошеннических целях
-   - Данные хранятся только для учета выплат и удаляются после выполнения обязательств
-
-💡 *Это взаимовыгодное сотрудничество в рамках акции банка, где каждый получает свою выгоду.* 
+    try:
+        storage.add_funnel_stats(rollup(items))
+    except Exception as e:
+        funnel.restore(items)
+        logging.error(f"❌ Ошибка сохранения статистики воронки: {e}")
+        return False
+    return len(items)
+
+def get_funnel_stats():
+    """Счетчики воронки по окнам /stats: {окно: {событие: число}} вместе с еще не сброшенными"""
+    if not storage:
+        return False
+    
+    try:
+        result = {}
+        for window, (period, since) in windows(datetime.now()).items():
+            totals = storage.funnel_totals(period, since)
+            for event, count in funnel.pending(since).items():
+                totals[event] = totals.get(event, 0) + count
+            result[window] = totals
+        return result
+    except Exception as e:
+        logging.error(f"❌ Ошибка чтения статистики воронки: {e}")
+        return False
+
+def export_applications_to_file(fmt=FORMAT_CSV, status=None, date_from=None, date_to=None):
+    """Потоковая выгрузка заявок во временный файл
+
+    Возвращает (путь к файлу, число строк или None) либо None при ошибке.
+    Файл удаляет вызывающий.
     """
+    if not storage:
+        return None
     
-    keyboard = [
-        [InlineKeyboardButton("✅ Я согласен со всеми условиями", callback_data='get_link')],
-        [InlineKeyboardButton("🔙 Назад", callback_data='back_to_start')]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    fd, path = tempfile.mkstemp(prefix='applications-', suffix=f'.{fmt}')
+    try:
+        with os.fdopen(fd, 'w', newline='', encoding='utf-8') as out:
+            count = export_applications(storage, out, fmt, status, date_from, date_to)
+    except Exception as e:
+        logging.error(f"❌ Ошибка выгрузки заявок: {e}")
+        os.remove(path)
+        return None
+    return path, count
+
+# ===== АСИНХРОННЫЙ ДОСТУП К БАЗЕ ДАННЫХ =====
+
+# psycopg2 блокирует поток, поэтому запросы выполняются в отдельном пуле потоков.
+# Потоков столько же, сколько подключений в пуле: лишние запросы ждут в очереди
+# исполнителя, а не занимают event loop.
+DB_WORKERS = int(os.environ.get('DB_WORKERS', DB_POOL_MAX))
+
+db_executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix='db')
+
+async def run_db(func, *args, **kwargs):
+    """Выполнение синхронной функции работы с БД в пуле потоков
+
+    Контекстные переменные вызывающей задачи видны и в потоке исполнителя.
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(db_executor, functools.partial(context.run, func, *args, **kwargs))
+
+def awaitable(func):
+    """Асинхронный вариант функции работы с БД (с замером времени в метриках)"""
+    timed = instrument_db(func)
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run_db(timed, *args, **kwargs)
+    return wrapper
+
+async def iterate_db(generator_func, *args, **kwargs):
+    """Асинхронный обход генератора, читающего из БД, в пуле потоков"""
+    generator = generator_func(*args, **kwargs)
+    fetch = instrument_db(next, name=generator_func.__name__)
+    try:
+        while True:
+            batch = await run_db(fetch, generator, None)
+            if batch is None:
+                break
+            yield batch
+    finally:
+        # Закрываем генератор в том же пуле: это вернет подключение в пул
+        await run_db(generator.close)
+
+create_application_async = awaitable(create_application)
+attach_contact_info_async = awaitable(attach_contact_info)
+finalize_application_async = awaitable(finalize_application)
+finalize_applications_async = awaitable(finalize_applications)
+get_pending_page_async = awaitable(get_pending_page)
+search_applications_async = awaitable(search_applications)
+get_application_by_user_id_async = awaitable(get_application_by_user_id)
+get_application_by_id_async = awaitable(get_application_by_id)
+export_applications_to_file_async = awaitable(export_applications_to_file)
+register_screenshot_async = awaitable(register_screenshot)
+save_screenshot_hash_async = awaitable(save_screenshot_hash)
+mark_duplicate_async = awaitable(mark_duplicate)
+claim_update_async = awaitable(claim_update)
+get_funnel_stats_async = awaitable(get_funnel_stats)
+
+# ===== ОТПРАВКА СООБЩЕНИЙ =====
+
+# Очередь исходящих сообщений, создается при запуске бота (on_startup).
+# Все send_message/send_photo идут через нее, чтобы не упираться в лимиты Telegram.
+sender = None
+
+# ===== УВЕДОМЛЕНИЯ АДМИНИСТРАТОРА =====
+
+# Уведомления о новых заявках: создаются при запуске бота (on_startup)
+admin_notifier = None
+
+def new_application_event(app_id, user_id, username, full_name, contact_info):
+    """Событие «новая заявка» для уведомления администратора"""
+    return {
+        'app_id': app_id,
+        'user_id': user_id,
+        'username': username,
+        'full_name': full_name,
+        'contact_info': contact_info,
+        'time': datetime.now(),
+    }
+
+async def deliver_admin_notifications(events) -> None:
+    """Отправка администратору одной заявки подробно или нескольких дайджестом"""
+    if len(events) == 1:
+        event = events[0]
+        await sender.send_message(
+            chat_id=ADMIN_ID,
+            text=catalog.text('admin_new_application', **event),
+            parse_mode=PARSE_MODE,
+            reply_markup=InlineKeyboardMarkup([[
+                InlineKeyboardButton("📸 Посмотреть скриншот", callback_data=f"view_screenshot_{event['app_id']}"),
+                InlineKeyboardButton("✅ Одобрить", callback_data=f"approve_{event['app_id']}")
+            ]])
+        )
+        return
     
-    await query.edit_message_text(terms_text, reply_markup=reply_markup, parse_mode='Markdown')
+    # Дайджест без разметки: в именах и реквизитах бывают _ и *
+    lines = [f"🚨 НОВЫЕ ЗАЯВКИ: {len(events)}"]
+    keyboard = []
+    for event in events:
+        lines.append(
+            f"\n📋 #{event['app_id']} — {event['time'].strftime('%H:%M:%S')}\n"
+            f"👤 {event['full_name']} (@{event['username']}), 🆔 {event['user_id']}\n"
+            f"📞 {event['contact_info']}"
+        )
+        keyboard.append([
+            InlineKeyboardButton(f"📸 #{event['app_id']}", callback_data=f"view_screenshot_{event['app_id']}_digest"),
+            InlineKeyboardButton(f"✅ #{event['app_id']}", callback_data=f"approve_{event['app_id']}_digest"),
+        ])
+    await sender.send_message(
+        chat_id=ADMIN_ID,
+        text="\n".join(lines)[:4096],
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
 
-async def get_link(update: Update, context: CallbackContext) -> None:
-    query = update.callback_query
-    await query.answer()
+# ===== ПЕРЕНОС ЖУРНАЛА В БАЗУ =====
+
+# Фоновая задача переноса журнала, создается при запуске бота (on_startup)
+journal_task = None
+
+async def replay_journal_periodically(application: Application) -> None:
+    """Раз в JOURNAL_REPLAY_INTERVAL секунд переносит накопленный журнал в базу"""
+    while True:
+        await asyncio.sleep(JOURNAL_REPLAY_INTERVAL)
+        if not journal.backlog:
+            continue
+        try:
+            events, user_ids = await run_db(replay_journal)
+        except Exception as e:
+            logging.warning(f"⚠️ Журнал пока не перенесен в базу ({journal.backlog} записей): {e}")
+            continue
+        forget_submissions(application, user_ids)
+        for event in events:
+            notify_admin(application, event)
+
+# ===== ХРАНЕНИЕ И АРХИВАЦИЯ =====
+
+async def retention_job(context: CallbackContext) -> None:
+    """Периодическая задача JobQueue: архивация завершенных заявок (только в ведущем процессе)"""
+    if not is_leader():
+        return
+    try:
+        await run_db(run_retention)
+    except Exception as e:
+        logging.error(f"❌ Ошибка архивации заявок: {e}")
+    if MULTI_INSTANCE:
+        try:
+            await run_db(storage.purge_processed_updates, datetime.now() - timedelta(hours=PROCESSED_UPDATES_TTL))
+        except Exception as e:
+            logging.error(f"❌ Ошибка очистки отметок обновлений: {e}")
+
+# ===== СТАТИСТИКА ВОРОНКИ =====
+
+async def stats_flush_job(context: CallbackContext) -> None:
+    """Периодическая задача JobQueue: сброс счетчиков воронки в базу"""
+    await run_db(flush_funnel_stats)
+
+# ===== НЕСКОЛЬКО ПРОЦЕССОВ =====
+
+# Фоновая задача выборов ведущего, создается при запуске бота (on_startup)
+leader_task = None
+
+def is_leader():
+    """Разовые задачи выполняет ведущий; единственный процесс ведущий всегда"""
+    return leader is None or leader.is_leader
+
+async def elect_leader_periodically(application: Application) -> None:
+    """Раз в LEADER_CHECK_INTERVAL секунд пробует стать ведущим или проверяет, что им остался"""
+    while True:
+        was_leader = leader.is_leader
+        if await run_db(leader.poll) and not was_leader and BOT_MODE == 'webhook' and WEBHOOK_URL:
+            # Вебхук регистрирует только ведущий: остальные процессы его не трогают
+            try:
+                await register_webhook(application.bot)
+            except Exception as e:
+                logging.error(f"❌ Ошибка регистрации вебхука: {e}")
+        await asyncio.sleep(LEADER_CHECK_INTERVAL)
+
+def notify_admin(application: Application, event) -> None:
+    """Новая заявка для администратора: дайджест собирает ведущий, остальные пересылают ему
+
+    Пересылка идет в фоне, ответ пользователю ее не ждет. Если ведущего
+    сейчас нет или переслать не удалось, процесс уведомляет администратора сам:
+    лучше отдельное сообщение мимо дайджеста, чем потерянная заявка.
+    """
+    if is_leader() or not leader.leader_known:
+        admin_notifier.notify(event)
+    else:
+        application.create_task(forward_admin_event(event))
+
+async def forward_admin_event(event) -> None:
+    """Пересылка события ведущему (фоновая задача notify_admin)"""
+    if not await run_db(broadcast, 'admin_event', event=event):
+        admin_notifier.notify(event)
+
+def event_handlers(application):
+    """Обработчики событий от других процессов (вызываются в event loop)"""
+    def on_invalidate(event):
+        forget_submissions(application, event['user_ids'])
+    
+    def on_screenshot_hash(event):
+        if screenshot_index is not None:
+            screenshot_index.load([(event['phash'], event['app_id'])])
+    
+    def on_admin_event(event):
+        # Событие получают все процессы, в дайджест его добавляет только ведущий
+        if is_leader() and admin_notifier:
+            notification = event['event']
+            notification['time'] = datetime.fromisoformat(notification['time'])
+            admin_notifier.notify(notification)
     
-    instruction_text = f"""
-🎉 Отлично! Вот ваша ссылка для оформления:
+    def on_reconnect():
+        # Пока подписки не было, события могли потеряться — состояния определятся заново
+        forget_submissions(application, list(application.user_data))
+    
+    handlers = {
+        'invalidate': on_invalidate,
+        'screenshot_hash': on_screenshot_hash,
+        'admin_event': on_admin_event,
+    }
+    return handlers, on_reconnect
 
-{REF_LINK}
+async def dedupe_update(update: Update, context: CallbackContext) -> None:
+    """Группа -2: обновление, уже взятое другим процессом (повторная доставка), дальше не идет
 
-*Инструкция:*
-1. *Оформите карту* по ссылке выше
-2. *Совершите покупку* от 500₽ (НЕ: ЖКХ, связь, переводы)
-3. *Пришлите скриншот* подтверждения покупки в этот чат
-4. *Получите 500₽* от меня в течение 7 дней (обычно это занимает до 24 часов) после проверки📸 
+    Проверка идет до входящего лимита: повторная доставка не должна тратить
+    токены пользователя и второй раз отправлять ему предупреждение.
     """
+    # При ошибке базы обновление обрабатывается: лучше редкий повтор, чем потерянное сообщение
+    if await claim_update_async(update.update_id) is None:
+        logging.info(f"🔁 Обновление {update.update_id} уже обработано другим процессом")
+        raise ApplicationHandlerStop
+
+# ===== МЕТРИКИ =====
+
+# Сервер /metrics для режима polling (в режиме вебхука метрики отдает сервер вебхука)
+metrics_server = None
+
+def pool_connections():
+    pool = getattr(storage, 'pool', None)
+    stats = pool.stats() if pool else {'in_use': 0, 'idle': 0}
+    return {('in_use',): stats['in_use'], ('idle',): stats['idle']}
+
+metrics.registry.register(CallbackMetric(
+    'bot_db_pool_connections', 'Подключения пула PostgreSQL', pool_connections, ['state']))
+metrics.registry.register(CallbackMetric(
+    'bot_outbound_queue_depth', 'Исходящие сообщения в очереди и в отправке',
+    lambda: sender.depth if sender else 0))
+metrics.registry.register(CallbackMetric(
+    'bot_admin_digest_pending', 'Заявки, ожидающие дайджеста администратору',
+    lambda: admin_notifier.pending if admin_notifier else 0))
+metrics.registry.register(CallbackMetric(
+    'bot_journal_backlog', 'Записи журнала, ожидающие переноса в базу',
+    lambda: journal.backlog if journal else 0))
+metrics.registry.register(CallbackMetric(
+    'bot_leader', 'Процесс выполняет разовые задачи (1 — ведущий)', lambda: int(is_leader())))
+
+# ===== ВХОДЯЩИЙ ЛИМИТ =====
+
+inbound_limiter = InboundLimiter(INBOUND_RATE, INBOUND_BURST, INBOUND_MAX_USERS) if INBOUND_RATE > 0 else None
+
+metrics.registry.register(CallbackMetric(
+    'bot_inbound_dropped_total', 'Входящие обновления, отброшенные лимитом',
+    lambda: inbound_limiter.dropped if inbound_limiter is not None else 0, type='counter'))
+metrics.registry.register(CallbackMetric(
+    'bot_inbound_tracked_users', 'Пользователи с корзиной входящего лимита',
+    lambda: len(inbound_limiter) if inbound_limiter is not None else 0))
+
+async def throttle_inbound(update: Update, context: CallbackContext) -> None:
+    """Группа -1: отбрасывает обновления сверх лимита пользователя, остальные группы их не видят"""
+    user = update.effective_user
+    if user is None or user.id == ADMIN_ID:
+        return
     
-    keyboard = [
-        [InlineKeyboardButton("📱 Я оформил карту и совершил покупку", callback_data='instruction')],
-        [InlineKeyboardButton("💬 Поддержка", url=f'https://t.me/{SUPPORT_USERNAME[1:]}')],
-        [InlineKeyboardButton("🔙 Назад", callback_data='show_terms')]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    allowed, warn = inbound_limiter.check(user.id)
+    if allowed:
+        return
+    if warn and update.effective_chat:
+        # Одно предупреждение на серию; отправка через очередь, обработчик ее не ждет
+        sender.send_message(
+            chat_id=update.effective_chat.id,
+            text=catalog.text('too_many_messages', user.language_code),
+            parse_mode=PARSE_MODE
+        )
+    if update.callback_query:
+        # Без ответа у пользователя крутятся часики на кнопке
+        await update.callback_query.answer()
+    raise ApplicationHandlerStop
+
+# ===== ТЕКСТЫ И КЛАВИАТУРЫ =====
+
+# Шаблоны всех языков загружаются и собираются один раз при импорте (rendering.py)
+catalog = Catalog(
+    LOCALES_DIR,
+    default=DEFAULT_LOCALE,
+    ref_link=REF_LINK,
+    support_url=f'https://t.me/{SUPPORT_USERNAME[1:]}',
+)
+
+async def reply_screen(message, name, language_code=None, **fields):
+    """Ответ на сообщение шаблоном name на языке пользователя"""
+    screen = catalog.render(name, language_code, **fields)
+    return await message.reply_text(screen.text, reply_markup=screen.reply_markup, parse_mode=PARSE_MODE)
+
+async def edit_screen(query, name, **fields):
+    """Замена сообщения с нажатой кнопкой шаблоном name на языке пользователя"""
+    screen = catalog.render(name, query.from_user.language_code, **fields)
+    return await query.edit_message_text(screen.text, reply_markup=screen.reply_markup, parse_mode=PARSE_MODE)
+
+# ===== ОСНОВНЫЕ ФУНКЦИИ БОТА =====
+
+async def start(update: Update, context: CallbackContext) -> None:
+    user = update.effective_user
+    funnel.bump('start')
     
-    await query.edit_message_text(instruction_text, reply_markup=reply_markup, parse_mode='Markdown')
+    await reply_screen(update.message, 'start', user.language_code, first_name=user.first_name)
 
-async def instruction(update: Update, context: CallbackContext) -> None:
+async def show_terms(update: Update, context: CallbackContext) -> None:
     query = update.callback_query
     await query.answer()
+    funnel.bump('show_terms')
     
-    instruction_text = """
-*Для получения 500₽ пришлите сюда:*
-1. *Скриншот* из приложения банка, подтверждающий покупку
-2. *Инициалы* (фамилия, имя) и *Ваши реквизиты* для перевода (номер карты/телефона)
-
-🕐 *Выплата производится в течение 7 дней* после проверки.
+    await edit_screen(query, 'terms')
 
-❓ *Что должно быть видно на скриншоте:*
-- Дата и время операции
-- Сумма покупки (от 500₽)
-- Не видно конфиденциальных данных (замажьте CVV, полный номер карты)
-    """
+async def get_link(update: Update, context: CallbackContext) -> None:
+    query = update.callback_query
+    await query.answer()
+    funnel.bump('get_link')
     
-    keyboard = [
-        [InlineKeyboardButton("💬 Поддержка", url=f'https://t.me/{SUPPORT_USERNAME[1:]}')],
-        [InlineKeyboardButton("🔙 Назад", callback_data='get_link')]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    await edit_screen(query, 'link')
+
+async def instruction(update: Update, context: CallbackContext) -> None:
+    query = update.callback_query
+    await query.answer()
+    funnel.bump('instruction')
     
-    await query.edit_message_text(instruction_text, reply_markup=reply_markup, parse_mode='Markdown')
+    await edit_screen(query, 'instruction')
 
 async def back_to_start(update: Update, context: CallbackContext) -> None:
     query = update.callback_query
     await query.answer()
     
-    user = query.from_user
-    welcome_text = f"""
-👋 Привет, {user.first_name}!
+    await edit_screen(query, 'start', first_name=query.from_user.first_name)
+
+# ===== ОБРАБОТЧИК СКРИНШОТОВ И ДАННЫХ =====
+
+# Подача заявки — конечный автомат в context.user_data['submission']:
+# awaiting_screenshot → awaiting_contact → submitted. Что делать с сообщением,
+# решается по состоянию в памяти; база по-прежнему атомарно проверяет каждый
+# переход, поэтому устаревшее состояние не ломает данные, а только исправляется.
+SUBMISSION_AWAITING_SCREENSHOT = 'awaiting_screenshot'
+SUBMISSION_AWAITING_CONTACT = 'awaiting_contact'
+SUBMISSION_SUBMITTED = 'submitted'
 
-Я помогаю получить 1000 рублей за оформление карты T-Bank Black.
+# Обращения к состоянию подачи: найдено в памяти или пришлось идти в базу
+submission_lookups = {'hit': 0, 'miss': 0}
+submissions_evicted = 0
 
-💰 *Как это работает:*
-• Ты получаешь 500₽ от банка за оформление карты
-• Плюс 500₽ от меня после первой покупки
-• Итого: 1000₽ на руки!
+metrics.registry.register(CallbackMetric(
+    'bot_submission_lookups_total', 'Обращения к состоянию подачи: hit — из памяти, miss — по базе',
+    lambda: {(result,): count for result, count in submission_lookups.items()}, ['result'], type='counter'))
+metrics.registry.register(CallbackMetric(
+    'bot_submission_evicted_total', 'Состояния подачи, вытесненные по времени или размеру',
+    lambda: submissions_evicted, type='counter'))
 
-📋 *Прежде чем начать, ознакомься с условиями нашего сотрудничества:*
+def set_submission(user_data, state):
+    """Запомнить состояние подачи вместе со временем обращения (для вытеснения)"""
+    user_data['submission'] = state
+    user_data['submission_at'] = time.time()
+
+def clear_submission(user_data):
+    """Забыть состояние подачи; возвращает True, если оно было"""
+    user_data.pop('submission_at', None)
+    return user_data.pop('submission', None) is not None
+
+async def submission_state(user_data, user_id):
+    """Состояние подачи заявки; у пользователя без сохраненного состояния — один раз по базе
+
+    Если база не ответила, возвращает None и ничего не запоминает: сообщение
+    обрабатывается без подсказки состояния, переход проверит сама база.
     """
+    state = user_data.get('submission')
+    if state is not None:
+        submission_lookups['hit'] += 1
+        user_data['submission_at'] = time.time()
+        return state
     
-    keyboard = [
-        [InlineKeyboardButton("📄 Показать условия", callback_data='show_terms')],
-        [InlineKeyboardButton("💬 Поддержка", url=f'https://t.me/{SUPPORT_USERNAME[1:]}')]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    await query.edit_message_text(welcome_text, reply_markup=reply_markup, parse_mode='Markdown')
+    submission_lookups['miss'] += 1
+    app = await get_application_by_user_id_async(user_id)
+    if app is False:
+        return None
+    if app is None:
+        state = SUBMISSION_AWAITING_SCREENSHOT
+    else:
+        state = SUBMISSION_SUBMITTED if app[5] else SUBMISSION_AWAITING_CONTACT
+    set_submission(user_data, state)
+    return state
 
-# ===== ОБРАБОТЧИК СКРИНШОТОВ И ДАННЫХ =====
+def reset_submission(application, user_id):
+    """После решения по заявке пользователь снова может прислать скриншот"""
+    user_data = application.user_data.get(user_id)
+    if user_data is not None:
+        set_submission(user_data, SUBMISSION_AWAITING_SCREENSHOT)
+        application.mark_data_for_update_persistence(user_ids=user_id)
+
+def forget_submissions(application, user_ids):
+    """Состояние подачи устарело: при следующем сообщении оно определится по базе"""
+    forgotten = []
+    for user_id in user_ids:
+        user_data = application.user_data.get(user_id)
+        if user_data and clear_submission(user_data):
+            forgotten.append(user_id)
+    # Иначе после перезапуска старое состояние вернулось бы из файла
+    if forgotten:
+        application.mark_data_for_update_persistence(user_ids=forgotten)
+
+async def evict_submissions_job(context: CallbackContext) -> None:
+    """Периодическая задача JobQueue: вытеснение давно не нужных состояний подачи
+
+    PTB заводит user_data каждому, кто писал боту, и сам их не удаляет —
+    без вытеснения память и файл состояния росли бы без предела.
+    Пустые записи удаляются сразу.
+    """
+    global submissions_evicted
+    application = context.application
+    touched = {}
+    for user_id, user_data in list(application.user_data.items()):
+        if 'submission' in user_data:
+            touched[user_id] = user_data.get('submission_at', 0)
+        elif not user_data:
+            application.drop_user_data(user_id)
+    
+    evicted = idle_keys(touched, SUBMISSION_TTL, SUBMISSION_MAX_USERS, time.time())
+    for user_id in evicted:
+        user_data = application.user_data[user_id]
+        clear_submission(user_data)
+        if user_data:
+            application.mark_data_for_update_persistence(user_ids=user_id)
+        else:
+            application.drop_user_data(user_id)
+    if evicted:
+        submissions_evicted += len(evicted)
+        logging.info(f"🧹 Вытеснено состояний подачи: {len(evicted)}, осталось {len(touched) - len(evicted)}")
 
 async def handle_screenshot(update: Update, context: CallbackContext) -> None:
     user = update.effective_user
     message = update.message
+    state = await submission_state(context.user_data, user.id)
     
     # Обрабатываем скриншот (фото)
     if message.photo:
         screenshot_file_id = message.photo[-1].file_id
         
-        # Проверяем, нет ли уже активной заявки
-        existing_app = get_application_by_user_id(user.id)
-        if existing_app:
-            await message.reply_text("❌ У вас уже есть активная заявка. Дождитесь ее проверки.")
+        if state == SUBMISSION_AWAITING_CONTACT:
+            await reply_screen(message, 'screenshot_already_received', user.language_code)
+            return
+        
+        # Заявка с реквизитами уже ждет проверки — в базу не идем
+        if state == SUBMISSION_SUBMITTED:
+            await reply_screen(message, 'application_active', user.language_code)
             return
         
-        # Сохраняем в базе данных
-        success = add_application(user.id, user.username, user.full_name, screenshot_file_id, None)
+        # Сохраняем в базе данных (заявка не создается, если уже есть активная)
+        app_id = await create_application_async(user.id, user.username, user.full_name, screenshot_file_id)
         
-        if success:
-            await message.reply_text("✅ Скриншот получен! Теперь отправьте ваши реквизиты для перевода (номер карты или телефона).")
+        if app_id is None:
+            # Состояние разошлось с базой — при следующем сообщении оно определится заново
+            clear_submission(context.user_data)
+            await reply_screen(message, 'application_active', user.language_code)
+        elif app_id is False:
+            await reply_screen(message, 'application_save_failed', user.language_code)
         else:
-            await message.reply_text("❌ Не удалось сохранить вашу заявку. Попробуйте позже или обратитесь в поддержку.")
+            set_submission(context.user_data, SUBMISSION_AWAITING_CONTACT)
+            funnel.bump('screenshot')
+            await reply_screen(message, 'screenshot_received', user.language_code)
+            # Проверка на повторное использование идет в фоне (у заявки из журнала еще нет id)
+            if app_id is not JOURNALED:
+                context.application.create_task(check_screenshot(app_id, user, message.photo))
     
     # Обрабатываем текст (реквизиты)
     elif message.text and not message.text.startswith('/'):
         contact_info = message.text
         
-        # Ищем активную заявку пользователя
-        existing_app = get_application_by_user_id(user.id)
+        # Без скриншота реквизиты некуда записать — база не нужна
+        if state == SUBMISSION_AWAITING_SCREENSHOT:
+            await reply_screen(message, 'screenshot_first', user.language_code)
+            return
+        
+        # Записываем реквизиты в активную заявку пользователя
+        app_id = await attach_contact_info_async(user.id, contact_info, user.username, user.full_name)
         
-        if not existing_app:
-            await message.reply_text("❌ Сначала отправьте скриншот подтверждения покупки.")
+        if app_id is None:
+            # Заявка уже рассмотрена — ждем новый скриншот
+            set_submission(context.user_data, SUBMISSION_AWAITING_SCREENSHOT)
+            await reply_screen(message, 'screenshot_first', user.language_code)
             return
         
-        # Обновляем заявку с реквизитами
-        conn = get_connection()
-        if conn:
-            try:
-                cur = conn.cursor()
-                cur.execute('UPDATE applications SET contact_info = %s WHERE id = %s', 
-                           (contact_info, existing_app[0]))
-                conn.commit()
-                conn.close()
-            except Exception as e:
-                logging.error(f"❌ Ошибка обновления реквизитов: {e}")
-                await message.reply_text("❌ Ошибка при сохранении реквизитов. Попробуйте еще раз.")
-                return
+        if app_id is False:
+            await reply_screen(message, 'contact_save_failed', user.language_code)
+            return
         
-        # Уведомляем администратора
-        admin_text = f"""
-🚨 *НОВАЯ ЗАЯВКА #{existing_app[0]}*
-
-👤 *Пользователь:* {user.full_name} (@{user.username})
-🆔 *ID:* {user.id}
-📞 *Реквизиты:* {contact_info}
-📅 *Время:* {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
-
-*Для ответа пользователю:* https://t.me/{user.username}
-        """
+        set_submission(context.user_data, SUBMISSION_SUBMITTED)
+        funnel.bump('contact')
         
-        try:
-            await context.bot.send_message(
-                chat_id=ADMIN_ID,
-                text=admin_text,
-                parse_mode='Markdown',
-                reply_markup=InlineKeyboardMarkup([[
-                    InlineKeyboardButton("📸 Посмотреть скриншот", callback_data=f'view_screenshot_{existing_app[0]}'),
-                    InlineKeyboardButton("✅ Одобрить", callback_data=f'approve_{existing_app[0]}')
-                ]])
-            )
-                
-        except Exception as e:
-            logging.error(f"❌ Ошибка отправки уведомления админу: {e}")
+        # Уведомляем администратора (отправка идет в фоне, пользователь ее не ждет).
+        # Заявка из журнала попадет к администратору после переноса в базу.
+        if app_id is not JOURNALED:
+            notify_admin(context.application, new_application_event(app_id, user.id, user.username, user.full_name, contact_info))
         
-        await message.reply_text("✅ Ваши данные получены! Проверка займет до 24 часов. Спасибо!")
-
-# ===== КОМАНДЫ ДЛЯ АДМИНИСТРАТОРА =====
+        await reply_screen(message, 'contact_received', user.language_code)
 
-async def view_applications(update: Update, context: CallbackContext) -> None:
-    """Просмотр всех заявок с inline кнопками"""
-    user = update.effective_user
+async def check_screenshot(app_id, user, photo_sizes) -> None:
+    """Поиск заявок с тем же или похожим скриншотом и предупреждение администратора"""
+    photo = photo_sizes[-1]
+    original = await register_screenshot_async(photo.file_unique_id, app_id)
+    distance = 0
     
-    if user.id != ADMIN_ID:
-        await update.message.reply_text("❌ У вас нет доступа к этой команде.")
+    if not original and screenshot_index is not None:
+        # Для хеша хватает самой маленькой копии: меньше трафика, а хеш от размера почти не зависит
+        try:
+            telegram_file = await photo_sizes[0].get_file()
+            data = bytes(await telegram_file.download_as_bytearray())
+            phash = await asyncio.get_running_loop().run_in_executor(None, fraud.dhash, data)
+        except Exception as e:
+            logging.warning(f"⚠️ Не удалось посчитать хеш скриншота заявки #{app_id}: {e}")
+            return
+        matches = screenshot_index.check_and_add(phash, app_id)
+        await save_screenshot_hash_async(photo.file_unique_id, phash, app_id)
+        if matches:
+            distance, original = matches[0]
+    
+    if not original:
         return
     
-    applications = get_pending_applications()
+    await mark_duplicate_async(app_id, original)
+    kind = "тот же файл" if distance == 0 else f"похожее изображение (отличие {distance} бит из 64)"
+    logging.warning(f"⚠️ Скриншот заявки #{app_id} повторяет заявку #{original}: {kind}")
+    sender.send_message(
+        chat_id=ADMIN_ID,
+        text=(
+            f"⚠️ Возможный повтор скриншота\n"
+            f"📋 Заявка #{app_id} от {user.full_name} (@{user.username}), 🆔 {user.id}\n"
+            f"🔁 Совпадает с заявкой #{original}: {kind}\n"
+            f"Сравнить: /screenshot {app_id} и /screenshot {original}"
+        ),
+    )
+
+# ===== КОМАНДЫ ДЛЯ АДМИНИСТРАТОРА =====
+
+EPOCH = datetime(1970, 1, 1)
+
+def encode_cursor(app):
+    """Курсор страницы для callback_data: created_at в микросекундах и id"""
+    return f"{(app[7] - EPOCH) // timedelta(microseconds=1)}_{app[0]}"
+
+def decode_cursor(created_us, app_id):
+    return EPOCH + timedelta(microseconds=int(created_us)), int(app_id)
+
+async def render_inbox(cursor=None, direction='next', page=1, notice=None):
+    """Текст и клавиатура одной страницы входящих заявок"""
+    result = await get_pending_page_async(cursor, direction, INBOX_PAGE_SIZE)
+    if result is False:
+        # Ошибка БД — не пустые входящие: предлагаем обновить позже
+        text = catalog.text('inbox_error')
+        reply_markup = InlineKeyboardMarkup([[InlineKeyboardButton("🔄", callback_data='inbox_f')]])
+        return (f"{escape(notice)}\n\n{text}" if notice else text), reply_markup
     
+    applications, has_more, total = result
     if not applications:
-        await update.message.reply_text("📭 Нет заявок для проверки.")
-        return
+        if cursor is not None and total:
+            # Страница опустела (заявки обработаны) — возвращаемся к началу
+            return await render_inbox(notice=notice)
+        text = catalog.text('inbox_empty')
+        return (f"{escape(notice)}\n\n{text}" if notice else text), None
+    
+    pages = (total + INBOX_PAGE_SIZE - 1) // INBOX_PAGE_SIZE
+    lines = [catalog.text('inbox_header', total=total, page=page, pages=pages)]
+    if notice:
+        lines.insert(0, escape(notice))
+    keyboard = []
+    no_contact_info = Markup(catalog.text('no_contact_info'))
     
     for app in applications:
         app_id, user_id, username, full_name, screenshot_file_id, contact_info, status, created_at = app
+        lines.append("\n" + catalog.text(
+            'inbox_card', app_id=app_id, created_at=created_at, full_name=full_name, username=username,
+            user_id=user_id, contact_info=contact_info or no_contact_info,
+        ))
         
-        text = f"""
-📋 *Заявка #{app_id}*
-👤 *Пользователь:* {full_name} (@{username})
-🆔 *User ID:* {user_id}
-📞 *Реквизиты:* {contact_info if contact_info else 'Не указаны'}
-📊 *Статус:* {status}
-📅 *Дата:* {created_at.strftime('%Y-%m-%d %H:%M')}
-        """
-        
-        keyboard = []
-        
+        row = []
         if screenshot_file_id:
-            keyboard.append([InlineKeyboardButton("📸 Просмотреть скриншот", callback_data=f'view_screenshot_{app_id}')])
-        
-        keyboard.extend([
-            [InlineKeyboardButton("✅ Одобрить", callback_data=f'approve_{app_id}'),
-             InlineKeyboardButton("❌ Отклонить", callback_data=f'reject_{app_id}')]
+            row.append(InlineKeyboardButton(f"📸 #{app_id}", callback_data=f'view_screenshot_{app_id}'))
+        row.extend([
+            InlineKeyboardButton(f"✅ #{app_id}", callback_data=f'approve_{app_id}_inbox'),
+            InlineKeyboardButton(f"❌ #{app_id}", callback_data=f'reject_{app_id}_inbox'),
         ])
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await update.message.reply_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+        keyboard.append(row)
+    
+    # has_more относится к направлению запроса: для 'next' — есть ли страницы дальше,
+    # для 'prev' — есть ли страницы ближе к началу списка
+    if direction == 'prev' and cursor is not None:
+        has_prev, has_next = has_more, True
+    else:
+        has_prev, has_next = cursor is not None, has_more
+    
+    navigation = []
+    if has_prev:
+        navigation.append(InlineKeyboardButton("◀️", callback_data=f'inbox_p_{max(page - 1, 1)}_{encode_cursor(applications[0])}'))
+    navigation.append(InlineKeyboardButton("🔄", callback_data='inbox_f'))
+    if has_next:
+        navigation.append(InlineKeyboardButton("▶️", callback_data=f'inbox_n_{page + 1}_{encode_cursor(applications[-1])}'))
+    keyboard.append(navigation)
+    
+    return "\n".join(lines), InlineKeyboardMarkup(keyboard)
+
+async def view_applications(update: Update, context: CallbackContext) -> None:
+    """Просмотр ожидающих заявок: одно сообщение с постраничной навигацией"""
+    user = update.effective_user
+    
+    if user.id != ADMIN_ID:
+        await update.message.reply_text("❌ У вас нет доступа к этой команде.")
+        return
+    
+    text, reply_markup = await render_inbox()
+    await update.message.reply_text(text, reply_markup=reply_markup, parse_mode=PARSE_MODE)
+
+async def inbox_navigation(query, data) -> None:
+    """Перелистывание страниц входящих заявок с редактированием сообщения"""
+    parts = data.split('_')
+    if parts[1] == 'f':
+        text, reply_markup = await render_inbox()
+    else:
+        direction = 'next' if parts[1] == 'n' else 'prev'
+        cursor = decode_cursor(parts[3], parts[4])
+        text, reply_markup = await render_inbox(cursor, direction, int(parts[2]))
+    await query.edit_message_text(text, reply_markup=reply_markup, parse_mode=PARSE_MODE)
 
 async def view_screenshot(update: Update, context: CallbackContext) -> None:
     """Просмотр скриншота конкретной заявки"""
@@ -464,7 +1289,7 @@ async def view_screenshot(update: Update, context: CallbackContext) -> None:
     
     app_id = context.args[0]
     
-    app = get_application_by_id(app_id)
+    app = await get_application_by_id_async(app_id)
     if not app:
         await update.message.reply_text("❌ Заявка не найдена.")
         return
@@ -476,195 +1301,629 @@ async def view_screenshot(update: Update, context: CallbackContext) -> None:
         return
     
     # Отправляем скриншот
-    await context.bot.send_photo(
+    await sender.send_photo(
         chat_id=ADMIN_ID,
         photo=file_id,
         caption=f"📸 Скриншот заявки #{app_id}\n👤 {full_name} (@{username})"
     )
 
+STATUSES = ('pending', 'approved', 'rejected')
+
+def parse_screenshot_filters(args):
+    """Разбор фильтров /all_screenshots: [статус] [с ГГГГ-ММ-ДД] [по ГГГГ-ММ-ДД]"""
+    status, dates = None, []
+    for arg in args:
+        if arg in STATUSES:
+            status = arg
+        elif arg == 'all':
+            status = None
+        else:
+            dates.append(datetime.strptime(arg, '%Y-%m-%d'))
+    if len(dates) > 2:
+        raise ValueError("слишком много дат")
+    date_from = dates[0] if dates else None
+    # Дата окончания включается в выборку целиком
+    date_to = dates[1] + timedelta(days=1) if len(dates) > 1 else None
+    return status, date_from, date_to
+
+def screenshot_caption(app):
+    """Подпись к скриншоту в альбоме (без разметки: в именах бывают _ и *)"""
+    app_id, user_id, username, full_name, screenshot_file_id, contact_info, status, created_at = app
+    return (
+        f"📋 Заявка #{app_id} — {status}\n"
+        f"👤 {full_name} (@{username}), 🆔 {user_id}\n"
+        f"📞 {contact_info if contact_info else 'Реквизиты не указаны'}\n"
+        f"📅 {created_at.strftime('%Y-%m-%d %H:%M')}"
+    )[:1024]
+
 async def view_all_with_screenshots(update: Update, context: CallbackContext) -> None:
-    """Просмотр всех заявок со скриншотами"""
+    """Просмотр заявок со скриншотами альбомами по 10 штук"""
     user = update.effective_user
     
     if user.id != ADMIN_ID:
         await update.message.reply_text("❌ У вас нет доступа к этой команде.")
         return
     
-    applications = get_all_applications()
+    try:
+        status, date_from, date_to = parse_screenshot_filters(context.args or [])
+    except ValueError:
+        await update.message.reply_text(
+            "❌ Формат: /all_screenshots [pending|approved|rejected|all] [с ГГГГ-ММ-ДД] [по ГГГГ-ММ-ДД]"
+        )
+        return
+    
+    sent = 0
+    previous = None
+    async for batch in iterate_db(iter_applications_with_screenshots, status, date_from, date_to, MEDIA_GROUP_SIZE):
+        if len(batch) == 1:
+            app = batch[0]
+            album = sender.send_photo(chat_id=ADMIN_ID, photo=app[4], caption=screenshot_caption(app))
+        else:
+            album = sender.send_media_group(
+                chat_id=ADMIN_ID,
+                media=[InputMediaPhoto(app[4], caption=screenshot_caption(app)) for app in batch]
+            )
+        # Держим в очереди не больше двух альбомов: память не растет вместе с таблицей
+        if previous:
+            await asyncio.wait([previous])
+        previous = album
+        sent += len(batch)
     
-    if not applications:
+    if previous:
+        await asyncio.wait([previous])
+    
+    if not sent:
         await update.message.reply_text("📭 Нет заявок.")
         return
     
-    for app in applications:
-        app_id, user_id, username, full_name, screenshot_file_id, contact_info, status, created_at = app
-        
-        if not screenshot_file_id:
-            continue
-            
-        # Отправляем информацию о заявке
-        info_text = f"""
-📋 *Заявка #{app_id}*
-👤 *Пользователь:* {full_name} (@{username})
-🆔 *User ID:* {user_id}
-📞 *Реквизиты:* {contact_info if contact_info else 'Не указаны'}
-📊 *Статус:* {status}
-📅 *Дата:* {created_at.strftime('%Y-%m-%d %H:%M')}
-        """
-        
-        await context.bot.send_message(
-            chat_id=ADMIN_ID,
-            text=info_text,
-            parse_mode='Markdown'
-        )
-        
-        # Отправляем скриншот
-        await context.bot.send_photo(
-            chat_id=ADMIN_ID,
-            photo=screenshot_file_id,
-            caption=f"Скриншот заявки #{app_id}"
+    await update.message.reply_text(f"📸 Показано заявок со скриншотами: {sent}")
+
+# Telegram не принимает от ботов файлы больше 50 МБ
+MAX_DOCUMENT_SIZE = 50 * 1024 * 1024
+
+async def export_command(update: Update, context: CallbackContext) -> None:
+    """Выгрузка заявок файлом: /export [csv|jsonl] [статус] [с ГГГГ-ММ-ДД] [по ГГГГ-ММ-ДД]"""
+    user = update.effective_user
+    
+    if user.id != ADMIN_ID:
+        await update.message.reply_text("❌ У вас нет доступа к этой команде.")
+        return
+    
+    args = list(context.args or [])
+    fmt = args.pop(0) if args and args[0] in FORMATS else FORMAT_CSV
+    try:
+        status, date_from, date_to = parse_screenshot_filters(args)
+    except ValueError:
+        await update.message.reply_text(
+            "❌ Формат: /export [csv|jsonl] [pending|approved|rejected|all] [с ГГГГ-ММ-ДД] [по ГГГГ-ММ-ДД]"
         )
+        return
+    
+    result = await export_applications_to_file_async(fmt, status, date_from, date_to)
+    if not result:
+        await update.message.reply_text("❌ Не удалось выгрузить заявки.")
+        return
+    
+    path, count = result
+    try:
+        if os.path.getsize(path) > MAX_DOCUMENT_SIZE:
+            await update.message.reply_text(
+                "❌ Файл больше 50 МБ — сузьте период или выгрузите через командную строку: python export.py"
+            )
+            return
+        filename = f"applications_{status or 'all'}_{datetime.now().strftime('%Y%m%d_%H%M')}.{fmt}"
+        caption = f"📦 Выгрузка заявок ({status or 'все'})" + (f": {count}" if count is not None else "")
+        # Путь, а не открытый файл: при повторной отправке файл откроется заново
+        await sender.send_document(chat_id=ADMIN_ID, document=Path(path), filename=filename, caption=caption)
+    finally:
+        os.remove(path)
 
-async def approve_application(update: Update, context: CallbackContext) -> None:
-    """Одобрение заявки"""
+# Триграммные индексы не помогают запросам короче трех символов (кроме user_id)
+FIND_MIN_LENGTH = 3
+
+# Запросы /find по токену из callback_data: сам текст в 64 байта кнопки не помещается
+search_queries = TTLCache(maxsize=1000, ttl=24 * 3600)
+
+async def render_search(text, token, offset=0):
+    """Текст и клавиатура одной страницы результатов поиска (без разметки: запрос — текст админа)"""
+    result = await search_applications_async(text, offset, FIND_PAGE_SIZE)
+    if result is False:
+        return "❌ Ошибка поиска заявок.", None
+    
+    applications, total = result
+    if not applications:
+        if offset:
+            # Страница опустела (заявки ушли в архив) — возвращаемся к началу
+            return await render_search(text, token)
+        return f"🔎 По запросу «{text}» ничего не найдено.", None
+    
+    page = offset // FIND_PAGE_SIZE + 1
+    pages = (total + FIND_PAGE_SIZE - 1) // FIND_PAGE_SIZE
+    lines = [f"🔎 Поиск «{text}» — найдено {total}, стр. {page}/{pages}"]
+    lines.extend(f"\n{screenshot_caption(app)}" for app in applications)
+    
+    keyboard = []
+    screenshots = [
+        InlineKeyboardButton(f"📸 #{app[0]}", callback_data=f'view_screenshot_{app[0]}')
+        for app in applications if app[4]
+    ]
+    if screenshots:
+        keyboard.append(screenshots)
+    navigation = []
+    if offset:
+        navigation.append(InlineKeyboardButton("◀️", callback_data=f'find_{token}_{max(offset - FIND_PAGE_SIZE, 0)}'))
+    if offset + len(applications) < total:
+        navigation.append(InlineKeyboardButton("▶️", callback_data=f'find_{token}_{offset + FIND_PAGE_SIZE}'))
+    if navigation:
+        keyboard.append(navigation)
+    
+    return "\n".join(lines)[:4096], InlineKeyboardMarkup(keyboard) if keyboard else None
+
+async def find_command(update: Update, context: CallbackContext) -> None:
+    """Поиск заявок: /find <username, имя, реквизиты или user_id>"""
     user = update.effective_user
     
     if user.id != ADMIN_ID:
         await update.message.reply_text("❌ У вас нет доступа к этой команде.")
         return
     
-    if not context.args:
-        await update.message.reply_text("❌ Укажите ID заявки: /approve <id>")
+    text = ' '.join(context.args or []).strip()
+    term = text.lstrip('@')
+    if len(term) < FIND_MIN_LENGTH and not term.isdigit():
+        await update.message.reply_text(
+            f"❌ Формат: /find <username, имя, реквизиты или user_id> (от {FIND_MIN_LENGTH} символов)"
+        )
         return
     
-    app_id = context.args[0]
-    success = update_application_status(app_id, 'approved')
+    token = secrets.token_hex(4)
+    search_queries.set(token, text)
+    message_text, reply_markup = await render_search(text, token)
+    await update.message.reply_text(message_text, reply_markup=reply_markup)
+
+async def find_navigation(query, data) -> None:
+    """Перелистывание результатов /find с редактированием сообщения"""
+    _, token, offset = data.split('_')
+    text = search_queries.get(token, None)
+    if text is None:
+        await query.edit_message_text("⌛ Результаты поиска устарели — повторите /find.")
+        return
+    message_text, reply_markup = await render_search(text, token, int(offset))
+    await query.edit_message_text(message_text, reply_markup=reply_markup)
+
+def conversion(part, total):
+    return f"{part / total * 100:.1f}%" if total else "—"
+
+async def stats_command(update: Update, context: CallbackContext) -> None:
+    """Воронка пользователей за 24 часа, 7 и 30 дней и за все время"""
+    user = update.effective_user
     
-    if not success:
-        await update.message.reply_text("❌ Ошибка при обновлении статуса заявки.")
+    if user.id != ADMIN_ID:
+        await update.message.reply_text("❌ У вас нет доступа к этой команде.")
         return
     
-    # Уведомляем пользователя
-    app = get_application_by_id(app_id)
-    if app:
-        user_id = app[1]
-        try:
-            await context.bot.send_message(
-                chat_id=user_id,
-                text="🎉 Ваша заявка одобрена! Деньги будут переведены в течение 7 дней."
-            )
-        except Exception as e:
-            logging.error(f"❌ Ошибка уведомления пользователя: {e}")
+    result = await get_funnel_stats_async()
+    if result is False:
+        await update.message.reply_text("❌ Не удалось получить статистику.")
+        return
     
-    await update.message.reply_text(f"✅ Заявка #{app_id} одобрена!")
+    lines = [f"{'':<11}" + ''.join(f"{WINDOWS[window]:>8}" for window in result)]
+    for event, title in EVENTS.items():
+        lines.append(f"{title:<11}" + ''.join(f"{totals.get(event, 0):>8}" for totals in result.values()))
+    month = result[WINDOW_MONTH]
+    screen = catalog.render(
+        'funnel_stats',
+        table=code_block("\n".join(lines)),
+        start_to_screenshot=conversion(month.get('screenshot', 0), month.get('start', 0)),
+        screenshot_to_approved=conversion(month.get('approved', 0), month.get('screenshot', 0)),
+    )
+    await update.message.reply_text(screen.text, parse_mode=PARSE_MODE)
 
-async def reject_application(update: Update, context: CallbackContext) -> None:
-    """Отклонение заявки"""
+# Больше заявок за одну команду не обрабатываем: защита от опечатки в диапазоне
+MAX_BULK_IDS = 1000
+
+DURATION_UNITS = {'m': 'minutes', 'h': 'hours', 'd': 'days', 'w': 'weeks'}
+
+def parse_duration(value):
+    """Срок вида 30m, 12h, 3d, 2w"""
+    unit = DURATION_UNITS.get(value[-1:].lower())
+    if unit is None or not value[:-1].isdigit():
+        raise ValueError(f"некорректный срок: {value}")
+    return timedelta(**{unit: int(value[:-1])})
+
+def parse_bulk_selection(args):
+    """Разбор выбора заявок: id, списки через запятую, диапазоны 10-20, older 3d
+
+    Возвращает (отсортированный список id, срок давности или None).
+    """
+    ids = set()
+    older_than = None
+    tokens = [part for arg in args for part in arg.split(',') if part]
+    position = 0
+    while position < len(tokens):
+        token = tokens[position].lower()
+        if token == 'older':
+            if position + 1 >= len(tokens):
+                raise ValueError("после older нужен срок, например older 3d")
+            older_than = parse_duration(tokens[position + 1])
+            position += 2
+            continue
+        start, _, end = token.partition('-')
+        if not start.isdigit() or (end and not end.isdigit()) or token.endswith('-'):
+            raise ValueError(f"некорректный номер заявки: {token}")
+        if end:
+            start, end = int(start), int(end)
+            if start > end:
+                start, end = end, start
+            if end - start + 1 > MAX_BULK_IDS:
+                raise ValueError(f"слишком большой диапазон (максимум {MAX_BULK_IDS})")
+            ids.update(range(start, end + 1))
+        else:
+            ids.add(int(token))
+        position += 1
+    
+    if older_than is not None and ids:
+        raise ValueError("укажите либо номера заявок, либо older")
+    if older_than is None and not ids:
+        raise ValueError("не указаны заявки")
+    if len(ids) > MAX_BULK_IDS:
+        raise ValueError(f"слишком много заявок (максимум {MAX_BULK_IDS})")
+    return sorted(ids), older_than
+
+def format_id_list(app_ids, limit=30):
+    shown = ', '.join(f"#{app_id}" for app_id in app_ids[:limit])
+    return shown + (f" и еще {len(app_ids) - limit}" if len(app_ids) > limit else '')
+
+async def decide_applications(update: Update, context: CallbackContext, status) -> None:
+    """Одобрение или отклонение списка заявок с одним итоговым ответом"""
     user = update.effective_user
+    command = 'approve' if status == STAGE_APPROVED else 'reject'
     
     if user.id != ADMIN_ID:
         await update.message.reply_text("❌ У вас нет доступа к этой команде.")
         return
     
-    if not context.args:
-        await update.message.reply_text("❌ Укажите ID заявки: /reject <id>")
+    try:
+        app_ids, older_than = parse_bulk_selection(context.args or [])
+    except ValueError as e:
+        reason = f"{str(e).capitalize()}. Формат" if context.args else "Укажите ID заявки"
+        await update.message.reply_text(f"❌ {reason}: /{command} <id> [<id> ...], диапазон 10-20 или older 3d")
         return
     
-    app_id = context.args[0]
-    success = update_application_status(app_id, 'rejected')
+    rows = await finalize_applications_async(app_ids, status, older_than)
     
-    if not success:
+    if rows is False:
         await update.message.reply_text("❌ Ошибка при обновлении статуса заявки.")
         return
     
-    await update.message.reply_text(f"❌ Заявка #{app_id} отклонена!")
+    if not rows:
+        await update.message.reply_text("❌ Заявки не найдены или уже обработаны.")
+        return
+    
+    funnel.bump(status, len(rows))
+    for _app_id, user_id in rows:
+        reset_submission(context.application, user_id)
+    done = sorted(app_id for app_id, _user_id in rows)
+    if len(done) == 1:
+        lines = [f"✅ Заявка #{done[0]} одобрена!" if status == STAGE_APPROVED else f"❌ Заявка #{done[0]} отклонена!"]
+    elif status == STAGE_APPROVED:
+        lines = [f"✅ Одобрены заявки ({len(done)}): {format_id_list(done)}"]
+    else:
+        lines = [f"❌ Отклонены заявки ({len(done)}): {format_id_list(done)}"]
+    
+    if older_than is None:
+        skipped = sorted(set(app_ids) - set(done))
+        if skipped:
+            lines.append(f"⏭ Пропущены (не найдены или уже обработаны): {format_id_list(skipped)}")
+    
+    if status == STAGE_APPROVED:
+        # Уведомления уходят через очередь отправки (~30 в секунду); итог отвечаем сразу,
+        # а о неудачных уведомлениях фоновая задача сообщит отдельным сообщением
+        notifications = [
+            (app_id, sender.send_message(
+                chat_id=user_id,
+                text="🎉 Ваша заявка одобрена! Деньги будут переведены в течение 7 дней."
+            )) for app_id, user_id in rows
+        ]
+        lines.append(f"📨 Уведомления пользователям отправляются: {len(notifications)}")
+        context.application.create_task(report_failed_notifications(notifications))
+    
+    await update.message.reply_text("\n".join(lines))
+
+async def report_failed_notifications(notifications) -> None:
+    """Дождаться уведомлений о решении и сообщить администратору о неудачных"""
+    results = await asyncio.gather(*(future for _app_id, future in notifications), return_exceptions=True)
+    failed = sorted(app_id for (app_id, _future), result in zip(notifications, results)
+                    if isinstance(result, BaseException))
+    if failed:
+        await sender.send_message(
+            chat_id=ADMIN_ID,
+            text=f"⚠️ Не удалось уведомить пользователей ({len(failed)} из {len(notifications)}): "
+                 f"{format_id_list(failed)}"
+        )
+
+async def approve_application(update: Update, context: CallbackContext) -> None:
+    """Одобрение одной или нескольких заявок"""
+    await decide_applications(update, context, STAGE_APPROVED)
+
+async def reject_application(update: Update, context: CallbackContext) -> None:
+    """Отклонение одной или нескольких заявок"""
+    await decide_applications(update, context, STAGE_REJECTED)
 
 # ===== ОБРАБОТЧИК INLINE КНОПОК =====
 
 async def button_handler(update: Update, context: CallbackContext) -> None:
-    """Обработчик inline кнопок"""
+    """Обработчик inline кнопок администратора (кнопки пользователя — отдельные обработчики)"""
     query = update.callback_query
-    await query.answer()
-    
     data = query.data
     
+    if query.from_user.id != ADMIN_ID:
+        await query.answer()
+        return
+    
     if data.startswith('view_screenshot_'):
         app_id = data.split('_')[2]
         
-        app = get_application_by_id(app_id)
+        app = await get_application_by_id_async(app_id)
         if not app or not app[4]:
-            await query.edit_message_text("❌ Скриншот не найден.")
+            # Сообщение с заявкой (входящие, дайджест) не трогаем — только всплывающее окно
+            await query.answer("❌ Скриншот не найден.", show_alert=True)
             return
+        await query.answer()
         
         file_id, username, full_name = app[4], app[2], app[3]
         
         # Отправляем скриншот отдельным сообщением
-        await context.bot.send_photo(
+        await sender.send_photo(
             chat_id=ADMIN_ID,
             photo=file_id,
             caption=f"📸 Скриншот заявки #{app_id}\n👤 {full_name} (@{username})"
         )
+        return
+    
+    await query.answer()
+    
+    if data.startswith('inbox_'):
+        await inbox_navigation(query, data)
+    
+    elif data.startswith('find_'):
+        await find_navigation(query, data)
     
     elif data.startswith('approve_'):
         app_id = data.split('_')[1]
-        success = update_application_status(app_id, 'approved')
+        user_id = await finalize_application_async(app_id, STAGE_APPROVED)
         
-        if success:
-            # Уведомляем пользователя
-            app = get_application_by_id(app_id)
-            if app:
-                user_id = app[1]
-                try:
-                    await context.bot.send_message(
-                        chat_id=user_id,
-                        text="🎉 Ваша заявка одобрена! Деньги будут переведены в течение 7 дней."
-                    )
-                except Exception as e:
-                    logging.error(f"❌ Ошибка уведомления пользователя: {e}")
-            
-            await query.edit_message_text(f"✅ Заявка #{app_id} одобрена!")
+        if user_id is None:
+            await show_decision(query, data, f"❌ Заявка #{app_id} не найдена или уже обработана.")
+        elif user_id:
+            funnel.bump(STAGE_APPROVED)
+            reset_submission(context.application, user_id)
+            # Уведомляем пользователя (очередь отправки сама повторит попытку при сбое)
+            sender.send_message(
+                chat_id=user_id,
+                text="🎉 Ваша заявка одобрена! Деньги будут переведены в течение 7 дней."
+            )
+            await show_decision(query, data, f"✅ Заявка #{app_id} одобрена!")
         else:
-            await query.edit_message_text("❌ Ошибка при одобрении заявки.")
+            await show_decision(query, data, "❌ Ошибка при одобрении заявки.")
     
     elif data.startswith('reject_'):
         app_id = data.split('_')[1]
-        success = update_application_status(app_id, 'rejected')
+        user_id = await finalize_application_async(app_id, STAGE_REJECTED)
         
-        if success:
-            await query.edit_message_text(f"❌ Заявка #{app_id} отклонена!")
+        if user_id is None:
+            await show_decision(query, data, f"❌ Заявка #{app_id} не найдена или уже обработана.")
+        elif user_id:
+            funnel.bump(STAGE_REJECTED)
+            reset_submission(context.application, user_id)
+            await show_decision(query, data, f"❌ Заявка #{app_id} отклонена!")
         else:
-            await query.edit_message_text("❌ Ошибка при отклонении заявки.")
+            await show_decision(query, data, "❌ Ошибка при отклонении заявки.")
+
+async def show_decision(query, data, notice) -> None:
+    """Результат решения по заявке: во входящих — поверх обновленной страницы,
+    для дайджеста — отдельным сообщением"""
+    if data.endswith('_inbox'):
+        text, reply_markup = await render_inbox(notice=notice)
+        await query.edit_message_text(text, reply_markup=reply_markup, parse_mode=PARSE_MODE)
+    elif data.endswith('_digest'):
+        # Дайджест содержит и другие заявки — не затираем его, отвечаем отдельно
+        await query.message.reply_text(notice)
+    else:
+        await query.edit_message_text(notice)
 
 # ===== ОСНОВНАЯ ФУНКЦИЯ =====
 
+async def on_startup(application: Application) -> None:
+    """Запуск фоновых компонентов после инициализации бота"""
+    global sender
+    sender = OutboundSender(
+        application.bot,
+        global_rate=SEND_GLOBAL_RATE,
+        per_chat_rate=SEND_PER_CHAT_RATE,
+        per_chat_burst=SEND_PER_CHAT_BURST,
+    )
+    await sender.start()
+    
+    global admin_notifier
+    admin_notifier = AdminNotifier(
+        deliver_admin_notifications,
+        mode=ADMIN_NOTIFY_MODE,
+        interval=ADMIN_DIGEST_INTERVAL,
+        max_items=ADMIN_DIGEST_MAX_ITEMS,
+    )
+    await admin_notifier.start()
+    
+    await run_db(load_screenshot_index)
+    
+    global leader, event_bus, leader_task
+    if MULTI_INSTANCE and isinstance(storage, PostgresStorage):
+        handlers, on_reconnect = event_handlers(application)
+        event_bus = EventBus(storage.pool.connect, handlers, on_reconnect=on_reconnect)
+        await event_bus.start()
+        leader = LeaderElection(storage.pool.connect)
+        leader_task = asyncio.create_task(elect_leader_periodically(application))
+    elif MULTI_INSTANCE:
+        logging.warning("⚠️ MULTI_INSTANCE работает только с PostgreSQL: процесс считается единственным")
+    
+    global journal_task
+    if journal:
+        journal_task = asyncio.create_task(replay_journal_periodically(application))
+    
+    global metrics_server
+    if BOT_MODE != 'webhook' and METRICS_PORT:
+        metrics_server = HTTPServer(port=METRICS_PORT)
+        metrics_server.add_route('GET', '/metrics', metrics_endpoint)
+        await metrics_server.start()
+
+async def on_shutdown(application: Application) -> None:
+    """Освобождение ресурсов при остановке бота"""
+    if metrics_server:
+        await metrics_server.stop()
+    if journal_task:
+        journal_task.cancel()
+        await asyncio.gather(journal_task, return_exceptions=True)
+    if journal:
+        journal.close()
+    if leader_task:
+        leader_task.cancel()
+        await asyncio.gather(leader_task, return_exceptions=True)
+    if event_bus:
+        await event_bus.stop()
+    if admin_notifier:
+        await admin_notifier.stop()
+    if sender:
+        await sender.stop()
+    db_executor.shutdown(wait=True)
+    # Несброшенные счетчики воронки сохраняются до закрытия хранилища
+    flush_funnel_stats()
+    if leader:
+        leader.close()
+    close_storage()
+
+def build_application(request: BaseRequest = None) -> Application:
+    """Создание приложения и регистрация обработчиков
+
+    request — своя реализация запросов к Bot API (например, заглушка в бенчмарках).
+    Все вызовы Bot API, кроме long polling getUpdates, попадают в метрики.
+    """
+    builder = (
+        Application.builder()
+        .token(TOKEN)
+        .request(InstrumentedRequest(request))
+        .concurrent_updates(PerUserUpdateProcessor(MAX_CONCURRENT_UPDATES))
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+    )
+    if STATE_PATH:
+        builder.persistence(SQLitePersistence(STATE_PATH, update_interval=STATE_FLUSH_INTERVAL))
+    application = builder.build()
+    
+    # Раньше всех обработчиков отсеивается повторная доставка, затем входящий лимит
+    if MULTI_INSTANCE:
+        application.add_handler(TypeHandler(Update, dedupe_update), group=-2)
+    if inbound_limiter is not None:
+        application.add_handler(TypeHandler(Update, throttle_inbound), group=-1)
+    
+    # Обработчики команд
+    application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("view_applications", view_applications))
+    application.add_handler(CommandHandler("screenshot", view_screenshot))
+    application.add_handler(CommandHandler("all_screenshots", view_all_with_screenshots))
+    application.add_handler(CommandHandler("approve", approve_application))
+    application.add_handler(CommandHandler("reject", reject_application))
+    application.add_handler(CommandHandler("export", export_command))
+    application.add_handler(CommandHandler("find", find_command))
+    application.add_handler(CommandHandler("stats", stats_command))
+    
+    # Обработчики callback-кнопок
+    application.add_handler(CallbackQueryHandler(show_terms, pattern='show_terms'))
+    application.add_handler(CallbackQueryHandler(get_link, pattern='get_link'))
+    application.add_handler(CallbackQueryHandler(instruction, pattern='instruction'))
+    application.add_handler(CallbackQueryHandler(back_to_start, pattern='back_to_start'))
+    application.add_handler(CallbackQueryHandler(button_handler))
+    
+    # Обработчик медиа-сообщений (скриншоты и текст)
+    application.add_handler(MessageHandler(filters.PHOTO | filters.TEXT & ~filters.COMMAND, handle_screenshot))
+    
+    # Архивация завершенных заявок и сброс статистики по расписанию
+    if application.job_queue:
+        application.job_queue.run_repeating(retention_job, interval=RETENTION_INTERVAL, first=60)
+        application.job_queue.run_repeating(stats_flush_job, interval=STATS_FLUSH_INTERVAL, first=STATS_FLUSH_INTERVAL)
+        application.job_queue.run_repeating(
+            evict_submissions_job, interval=SUBMISSION_EVICT_INTERVAL, first=SUBMISSION_EVICT_INTERVAL)
+    else:
+        logging.warning(
+            "⚠️ JobQueue недоступна (нужен python-telegram-bot[job-queue]): "
+            "архивация выключена, статистика сохраняется только при остановке"
+        )
+    
+    # Время, ошибки и trace id для каждого обработчика
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            handler.callback = instrument_handler(handler.callback)
+    
+    return application
+
+async def register_webhook(bot) -> None:
+    """Регистрация вебхука в Telegram с общим секретным токеном"""
+    await bot.set_webhook(
+        url=WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET,
+        allowed_updates=Update.ALL_TYPES,
+    )
+    logging.info(f"✅ Вебхук зарегистрирован: {WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}")
+
+async def run_webhook(application: Application) -> None:
+    """Работа через вебхук со встроенным HTTP-сервером"""
+    server = WebhookServer(application, WEBHOOK_SECRET, path=WEBHOOK_PATH, port=PORT)
+    server.add_route('GET', '/metrics', metrics_endpoint)
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+    
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+    try:
+        await server.start()
+        if not WEBHOOK_URL:
+            logging.warning("⚠️ WEBHOOK_URL не задан: вебхук не регистрируется, сервер работает локально")
+            if not os.environ.get('WEBHOOK_SECRET'):
+                logging.warning("⚠️ WEBHOOK_SECRET не задан: запросы без случайного секрета процесса получат 403, "
+                                "задайте WEBHOOK_SECRET, чтобы отправлять обновления вручную")
+        elif leader is None:
+            await register_webhook(application.bot)
+        else:
+            logging.info("ℹ️ Вебхук зарегистрирует ведущий процесс")
+        
+        logging.info("✅ Бот успешно запущен и ожидает сообщений")
+        await stop_event.wait()
+    finally:
+        await server.stop()
+        await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
 def main() -> None:
     try:
-        # Инициализируем базу данных (если доступна)
+        # Создаем хранилище заявок и применяем миграции
+        init_storage()
         init_db()
+        init_journal()
         
         logging.info("🚀 Запуск бота...")
-        application = Application.builder().token(TOKEN).build()
-        
-        # Обработчики команд
-        application.add_handler(CommandHandler("start", start))
-        application.add_handler(CommandHandler("view_applications", view_applications))
-        application.add_handler(CommandHandler("screenshot", view_screenshot))
-        application.add_handler(CommandHandler("all_screenshots", view_all_with_screenshots))
-        application.add_handler(CommandHandler("approve", approve_application))
-        application.add_handler(CommandHandler("reject", reject_application))
-        
-        # Обработчики callback-кнопок
-        application.add_handler(CallbackQueryHandler(show_terms, pattern='show_terms'))
-        application.add_handler(CallbackQueryHandler(get_link, pattern='get_link'))
-        application.add_handler(CallbackQueryHandler(instruction, pattern='instruction'))
-        application.add_handler(CallbackQueryHandler(back_to_start, pattern='back_to_start'))
-        application.add_handler(CallbackQueryHandler(button_handler))
+        application = build_application()
         
-        # Обработчик медиа-сообщений (скриншоты и текст)
-        application.add_handler(MessageHandler(filters.PHOTO | filters.TEXT & ~filters.COMMAND, handle_screenshot))
-        
-        logging.info("✅ Бот успешно запущен и ожидает сообщений")
-        application.run_polling()
+        if BOT_MODE == 'webhook':
+            asyncio.run(run_webhook(application))
+        else:
+            logging.info("✅ Бот успешно запущен и ожидает сообщений")
+            application.run_polling()
         
     except Exception as e:
         logging.error(f"❌ Ошибка при запуске бота: {e}")
@@ -0,0 +1,93 @@
+import heapq
+import threading
+import time
+from collections import OrderedDict
+
+# Значение «в кэше ничего нет» (None в кэше — это закэшированное отсутствие)
+MISSING = object()
+
+
+class TTLCache:
+    """Потокобезопасный LRU-кэш с ограниченным размером и временем жизни записей
+
+    Поддерживает отрицательное кэширование: None — полноценное значение.
+    Чтобы запись, прочитанная до изменения данных, не перезаписала свежую
+    инвалидацию, заполнение идет по токену: set() с токеном, полученным
+    до чтения из базы, только удаляет запись, если с тех пор была инвалидация.
+    """
+
+    def __init__(self, maxsize=10000, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0
+
+    def token(self):
+        """Токен для заполнения кэша после чтения из базы"""
+        with self._lock:
+            return self._generation
+
+    def get(self, key, default=MISSING):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[1] < now:
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, token=None):
+        with self._lock:
+            if token is not None and token != self._generation:
+                # Данные могли устареть — убираем запись, следующее чтение пойдет в базу
+                self._data.pop(key, None)
+                return
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._generation += 1
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / total if total else 0.0,
+            }
+
+
+def idle_keys(touched, ttl, maxsize, now=None):
+    """Ключи для вытеснения из словаря ключ → время последнего обращения (time.time())
+
+    Сначала все, к которым не обращались дольше ttl; если оставшихся
+    больше maxsize — еще и самые давние из них сверх maxsize.
+    """
+    now = time.time() if now is None else now
+    stale = [key for key, at in touched.items() if now - at > ttl]
+    excess = len(touched) - len(stale) - maxsize
+    if excess > 0:
+        fresh = ((at, key) for key, at in touched.items() if now - at <= ttl)
+        stale.extend(key for _at, key in heapq.nsmallest(excess, fresh))
+    return stale
@@ -0,0 +1,197 @@
+"""Координация нескольких процессов бота через PostgreSQL
+
+Несколько процессов за одним вебхуком работают с общей базой:
+- ведущий выбирается сессионной advisory-блокировкой (LeaderElection), только
+  он выполняет разовые задачи — архивацию и дайджест администратору;
+- процессы обмениваются событиями через LISTEN/NOTIFY (EventBus): сброс
+  кэшей, новые хеши скриншотов, заявки для дайджеста ведущего;
+- повторно доставленные обновления отсекаются по update_id (processed_updates).
+
+Проверка на одной машине — несколько процессов с MULTI_INSTANCE=1 и разными PORT
+над одной базой; обновления можно отправлять POST-запросами на любой порт.
+"""
+import asyncio
+import json
+import logging
+import secrets
+
+import psycopg2
+
+# Ключ advisory-блокировки ведущего (миграции используют свой ключ)
+LEADER_LOCK_ID = 7_310_002
+
+CHANNEL = 'bot_events'
+
+# Полезная нагрузка NOTIFY ограничена 8000 байт
+MAX_PAYLOAD = 7900
+
+
+class LeaderElection:
+    """Ведущий — процесс, удерживающий advisory-блокировку на своем подключении
+
+    Блокировка сессионная: если процесс упал или подключение оборвалось,
+    PostgreSQL снимает ее сам, и при следующей проверке ее забирает другой
+    процесс. Пока ведущий не проверил подключение, он может не знать, что
+    потерял блокировку, поэтому задачи ведущего должны быть безопасны при
+    редком двойном запуске (архивация и так идет атомарными пачками).
+    leader_known — при последней проверке блокировку держал этот или другой
+    процесс (False, если проверить не удалось или ее еще не было).
+    Методы блокирующие — вызываются из пула потоков.
+    """
+
+    def __init__(self, connect, lock_id=LEADER_LOCK_ID):
+        self.connect = connect
+        self.lock_id = lock_id
+        self.is_leader = False
+        self.leader_known = False
+        self._conn = None
+
+    def poll(self):
+        """Попытка стать ведущим или проверка, что подключение с блокировкой живо"""
+        try:
+            if self._conn is None or self._conn.closed:
+                self._conn = self.connect()
+                self._conn.autocommit = True
+            cur = self._conn.cursor()
+            if self.is_leader:
+                cur.execute('SELECT 1')
+            else:
+                # Повторный pg_try_advisory_lock в той же сессии увеличил бы счетчик блокировки
+                cur.execute('SELECT pg_try_advisory_lock(%s)', (self.lock_id,))
+                if cur.fetchone()[0]:
+                    self.is_leader = True
+                    logging.info("👑 Процесс стал ведущим")
+            # Блокировку не получили — значит, ее держит другой процесс
+            self.leader_known = True
+        except psycopg2.Error as e:
+            if self.is_leader:
+                logging.warning(f"⚠️ Подключение ведущего потеряно, процесс больше не ведущий: {e}")
+            self.is_leader = False
+            self.leader_known = False
+            self._close()
+        return self.is_leader
+
+    def close(self):
+        if self._conn is not None and not self._conn.closed and self.is_leader:
+            try:
+                self._conn.cursor().execute('SELECT pg_advisory_unlock(%s)', (self.lock_id,))
+            except psycopg2.Error:
+                pass
+        self.is_leader = False
+        self.leader_known = False
+        self._close()
+
+    def _close(self):
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except psycopg2.Error:
+                pass
+            self._conn = None
+
+
+class EventBus:
+    """События между процессами через LISTEN/NOTIFY
+
+    Подключение-слушатель читается прямо в event loop (add_reader), без
+    отдельного потока. Событие — JSON с полями type и origin; свои события
+    процесс пропускает. NOTIFY не хранит события: после переподключения
+    вызывается on_reconnect, чтобы сбросить все, что могло устареть.
+    Отправка — publish() хранилища с текстом из encode().
+    """
+
+    def __init__(self, connect, handlers, on_reconnect=None, channel=CHANNEL, reconnect_delay=5):
+        self.connect = connect
+        self.handlers = handlers
+        self.on_reconnect = on_reconnect
+        self.channel = channel
+        self.reconnect_delay = reconnect_delay
+        self.instance_id = secrets.token_hex(4)
+        self._conn = None
+        self._reconnect_task = None
+        self._stopped = False
+
+    async def start(self):
+        try:
+            await self._listen()
+        except psycopg2.Error as e:
+            # Подписка восстановится в фоне, как после обрыва
+            logging.error(f"❌ Ошибка подписки на события процессов: {e}")
+            self._reconnect_task = asyncio.get_running_loop().create_task(self._reconnect())
+            return
+        logging.info(f"✅ Подписка на события процессов: {self.channel} (процесс {self.instance_id})")
+
+    async def stop(self):
+        self._stopped = True
+        if self._reconnect_task:
+            self._reconnect_task.cancel()
+            await asyncio.gather(self._reconnect_task, return_exceptions=True)
+        self._drop()
+
+    def encode(self, type, **fields):
+        payload = json.dumps({'type': type, 'origin': self.instance_id, **fields}, ensure_ascii=False, default=str)
+        if len(payload.encode()) > MAX_PAYLOAD:
+            raise ValueError(f"Событие {type} больше {MAX_PAYLOAD} байт")
+        return payload
+
+    async def _listen(self):
+        loop = asyncio.get_running_loop()
+        conn = await loop.run_in_executor(None, self.connect)
+        conn.autocommit = True
+        conn.cursor().execute(f'LISTEN {self.channel}')
+        self._conn = conn
+        loop.add_reader(conn.fileno(), self._on_readable)
+
+    def _drop(self):
+        if self._conn is None:
+            return
+        try:
+            asyncio.get_running_loop().remove_reader(self._conn.fileno())
+        except (ValueError, psycopg2.Error):
+            pass
+        try:
+            self._conn.close()
+        except psycopg2.Error:
+            pass
+        self._conn = None
+
+    def _on_readable(self):
+        try:
+            self._conn.poll()
+        except psycopg2.Error as e:
+            logging.warning(f"⚠️ Подписка на события процессов прервана: {e}")
+            self._drop()
+            if not self._stopped:
+                self._reconnect_task = asyncio.get_running_loop().create_task(self._reconnect())
+            return
+        while self._conn.notifies:
+            self._dispatch(self._conn.notifies.pop(0).payload)
+
+    def _dispatch(self, payload):
+        try:
+            event = json.loads(payload)
+        except ValueError:
+            logging.warning(f"⚠️ Непонятное событие процессов: {payload[:100]}")
+            return
+        if event.get('origin') == self.instance_id:
+            return
+        handler = self.handlers.get(event.get('type'))
+        if handler is None:
+            return
+        try:
+            handler(event)
+        except Exception as e:
+            logging.error(f"❌ Ошибка обработки события {event.get('type')}: {e}")
+
+    async def _reconnect(self):
+        while not self._stopped:
+            await asyncio.sleep(self.reconnect_delay)
+            try:
+                await self._listen()
+            except psycopg2.Error as e:
+                logging.warning(f"⚠️ Не удалось восстановить подписку на события: {e}")
+                continue
+            logging.info("✅ Подписка на события процессов восстановлена")
+            if self.on_reconnect:
+                self.on_reconnect()
+            return
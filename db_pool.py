@@ -0,0 +1,192 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import extensions, pool as pg_pool
+
+
+class PoolUnavailableError(Exception):
+    """Пул не может выдать подключение (база недоступна или пул закрыт)"""
+
+
+class DatabasePool:
+    """Пул долгоживущих подключений к PostgreSQL
+
+    Подключения создаются один раз и переиспользуются между запросами.
+    Перед выдачей подключение проверяется, сломанные подключения
+    выбрасываются из пула и пересоздаются при следующем запросе.
+    """
+
+    def __init__(self, dsn, minconn=1, maxconn=10, health_check_interval=30,
+                 acquire_timeout=10, reconnect_delay=5, **connect_kwargs):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError("Некорректные размеры пула: min=%s, max=%s" % (minconn, maxconn))
+        self.dsn = dsn
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.health_check_interval = health_check_interval
+        self.acquire_timeout = acquire_timeout
+        self.reconnect_delay = reconnect_delay
+        self.connect_kwargs = connect_kwargs
+
+        self._pool = None
+        self._lock = threading.Lock()
+        # Ограничиваем число одновременно выданных подключений: ThreadedConnectionPool
+        # при исчерпании бросает ошибку, а нам нужно подождать свободное подключение
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._last_used = {}
+        self._in_use = 0
+        self._next_attempt = 0.0
+        self._closed = False
+
+    # ----- жизненный цикл -----
+
+    def open(self):
+        """Создание пула; при неудаче повторная попытка не раньше reconnect_delay"""
+        with self._lock:
+            if self._closed:
+                raise PoolUnavailableError("Пул подключений закрыт")
+            if self._pool is not None:
+                return self._pool
+            now = time.monotonic()
+            if now < self._next_attempt:
+                raise PoolUnavailableError("База данных недоступна, ждем переподключения")
+            try:
+                self._pool = pg_pool.ThreadedConnectionPool(
+                    self.minconn, self.maxconn, self.dsn, **self.connect_kwargs
+                )
+            except psycopg2.Error as e:
+                self._next_attempt = now + self.reconnect_delay
+                raise PoolUnavailableError(f"Не удалось создать пул подключений: {e}") from e
+            logging.info(f"✅ Пул подключений к PostgreSQL создан (min={self.minconn}, max={self.maxconn})")
+            return self._pool
+
+    def close(self):
+        """Закрытие всех подключений пула"""
+        with self._lock:
+            self._closed = True
+            if self._pool is not None:
+                self._pool.closeall()
+                self._pool = None
+            self._last_used.clear()
+        logging.info("🔌 Пул подключений к PostgreSQL закрыт")
+
+    @property
+    def closed(self):
+        return self._closed
+
+    # ----- выдача подключений -----
+
+    @contextmanager
+    def connection(self):
+        """Подключение из пула на время блока with
+
+        Незавершенная транзакция откатывается при возврате в пул,
+        подключение с сетевой ошибкой закрывается и не возвращается.
+        """
+        conn = self._acquire()
+        broken = False
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        finally:
+            self._release(conn, broken)
+
+    def connect(self):
+        """Отдельное подключение вне пула с теми же параметрами (LISTEN, сессионные блокировки)"""
+        return psycopg2.connect(self.dsn, **self.connect_kwargs)
+
+    def _acquire(self):
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            raise PoolUnavailableError("Нет свободных подключений в пуле")
+        try:
+            pool = self.open()
+            # Одна повторная попытка: если выданное подключение мертво, берем новое
+            for attempt in range(2):
+                conn = pool.getconn()
+                if self._is_healthy(conn):
+                    with self._lock:
+                        self._in_use += 1
+                    return conn
+                logging.warning("⚠️ Подключение к базе данных потеряно, переподключаемся")
+                self._discard(pool, conn)
+            raise PoolUnavailableError("Не удалось получить рабочее подключение")
+        except psycopg2.Error as e:
+            self._slots.release()
+            self._reset_pool()
+            raise PoolUnavailableError(f"Ошибка получения подключения: {e}") from e
+        except Exception:
+            self._slots.release()
+            raise
+
+    def _release(self, conn, broken=False):
+        try:
+            with self._lock:
+                self._in_use -= 1
+                pool = self._pool
+            if pool is None:
+                conn.close()
+                return
+            if not broken and not conn.closed:
+                try:
+                    if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                        conn.rollback()
+                except psycopg2.Error:
+                    broken = True
+            if broken or conn.closed:
+                self._discard(pool, conn)
+            else:
+                self._last_used[id(conn)] = time.monotonic()
+                pool.putconn(conn)
+        finally:
+            self._slots.release()
+
+    def _is_healthy(self, conn):
+        """Проверка подключения перед выдачей"""
+        if conn.closed:
+            return False
+        last_used = self._last_used.get(id(conn))
+        if last_used is not None and time.monotonic() - last_used < self.health_check_interval:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute('SELECT 1')
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _discard(self, pool, conn):
+        self._last_used.pop(id(conn), None)
+        try:
+            pool.putconn(conn, close=True)
+        except Exception:
+            pass
+
+    def _reset_pool(self):
+        """Сброс пула после ошибки подключения, чтобы пересоздать его позже"""
+        with self._lock:
+            if self._pool is not None and self._in_use == 0:
+                try:
+                    self._pool.closeall()
+                except Exception:
+                    pass
+                self._pool = None
+                self._last_used.clear()
+                self._next_attempt = time.monotonic() + self.reconnect_delay
+
+    # ----- состояние -----
+
+    def stats(self):
+        """Текущее состояние пула: размер, выдано, свободно"""
+        with self._lock:
+            pool = self._pool
+            in_use = self._in_use
+        if pool is None:
+            return {'size': 0, 'in_use': in_use, 'idle': 0}
+        idle = len(pool._pool)
+        return {'size': idle + in_use, 'in_use': in_use, 'idle': idle}
@@ -0,0 +1,106 @@
+"""Потоковая выгрузка заявок в CSV или JSONL
+
+Строки не собираются в памяти: PostgreSQL отдает CSV через COPY ... TO STDOUT
+прямо в файл, JSONL и SQLite читаются пачками через потоковый курсор.
+
+Пример:
+    python export.py --format csv --status approved --from 2026-01-01 --to 2026-01-31 -o january.csv
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+import sys
+from datetime import datetime, timedelta
+
+from storage import COLUMNS
+
+FORMAT_CSV = 'csv'
+FORMAT_JSONL = 'jsonl'
+FORMATS = (FORMAT_CSV, FORMAT_JSONL)
+
+FIELDS = [name.strip() for name in COLUMNS.split(',')]
+
+# Размер пачки потокового чтения
+EXPORT_BATCH_SIZE = 1000
+
+
+def write_csv(out, batches):
+    writer = csv.writer(out)
+    writer.writerow(FIELDS)
+    count = 0
+    for rows in batches:
+        writer.writerows(rows)
+        count += len(rows)
+    return count
+
+
+def write_jsonl(out, batches):
+    count = 0
+    for rows in batches:
+        for row in rows:
+            out.write(json.dumps(dict(zip(FIELDS, row)), ensure_ascii=False, default=str) + '\n')
+        count += len(rows)
+    return count
+
+
+def export_applications(storage, out, fmt=FORMAT_CSV, status=None, date_from=None, date_to=None):
+    """Выгрузка заявок в текстовый файл out; date_to не включается в интервал
+
+    Возвращает число выгруженных строк или None, если его знает только база (COPY).
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Неизвестный формат выгрузки: {fmt}")
+    if fmt == FORMAT_CSV and hasattr(storage, 'copy_csv'):
+        storage.copy_csv(out, status, date_from, date_to)
+        return None
+    batches = storage.iter_applications(status, date_from, date_to, EXPORT_BATCH_SIZE)
+    writer = write_csv if fmt == FORMAT_CSV else write_jsonl
+    return writer(out, batches)
+
+
+def parse_date(value):
+    return datetime.strptime(value, '%Y-%m-%d')
+
+
+def open_storage(database_url=None, sqlite_path=None, sslmode=None):
+    """Хранилище для запуска из командной строки (те же переменные окружения, что у бота)"""
+    if database_url:
+        from db_pool import DatabasePool
+        from storage import PostgresStorage
+        kwargs = {'sslmode': sslmode} if sslmode else {}
+        return PostgresStorage(DatabasePool(database_url, minconn=1, maxconn=1, **kwargs))
+    from storage import SQLiteStorage
+    return SQLiteStorage(sqlite_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--format', choices=FORMATS, default=FORMAT_CSV)
+    parser.add_argument('--status', choices=('pending', 'approved', 'rejected'))
+    parser.add_argument('--from', dest='date_from', type=parse_date, help='с даты ГГГГ-ММ-ДД')
+    parser.add_argument('--to', dest='date_to', type=parse_date, help='по дату ГГГГ-ММ-ДД включительно')
+    parser.add_argument('-o', '--output', help='файл выгрузки (по умолчанию stdout)')
+    parser.add_argument('--database-url', default=os.environ.get('DATABASE_URL'))
+    parser.add_argument('--sqlite-path', default=os.environ.get('SQLITE_PATH', 'applications.db'))
+    parser.add_argument('--sslmode', default=os.environ.get('DB_SSLMODE', 'require'),
+                        help='sslmode для PostgreSQL, как DB_SSLMODE у бота (по умолчанию require)')
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.INFO)
+    date_to = args.date_to + timedelta(days=1) if args.date_to else None
+    storage = open_storage(args.database_url, args.sqlite_path, args.sslmode)
+    out = open(args.output, 'w', newline='', encoding='utf-8') if args.output else sys.stdout
+    try:
+        count = export_applications(storage, out, args.format, args.status, args.date_from, date_to)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+        storage.close()
+    if count is not None:
+        logging.info(f"✅ Выгружено заявок: {count}")
+
+
+if __name__ == '__main__':
+    main()
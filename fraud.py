@@ -0,0 +1,139 @@
+"""Поиск повторно использованных скриншотов
+
+Точные повторы ищутся в базе по file_unique_id (уникальный индекс), похожие
+изображения — по перцептивному хешу (dHash) в BK-дереве в памяти. Для хеша
+нужен Pillow; без него работает только поиск точных повторов.
+
+Проверка на локальных файлах:
+    python fraud.py screenshot1.jpg screenshot2.png
+"""
+import io
+import sys
+import threading
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow не обязателен
+    Image = None
+
+HASH_SIZE = 8
+
+
+def dhash(data, size=HASH_SIZE):
+    """Разностный хеш изображения (64 бита при size=8)
+
+    Изображение сжимается до (size+1)×size в оттенках серого, каждый бит —
+    «соседний справа пиксель светлее». Хеш устойчив к пересжатию и масштабу.
+    """
+    image = Image.open(io.BytesIO(data)).convert('L').resize((size + 1, size), Image.LANCZOS)
+    pixels = image.tobytes()
+    value = 0
+    for row in range(size):
+        for column in range(size):
+            left = pixels[row * (size + 1) + column]
+            right = pixels[row * (size + 1) + column + 1]
+            value = (value << 1) | (right > left)
+    return value
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+def to_signed(value):
+    """64-битный хеш → знаковое число для колонки BIGINT/INTEGER"""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def from_signed(value):
+    return value + (1 << 64) if value < 0 else value
+
+
+class BKTree:
+    """BK-дерево по расстоянию Хэмминга для поиска похожих хешей
+
+    Поиск в радиусе d обходит только поддеревья, ребра которых лежат в
+    [расстояние − d, расстояние + d], а не все хеши подряд.
+    """
+
+    def __init__(self):
+        # Узел: [хеш, значения с этим хешем, {расстояние: дочерний узел}]
+        self._root = None
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def add(self, value, item):
+        self._size += 1
+        if self._root is None:
+            self._root = [value, [item], {}]
+            return
+        node = self._root
+        while True:
+            distance = hamming(value, node[0])
+            if distance == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value, [item], {}]
+                return
+            node = child
+
+    def search(self, value, max_distance):
+        """Список (расстояние, значение) в радиусе max_distance, ближайшие первыми"""
+        found = []
+        stack = [self._root] if self._root else []
+        while stack:
+            node = stack.pop()
+            distance = hamming(value, node[0])
+            if distance <= max_distance:
+                found.extend((distance, item) for item in node[1])
+            for edge, child in node[2].items():
+                if distance - max_distance <= edge <= distance + max_distance:
+                    stack.append(child)
+        found.sort(key=lambda pair: pair[0])
+        return found
+
+
+class ScreenshotIndex:
+    """Потокобезопасный индекс хешей скриншотов: хеш → id заявки"""
+
+    def __init__(self, max_distance=6):
+        self.max_distance = max_distance
+        self._tree = BKTree()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._tree)
+
+    def load(self, pairs):
+        """Заполнение из базы: пары (хеш, id заявки)"""
+        with self._lock:
+            for value, app_id in pairs:
+                self._tree.add(from_signed(value), app_id)
+
+    def check_and_add(self, value, app_id):
+        """Похожие заявки (расстояние, id) и добавление хеша в индекс одной операцией"""
+        with self._lock:
+            matches = [match for match in self._tree.search(value, self.max_distance) if match[1] != app_id]
+            self._tree.add(value, app_id)
+        return matches
+
+
+def main(paths):
+    if Image is None:
+        sys.exit("Нужен Pillow: pip install Pillow")
+    hashes = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            hashes.append(dhash(f.read()))
+        print(f"{hashes[-1]:016x}  {path}")
+    for i in range(len(paths)):
+        for j in range(i + 1, len(paths)):
+            print(f"{hamming(hashes[i], hashes[j]):2d}  {paths[i]} ↔ {paths[j]}")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
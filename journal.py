@@ -0,0 +1,154 @@
+import json
+import logging
+import os
+import threading
+
+SEGMENT_PREFIX = 'segment-'
+SEGMENT_SUFFIX = '.jsonl'
+ACK_SUFFIX = '.ack'
+
+
+class Journal:
+    """Локальный журнал записей, которые еще не попали в базу данных
+
+    Append-only: каждая запись — строка JSON, дописывается в текущий сегмент
+    и сбрасывается на диск (fsync) до возврата из append(), поэтому принятая
+    заявка переживает и перезапуск процесса, и недоступность базы.
+    Сегмент закрывается по достижении segment_size байт или перед
+    воспроизведением. Воспроизведение идет по закрытым сегментам по порядку;
+    число примененных записей сегмента хранится в файле .ack, полностью
+    примененный сегмент удаляется.
+    """
+
+    def __init__(self, directory, segment_size=4 * 1024 * 1024, fsync=True):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        # Воспроизведение идет из одного потока за раз
+        self._replay_lock = threading.Lock()
+        self._file = None
+        self._backlog = 0
+
+        os.makedirs(directory, exist_ok=True)
+        segments = self._segments()
+        self._next_number = self._number(segments[-1]) + 1 if segments else 1
+        for path in segments:
+            self._backlog += len(self._read(path)) - self._acked(path)
+        if self._backlog:
+            logging.warning(f"⚠️ В журнале {self._backlog} записей, не попавших в базу")
+
+    @property
+    def backlog(self):
+        """Сколько записей ждет воспроизведения"""
+        return self._backlog
+
+    def append(self, record):
+        """Дописать запись и дождаться ее сброса на диск"""
+        line = (json.dumps(record, ensure_ascii=False, default=str) + '\n').encode()
+        with self._lock:
+            if self._file is None:
+                self._open_segment()
+            self._file.write(line)
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+            self._backlog += 1
+            if self._file.tell() >= self.segment_size:
+                self._close_segment()
+
+    def replay(self, apply_batch, batch_size=100):
+        """Воспроизведение накопленных записей пачками
+
+        apply_batch(records) применяет пачку одной транзакцией и возвращает
+        список результатов; при исключении воспроизведение останавливается
+        и продолжится со следующей пачки при следующем вызове.
+        Возвращает список (запись, результат) примененных записей.
+        """
+        applied = []
+        with self._replay_lock:
+            with self._lock:
+                self._close_segment()
+                segments = self._segments()
+            for path in segments:
+                records = self._read(path)
+                done = self._acked(path)
+                while done < len(records):
+                    batch = records[done:done + batch_size]
+                    results = apply_batch(batch)
+                    done += len(batch)
+                    self._ack(path, done)
+                    with self._lock:
+                        self._backlog -= len(batch)
+                    applied.extend(zip(batch, results))
+                os.remove(path)
+                if os.path.exists(path + ACK_SUFFIX):
+                    os.remove(path + ACK_SUFFIX)
+        return applied
+
+    def close(self):
+        with self._lock:
+            self._close_segment()
+
+    # ----- сегменты -----
+
+    def _segments(self):
+        names = sorted(
+            name for name in os.listdir(self.directory)
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX)
+        )
+        return [os.path.join(self.directory, name) for name in names]
+
+    @staticmethod
+    def _number(path):
+        return int(os.path.basename(path)[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)])
+
+    def _open_segment(self):
+        path = os.path.join(self.directory, f"{SEGMENT_PREFIX}{self._next_number:08d}{SEGMENT_SUFFIX}")
+        self._next_number += 1
+        self._file = open(path, 'ab')
+        if self.fsync:
+            # Новый файл должен пережить сбой вместе с записью в каталоге
+            self._fsync_directory()
+
+    def _close_segment(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _fsync_directory(self):
+        fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    @staticmethod
+    def _read(path):
+        records = []
+        with open(path, 'rb') as f:
+            for line_number, line in enumerate(f, 1):
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    # Недописанная строка после аварийной остановки: запись не была подтверждена
+                    logging.warning(f"⚠️ Пропущена поврежденная строка {line_number} журнала {path}")
+        return records
+
+    @staticmethod
+    def _acked(path):
+        try:
+            with open(path + ACK_SUFFIX) as f:
+                return int(f.read() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def _ack(self, path, count):
+        # Запись через временный файл: отметка либо старая, либо новая, но не битая
+        temporary = path + ACK_SUFFIX + '.tmp'
+        with open(temporary, 'w') as f:
+            f.write(str(count))
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        os.replace(temporary, path + ACK_SUFFIX)
@@ -0,0 +1,303 @@
+import bisect
+import contextvars
+import functools
+import logging
+import secrets
+import threading
+import time
+from http import HTTPStatus
+
+from telegram.ext import ApplicationHandlerStop
+from telegram.request import BaseRequest, HTTPXRequest
+
+# Идентификатор трассировки текущего обновления (попадает в журнал медленных операций)
+trace_id = contextvars.ContextVar('trace_id', default=None)
+
+# Порог медленной операции в секундах; None — журнал выключен
+slow_threshold = None
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in pairs
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """Базовая метрика с метками; значения хранятся по кортежу значений меток"""
+
+    type = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name}: ожидались метки {self.labelnames}")
+        return tuple(labels)
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in self._values.items()]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for name, key, value, *extra in self.samples():
+            lines.append(f"{name}{_format_labels(self.labelnames, key, *extra)} {_format_value(value)}")
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, *labels, amount=1):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(self._key(labels), 0)
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value, *labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, *labels, amount=1):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+
+class CallbackMetric(Metric):
+    """Метрика, значение которой читается функцией в момент выдачи /metrics
+
+    Функция возвращает число или словарь {кортеж значений меток: число}.
+    """
+
+    def __init__(self, name, documentation, function, labelnames=(), type='gauge'):
+        super().__init__(name, documentation, labelnames)
+        self.function = function
+        self.type = type
+
+    def samples(self):
+        try:
+            value = self.function()
+        except Exception as e:
+            logging.error(f"❌ Ошибка чтения метрики {self.name}: {e}")
+            return []
+        if isinstance(value, dict):
+            return [(self.name, tuple(key), item) for key, item in value.items()]
+        return [(self.name, (), value)]
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(state[0]), state[1], state[2]) for key, state in self._values.items()]
+        samples = []
+        for key, counts, total, count in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                samples.append((f"{self.name}_bucket", key, cumulative, ('le', _format_value(bound))))
+            samples.append((f"{self.name}_bucket", key, count, ('le', '+Inf')))
+            samples.append((f"{self.name}_sum", key, total))
+            samples.append((f"{self.name}_count", key, count))
+        return samples
+
+
+class Registry:
+    """Набор метрик, отдаваемых в текстовом формате Prometheus"""
+
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Метрика {metric.name} уже зарегистрирована")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def unregister(self, name):
+        self._metrics.pop(name, None)
+
+    def render(self):
+        return '\n'.join(metric.render() for metric in self._metrics.values()) + '\n'
+
+
+registry = Registry()
+
+HANDLER_DURATION = registry.register(Histogram(
+    'bot_handler_duration_seconds', 'Время работы обработчика обновления', ['handler']))
+HANDLER_ERRORS = registry.register(Counter(
+    'bot_handler_errors_total', 'Исключения в обработчиках обновлений', ['handler']))
+HANDLERS_IN_FLIGHT = registry.register(Gauge(
+    'bot_handlers_in_flight', 'Обработчики, выполняющиеся прямо сейчас', ['handler']))
+
+DB_DURATION = registry.register(Histogram(
+    'bot_db_duration_seconds', 'Время выполнения операции с базой данных', ['operation']))
+DB_ERRORS = registry.register(Counter(
+    'bot_db_errors_total', 'Неудачные операции с базой данных', ['operation']))
+DB_IN_FLIGHT = registry.register(Gauge(
+    'bot_db_in_flight', 'Операции с базой данных, выполняющиеся прямо сейчас'))
+DB_POOL_WAIT = registry.register(Histogram(
+    'bot_db_pool_wait_seconds', 'Ожидание свободного подключения в пуле'))
+
+API_DURATION = registry.register(Histogram(
+    'bot_api_duration_seconds', 'Время вызова метода Bot API', ['method']))
+API_ERRORS = registry.register(Counter(
+    'bot_api_errors_total', 'Вызовы Bot API, завершившиеся ошибкой', ['method']))
+API_IN_FLIGHT = registry.register(Gauge(
+    'bot_api_in_flight', 'Вызовы Bot API, выполняющиеся прямо сейчас'))
+
+
+def new_trace_id():
+    return secrets.token_hex(8)
+
+
+def report_slow(kind, name, elapsed):
+    """Запись в журнал медленных операций, если превышен порог"""
+    if slow_threshold is not None and elapsed >= slow_threshold:
+        logging.warning(f"🐢 Медленная операция [{trace_id.get() or '-'}] {kind}:{name} — {elapsed * 1000:.0f} мс")
+
+
+def instrument_handler(callback, name=None):
+    """Обертка обработчика PTB: время, ошибки, число выполняющихся и trace id"""
+    name = name or callback.__name__
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        token = trace_id.set(new_trace_id())
+        HANDLERS_IN_FLIGHT.inc(name)
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except ApplicationHandlerStop:
+            # Штатная остановка цепочки обработчиков (например, входящим лимитом), не ошибка
+            raise
+        except Exception:
+            HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            HANDLERS_IN_FLIGHT.dec(name)
+            HANDLER_DURATION.observe(elapsed, name)
+            report_slow('handler', name, elapsed)
+            trace_id.reset(token)
+
+    return wrapper
+
+
+def instrument_db(function, name=None):
+    """Обертка синхронной функции работы с БД (выполняется в потоке исполнителя)
+
+    Функции БД сообщают об ошибке значением False — оно тоже считается ошибкой.
+    """
+    name = name or function.__name__
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        DB_IN_FLIGHT.inc()
+        started = time.perf_counter()
+        try:
+            result = function(*args, **kwargs)
+        except Exception:
+            DB_ERRORS.inc(name)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            DB_IN_FLIGHT.dec()
+            DB_DURATION.observe(elapsed, name)
+            report_slow('db', name, elapsed)
+        if result is False:
+            DB_ERRORS.inc(name)
+        return result
+
+    return wrapper
+
+
+class InstrumentedRequest(BaseRequest):
+    """Реализация запросов PTB, измеряющая каждый вызов Bot API
+
+    Сами запросы выполняет вложенная реализация (по умолчанию HTTPXRequest).
+    """
+
+    def __init__(self, request=None, connection_pool_size=256):
+        self._request = request or HTTPXRequest(connection_pool_size=connection_pool_size)
+
+    @property
+    def read_timeout(self):
+        return self._request.read_timeout
+
+    async def initialize(self):
+        await self._request.initialize()
+
+    async def shutdown(self):
+        await self._request.shutdown()
+
+    async def do_request(self, url, method, *args, **kwargs):
+        api_method = url.rsplit('/', 1)[-1]
+        API_IN_FLIGHT.inc()
+        started = time.perf_counter()
+        try:
+            code, payload = await self._request.do_request(url, method, *args, **kwargs)
+        except Exception:
+            API_ERRORS.inc(api_method)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            API_IN_FLIGHT.dec()
+            API_DURATION.observe(elapsed, api_method)
+            report_slow('api', api_method, elapsed)
+        if not 200 <= code <= 299:
+            API_ERRORS.inc(api_method)
+        return code, payload
+
+
+async def metrics_endpoint(request):
+    """Маршрут /metrics для встроенного HTTP-сервера"""
+    return HTTPStatus.OK, 'text/plain; version=0.0.4; charset=utf-8', registry.render().encode()
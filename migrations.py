@@ -0,0 +1,299 @@
+import logging
+
+# Ключ advisory-блокировки: миграции выполняет только один процесс одновременно
+MIGRATION_LOCK_ID = 7_310_001
+
+# Миграции применяются по порядку версий и никогда не меняются после выката.
+# Новая схема — новая миграция в конце списка.
+MIGRATIONS = [
+    (1, 'create applications', '''
+        CREATE TABLE IF NOT EXISTS applications (
+            id SERIAL PRIMARY KEY,
+            user_id BIGINT,
+            username TEXT,
+            full_name TEXT,
+            screenshot_file_id TEXT,
+            contact_info TEXT,
+            status TEXT DEFAULT 'pending',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(user_id, status)  -- Защита от дублирования
+        )
+    '''),
+    (2, 'index pending applications by date', '''
+        CREATE INDEX IF NOT EXISTS applications_pending_created_idx
+            ON applications (created_at DESC, id DESC)
+            WHERE status = 'pending'
+    '''),
+    (3, 'one pending application per user', '''
+        -- UNIQUE(user_id, status) запрещал пользователю иметь две одобренные заявки;
+        -- ограничение нужно только для ожидающих
+        CREATE UNIQUE INDEX IF NOT EXISTS applications_pending_user_idx
+            ON applications (user_id)
+            WHERE status = 'pending';
+        ALTER TABLE applications DROP CONSTRAINT IF EXISTS applications_user_id_status_key;
+    '''),
+    (4, 'idempotency keys for journal replay', '''
+        ALTER TABLE applications ADD COLUMN IF NOT EXISTS idempotency_key TEXT;
+        CREATE UNIQUE INDEX IF NOT EXISTS applications_idempotency_key_idx
+            ON applications (idempotency_key)
+            WHERE idempotency_key IS NOT NULL;
+    '''),
+    (5, 'decision time and partitioned archive', '''
+        ALTER TABLE applications ADD COLUMN IF NOT EXISTS decided_at TIMESTAMP;
+        UPDATE applications SET decided_at = created_at WHERE status <> 'pending' AND decided_at IS NULL;
+        CREATE INDEX IF NOT EXISTS applications_finished_decided_idx
+            ON applications (decided_at)
+            WHERE status <> 'pending';
+        -- Разделы по месяцам decided_at создаются задачей архивации,
+        -- старый месяц удаляется целиком через DROP TABLE
+        CREATE TABLE IF NOT EXISTS applications_archive (
+            id INTEGER NOT NULL,
+            user_id BIGINT,
+            username TEXT,
+            full_name TEXT,
+            screenshot_file_id TEXT,
+            contact_info TEXT,
+            status TEXT NOT NULL,
+            created_at TIMESTAMP,
+            decided_at TIMESTAMP NOT NULL,
+            archived_at TIMESTAMP NOT NULL DEFAULT LOCALTIMESTAMP,
+            anonymized BOOLEAN NOT NULL DEFAULT FALSE,
+            PRIMARY KEY (id, decided_at)
+        ) PARTITION BY RANGE (decided_at);
+    '''),
+    (6, 'screenshot fingerprints', '''
+        -- Первая заявка с этим файлом; повторы находятся по первичному ключу
+        CREATE TABLE IF NOT EXISTS screenshot_fingerprints (
+            file_unique_id TEXT PRIMARY KEY,
+            application_id INTEGER NOT NULL,
+            phash BIGINT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        ALTER TABLE applications ADD COLUMN IF NOT EXISTS duplicate_of INTEGER;
+    '''),
+    (7, 'applicant search indexes', '''
+        CREATE INDEX IF NOT EXISTS applications_user_idx ON applications (user_id);
+        -- pg_trgm есть не у всех провайдеров; без него поиск идет через ILIKE без индекса
+        DO $$
+        BEGIN
+            CREATE EXTENSION IF NOT EXISTS pg_trgm;
+        EXCEPTION WHEN OTHERS THEN
+            RAISE WARNING 'pg_trgm недоступен, поиск заявок будет работать без индекса';
+        END $$;
+        -- Выражение индекса совпадает с SEARCH_DOCUMENT в storage.py
+        DO $$
+        BEGIN
+            IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm') THEN
+                CREATE INDEX IF NOT EXISTS applications_search_trgm_idx ON applications USING GIN (
+                    (coalesce(username, '') || ' ' || coalesce(full_name, '') || ' ' || coalesce(contact_info, ''))
+                    gin_trgm_ops
+                );
+            END IF;
+        END $$;
+    '''),
+    (8, 'funnel stats rollup', '''
+        -- Счетчики воронки: строка на (час или день, событие), пополняется сбросами из памяти
+        CREATE TABLE IF NOT EXISTS funnel_stats (
+            period TEXT NOT NULL,
+            bucket TIMESTAMP NOT NULL,
+            event TEXT NOT NULL,
+            count BIGINT NOT NULL DEFAULT 0,
+            PRIMARY KEY (period, bucket, event)
+        );
+    '''),
+    (9, 'processed updates', '''
+        -- update_id обработанных обновлений: повторная доставка в другой процесс отсекается
+        CREATE TABLE IF NOT EXISTS processed_updates (
+            update_id BIGINT PRIMARY KEY,
+            processed_at TIMESTAMP NOT NULL DEFAULT LOCALTIMESTAMP
+        );
+        CREATE INDEX IF NOT EXISTS processed_updates_processed_at_idx ON processed_updates (processed_at);
+    '''),
+]
+
+
+def current_version(cur):
+    cur.execute('SELECT COALESCE(MAX(version), 0) FROM schema_migrations')
+    return cur.fetchone()[0]
+
+
+def run_migrations(conn, migrations=MIGRATIONS):
+    """Применение недостающих миграций под advisory-блокировкой
+
+    Каждая миграция выполняется в своей транзакции вместе с записью версии
+    в schema_migrations, поэтому частично примененных миграций не бывает.
+    Возвращает номер версии схемы после применения.
+    """
+    cur = conn.cursor()
+    cur.execute('SELECT pg_advisory_lock(%s)', (MIGRATION_LOCK_ID,))
+    try:
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        conn.commit()
+
+        version = current_version(cur)
+        for number, name, sql in sorted(migrations):
+            if number <= version:
+                continue
+            try:
+                cur.execute(sql)
+                cur.execute('INSERT INTO schema_migrations (version, name) VALUES (%s, %s)', (number, name))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                logging.error(f"❌ Ошибка миграции {number} ({name})")
+                raise
+            version = number
+            logging.info(f"✅ Применена миграция {number}: {name}")
+        return version
+    finally:
+        cur.execute('SELECT pg_advisory_unlock(%s)', (MIGRATION_LOCK_ID,))
+        conn.commit()
+
+
+# Та же схема для встроенного SQLite: номера версий совпадают с MIGRATIONS.
+# created_at хранится текстом с микросекундами, чтобы сравнение строк
+# совпадало с сравнением времени (нужно для keyset-пагинации).
+SQLITE_MIGRATIONS = [
+    (1, 'create applications', '''
+        CREATE TABLE IF NOT EXISTS applications (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            username TEXT,
+            full_name TEXT,
+            screenshot_file_id TEXT,
+            contact_info TEXT,
+            status TEXT DEFAULT 'pending',
+            created_at TEXT DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime') || '000')
+        );
+    '''),
+    (2, 'index pending applications by date', '''
+        CREATE INDEX IF NOT EXISTS applications_pending_created_idx
+            ON applications (created_at DESC, id DESC)
+            WHERE status = 'pending';
+    '''),
+    (3, 'one pending application per user', '''
+        CREATE UNIQUE INDEX IF NOT EXISTS applications_pending_user_idx
+            ON applications (user_id)
+            WHERE status = 'pending';
+    '''),
+    (4, 'idempotency keys for journal replay', '''
+        ALTER TABLE applications ADD COLUMN idempotency_key TEXT;
+        CREATE UNIQUE INDEX IF NOT EXISTS applications_idempotency_key_idx
+            ON applications (idempotency_key)
+            WHERE idempotency_key IS NOT NULL;
+    '''),
+    (5, 'decision time and archive', '''
+        ALTER TABLE applications ADD COLUMN decided_at TEXT;
+        UPDATE applications SET decided_at = created_at WHERE status <> 'pending' AND decided_at IS NULL;
+        CREATE INDEX IF NOT EXISTS applications_finished_decided_idx
+            ON applications (decided_at)
+            WHERE status <> 'pending';
+        -- В SQLite нет секционирования: старый архив удаляется по индексу decided_at
+        CREATE TABLE IF NOT EXISTS applications_archive (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER,
+            username TEXT,
+            full_name TEXT,
+            screenshot_file_id TEXT,
+            contact_info TEXT,
+            status TEXT NOT NULL,
+            created_at TEXT,
+            decided_at TEXT NOT NULL,
+            archived_at TEXT DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime') || '000'),
+            anonymized INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS applications_archive_decided_idx
+            ON applications_archive (decided_at);
+    '''),
+    (6, 'screenshot fingerprints', '''
+        CREATE TABLE IF NOT EXISTS screenshot_fingerprints (
+            file_unique_id TEXT PRIMARY KEY,
+            application_id INTEGER NOT NULL,
+            phash INTEGER,
+            created_at TEXT DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime') || '000')
+        );
+        ALTER TABLE applications ADD COLUMN duplicate_of INTEGER;
+    '''),
+    (7, 'applicant search indexes', '''
+        CREATE INDEX IF NOT EXISTS applications_user_idx ON applications (user_id);
+        -- Внешнее содержимое: FTS хранит только индекс триграмм, строки берутся из applications
+        CREATE VIRTUAL TABLE IF NOT EXISTS applications_search USING fts5 (
+            username, full_name, contact_info,
+            content = 'applications', content_rowid = 'id', tokenize = 'trigram'
+        );
+        CREATE TRIGGER IF NOT EXISTS applications_search_insert AFTER INSERT ON applications BEGIN
+            INSERT INTO applications_search (rowid, username, full_name, contact_info)
+            VALUES (new.id, new.username, new.full_name, new.contact_info);
+        END;
+        CREATE TRIGGER IF NOT EXISTS applications_search_delete AFTER DELETE ON applications BEGIN
+            INSERT INTO applications_search (applications_search, rowid, username, full_name, contact_info)
+            VALUES ('delete', old.id, old.username, old.full_name, old.contact_info);
+        END;
+        CREATE TRIGGER IF NOT EXISTS applications_search_update
+        AFTER UPDATE OF username, full_name, contact_info ON applications BEGIN
+            INSERT INTO applications_search (applications_search, rowid, username, full_name, contact_info)
+            VALUES ('delete', old.id, old.username, old.full_name, old.contact_info);
+            INSERT INTO applications_search (rowid, username, full_name, contact_info)
+            VALUES (new.id, new.username, new.full_name, new.contact_info);
+        END;
+        INSERT INTO applications_search (applications_search) VALUES ('rebuild');
+    '''),
+    (8, 'funnel stats rollup', '''
+        CREATE TABLE IF NOT EXISTS funnel_stats (
+            period TEXT NOT NULL,
+            bucket TEXT NOT NULL,
+            event TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (period, bucket, event)
+        ) WITHOUT ROWID;
+    '''),
+    (9, 'processed updates', '''
+        CREATE TABLE IF NOT EXISTS processed_updates (
+            update_id INTEGER PRIMARY KEY,
+            processed_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime') || '000')
+        );
+        CREATE INDEX IF NOT EXISTS processed_updates_processed_at_idx ON processed_updates (processed_at);
+    '''),
+]
+
+
+def run_sqlite_migrations(conn, migrations=SQLITE_MIGRATIONS):
+    """Применение недостающих миграций к базе SQLite
+
+    Вместо advisory-блокировки — BEGIN IMMEDIATE: пока миграция идет,
+    другие процессы не могут писать в файл базы.
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    version = conn.execute('SELECT COALESCE(MAX(version), 0) FROM schema_migrations').fetchone()[0]
+    for number, name, sql in sorted(migrations):
+        if number <= version:
+            continue
+        escaped_name = name.replace("'", "''")
+        try:
+            # executescript выполняет несколько команд; транзакция открывается в самом скрипте
+            conn.executescript(f'''
+                BEGIN IMMEDIATE;
+                {sql}
+                INSERT OR IGNORE INTO schema_migrations (version, name) VALUES ({number}, '{escaped_name}');
+                COMMIT;
+            ''')
+        except Exception:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            logging.error(f"❌ Ошибка миграции {number} ({name})")
+            raise
+        version = number
+        logging.info(f"✅ Применена миграция {number}: {name}")
+    return version
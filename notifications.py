@@ -0,0 +1,83 @@
+import asyncio
+import logging
+
+MODE_IMMEDIATE = 'immediate'
+MODE_DIGEST = 'digest'
+
+
+class AdminNotifier:
+    """Уведомления администратора о новых заявках
+
+    В режиме digest события копятся в буфере и отправляются одним
+    сообщением раз в interval секунд или сразу по достижении max_items.
+    В режиме immediate каждое событие отправляется отдельно. В обоих
+    режимах notify() не ждет отправки — ответ пользователю не задерживается.
+
+    deliver — корутина, получающая список событий и отправляющая их.
+    """
+
+    def __init__(self, deliver, mode=MODE_DIGEST, interval=60, max_items=10):
+        if mode not in (MODE_IMMEDIATE, MODE_DIGEST):
+            raise ValueError(f"Неизвестный режим уведомлений: {mode}")
+        self.deliver = deliver
+        self.mode = mode
+        self.interval = interval
+        self.max_items = max_items
+        self._buffer = []
+        self._timer = None
+        self._tasks = set()
+
+    @property
+    def pending(self):
+        return len(self._buffer)
+
+    async def start(self):
+        if self.mode == MODE_DIGEST and self._timer is None:
+            self._timer = asyncio.create_task(self._flush_periodically())
+
+    async def stop(self):
+        """Остановка с отправкой накопленного"""
+        if self._timer:
+            self._timer.cancel()
+            await asyncio.gather(self._timer, return_exceptions=True)
+            self._timer = None
+        self._spawn_flush()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def notify(self, event):
+        """Зарегистрировать событие (не блокирует)"""
+        if self.mode == MODE_IMMEDIATE:
+            self._spawn(self._safe_deliver([event]))
+            return
+        self._buffer.append(event)
+        if len(self._buffer) >= self.max_items:
+            self._spawn_flush()
+
+    async def flush(self):
+        """Немедленная отправка накопленных событий"""
+        self._spawn_flush()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def _spawn_flush(self):
+        while self._buffer:
+            batch = self._buffer[:self.max_items]
+            del self._buffer[:self.max_items]
+            self._spawn(self._safe_deliver(batch))
+
+    def _spawn(self, coroutine):
+        task = asyncio.create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            self._spawn_flush()
+
+    async def _safe_deliver(self, events):
+        try:
+            await self.deliver(events)
+        except Exception as e:
+            logging.error(f"❌ Ошибка отправки уведомления админу: {e}")
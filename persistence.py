@@ -0,0 +1,131 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+
+class SQLitePersistence(BasePersistence):
+    """Хранение user_data бота в локальном файле SQLite
+
+    PTB держит все user_data в памяти и раз в update_interval секунд
+    передает измененные записи сюда. Записи одного такого прохода
+    копятся и пишутся одной транзакцией в пуле потоков, не блокируя
+    event loop; при остановке остаток пишется в flush().
+    Остальные данные (chat_data, bot_data, диалоги) не сохраняются.
+    """
+
+    def __init__(self, path, update_interval=5):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.path = path
+        # user_id -> данные для записи; None или пустой словарь — удаление строки
+        self._pending = {}
+        self._flush_task = None
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS user_data (
+                user_id INTEGER PRIMARY KEY,
+                data TEXT NOT NULL
+            )
+        ''')
+
+    # ----- user_data -----
+
+    async def get_user_data(self):
+        with self._lock:
+            rows = self._conn.execute('SELECT user_id, data FROM user_data').fetchall()
+        return {user_id: json.loads(data) for user_id, data in rows}
+
+    async def update_user_data(self, user_id, data):
+        self._schedule(user_id, data)
+
+    async def drop_user_data(self, user_id):
+        self._schedule(user_id, None)
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    def _schedule(self, user_id, data):
+        self._pending[user_id] = data
+        if self._flush_task is None:
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_batch())
+
+    async def _flush_batch(self):
+        # Дожидаемся, пока PTB передаст все записи текущего прохода
+        await asyncio.sleep(0)
+        self._flush_task = None
+        pending, self._pending = self._pending, {}
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self._write, pending)
+        except Exception as e:
+            # Записи вернутся в следующую пачку, если их не успели обновить
+            for user_id, data in pending.items():
+                self._pending.setdefault(user_id, data)
+            logging.error(f"❌ Ошибка сохранения состояния пользователей: {e}")
+
+    def _write(self, pending):
+        upserts = [
+            (user_id, json.dumps(data, ensure_ascii=False)) for user_id, data in pending.items() if data
+        ]
+        deletes = [(user_id,) for user_id, data in pending.items() if not data]
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                self._conn.executemany('INSERT OR REPLACE INTO user_data (user_id, data) VALUES (?, ?)', upserts)
+                self._conn.executemany('DELETE FROM user_data WHERE user_id = ?', deletes)
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+
+    async def flush(self):
+        if self._flush_task is not None:
+            await self._flush_task
+        if self._pending:
+            pending, self._pending = self._pending, {}
+            self._write(pending)
+        with self._lock:
+            self._conn.close()
+
+    # ----- не сохраняется -----
+
+    async def get_chat_data(self):
+        return {}
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def get_bot_data(self):
+        return {}
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def get_callback_data(self):
+        return None
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def get_conversations(self, name):
+        return {}
+
+    async def update_conversation(self, name, key, new_state):
+        pass
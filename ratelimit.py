@@ -0,0 +1,99 @@
+import time
+from collections import OrderedDict
+
+
+class TokenBucket:
+    """Классический token bucket: rate токенов в секунду, не больше capacity"""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate, capacity, now=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated = time.monotonic() if now is None else now
+
+    def _refill(self, now):
+        elapsed = now - self.updated
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated = now
+
+    def try_acquire(self, tokens=1, now=None):
+        """Списать токены, если они есть; возвращает True при успехе"""
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return True
+        return False
+
+    def delay(self, tokens=1, now=None):
+        """Через сколько секунд станет доступно нужное число токенов"""
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        if self.tokens >= tokens:
+            return 0.0
+        return (tokens - self.tokens) / self.rate
+
+
+class InboundBucket(TokenBucket):
+    """Корзина входящих обновлений: плюс отметка «предупреждение уже отправлено»"""
+
+    __slots__ = ('warned',)
+
+    def __init__(self, rate, capacity, now=None):
+        super().__init__(rate, capacity, now)
+        self.warned = False
+
+
+class InboundLimiter:
+    """Лимит входящих обновлений по ключу (user_id) с ограниченной памятью
+
+    Корзины лежат в OrderedDict в порядке последнего обращения; самые старые
+    удаляются, если ключей больше max_keys или корзина простаивает дольше
+    idle_ttl. По умолчанию idle_ttl — время полного наполнения корзины:
+    удаленная корзина к этому моменту все равно была бы полной, поэтому
+    удаление ничего не меняет для пользователя.
+    Вызывается только из event loop, блокировки не нужны.
+    """
+
+    def __init__(self, rate, burst, max_keys=20000, idle_ttl=None):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.max_keys = max_keys
+        self.idle_ttl = idle_ttl if idle_ttl is not None else self.burst / self.rate
+        self.dropped = 0
+        self._buckets = OrderedDict()
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def check(self, key, now=None):
+        """Пропускать ли обновление: (пропустить, нужно_предупредить)
+
+        Предупреждение одно на серию обновлений, отброшенных подряд.
+        """
+        now = time.monotonic() if now is None else now
+        self._evict(now)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = InboundBucket(self.rate, self.burst, now)
+        else:
+            self._buckets.move_to_end(key)
+
+        if bucket.try_acquire(now=now):
+            bucket.warned = False
+            return True, False
+        self.dropped += 1
+        warn = not bucket.warned
+        bucket.warned = True
+        return False, warn
+
+    def _evict(self, now):
+        buckets = self._buckets
+        while buckets:
+            key, oldest = next(iter(buckets.items()))
+            if len(buckets) < self.max_keys and now - oldest.updated < self.idle_ttl:
+                break
+            del buckets[key]
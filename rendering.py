@@ -0,0 +1,154 @@
+"""Тексты и клавиатуры бота: шаблоны локалей, собранные один раз при запуске
+
+Шаблоны лежат в locales/<язык>.toml. При загрузке каждый шаблон
+превращается в готовую строку MarkdownV2: постоянный текст экранирован
+заранее, остаются только места для полей пользователя. Экран без полей
+(условия, инструкция) и все клавиатуры — неизменяемые объекты, которые
+отдаются обработчикам без сборки заново. Значения полей экранируются при
+каждой подстановке, поэтому _ и * в именах не ломают разметку.
+
+Проверка шаблонов:
+    python rendering.py locales
+"""
+import string
+import sys
+import tomllib
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.constants import ParseMode
+
+PARSE_MODE = ParseMode.MARKDOWN_V2
+
+
+# Те же символы, что экранирует telegram.helpers.escape_markdown(version=2);
+# таблица для str.translate в несколько раз быстрее re.sub на коротких полях
+ESCAPES = str.maketrans({char: '\\' + char for char in '\\_*[]()~`>#+-=|{}.!'})
+
+
+def escape(value):
+    """Произвольный текст → MarkdownV2 без разметки"""
+    return str(value).translate(ESCAPES)
+
+
+class Markup(str):
+    """Уже размеченный текст MarkdownV2: подставляется в шаблон без экранирования"""
+
+
+def code_block(text):
+    """Моноширинный блок MarkdownV2 (таблицы); внутри экранируются только ` и \\"""
+    return Markup('```\n' + text.replace('\\', '\\\\').replace('`', '\\`') + '\n```')
+
+
+class Screen(NamedTuple):
+    text: str
+    reply_markup: Optional[InlineKeyboardMarkup]
+
+
+class Template:
+    """Один шаблон локали, разобранный при загрузке
+
+    Постоянные части текста экранируются сразу, разметка *жирный*
+    сохраняется. Поля остаются местами {0}, {1}… в строке формата,
+    формат поля ({time:%H:%M}) применяется до экранирования значения.
+    """
+
+    def __init__(self, name, text, keyboard=None, params=None):
+        self.name = name
+        self.fields = []
+        pattern = []
+        for literal, field, spec, conversion in string.Formatter().parse(text.strip()):
+            pattern.append(self._literal(literal))
+            if field is None:
+                continue
+            if conversion or not field.isidentifier():
+                raise ValueError(f"Шаблон {name}: поддерживаются только поля вида {{имя}} или {{имя:формат}}")
+            if params and field in params:
+                pattern.append(escape(format(params[field], spec)).replace('{', '{{').replace('}', '}}'))
+            else:
+                pattern.append(f'{{{len(self.fields)}}}')
+                self.fields.append((field, spec))
+        self.pattern = ''.join(pattern)
+        try:
+            self.reply_markup = build_keyboard(keyboard, params) if keyboard else None
+        except KeyError as e:
+            raise ValueError(f"Шаблон {name}: в клавиатуре неизвестный параметр {e}") from None
+        # Экран без полей собирается один раз
+        self.screen = None if self.fields else Screen(self.pattern.format(), self.reply_markup)
+
+    @staticmethod
+    def _literal(text):
+        # Звездочки — разметка, остальное экранируется; фигурные скобки удваиваются для str.format
+        escaped = '*'.join(escape(part) for part in text.split('*'))
+        return escaped.replace('{', '{{').replace('}', '}}')
+
+    def render(self, fields):
+        if self.screen:
+            return self.screen
+        values = []
+        for field, spec in self.fields:
+            value = fields[field]
+            values.append(value if isinstance(value, Markup) else escape(format(value, spec)))
+        return Screen(self.pattern.format(*values), self.reply_markup)
+
+
+def build_keyboard(rows, params=None):
+    """Строки кнопок из шаблона → InlineKeyboardMarkup (url и текст могут содержать параметры)"""
+    params = params or {}
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton(**{key: value.format(**params) for key, value in button.items()}) for button in row]
+        for row in rows
+    ])
+
+
+class Catalog:
+    """Шаблоны всех локалей из каталога, загруженные при создании
+
+    Локаль выбирается по language_code пользователя (en-US → en); если
+    такой нет, используется default. Ключи, которых нет в локали, берутся
+    из default. params — постоянные значения (ссылки), подставляются в
+    шаблоны и клавиатуры один раз при загрузке.
+    """
+
+    def __init__(self, directory, default='ru', **params):
+        self.default = default
+        self._locales = {}
+        for path in sorted(Path(directory).glob('*.toml')):
+            with open(path, 'rb') as f:
+                data = tomllib.load(f)
+            self._locales[path.stem] = {
+                name: Template(name, item['text'], item.get('keyboard'), params) for name, item in data.items()
+            }
+        if default not in self._locales:
+            raise ValueError(f"Нет шаблонов локали по умолчанию: {Path(directory) / default}.toml")
+        base = self._locales[default]
+        for locale, templates in self._locales.items():
+            self._locales[locale] = {**base, **templates}
+
+    @property
+    def locales(self):
+        return list(self._locales)
+
+    def locale(self, language_code=None):
+        code = (language_code or '').split('-', 1)[0].lower()
+        return code if code in self._locales else self.default
+
+    def render(self, name, language_code=None, **fields):
+        """Текст и клавиатура шаблона name на языке пользователя"""
+        return self._locales[self.locale(language_code)][name].render(fields)
+
+    def text(self, name, language_code=None, **fields):
+        return self.render(name, language_code, **fields).text
+
+
+def main(directory):
+    catalog = Catalog(directory, ref_link='https://example.com/ref', support_url='https://t.me/support')
+    for locale in catalog.locales:
+        templates = catalog._locales[locale]
+        static = sum(1 for template in templates.values() if template.screen)
+        print(f"{locale}: шаблонов {len(templates)}, без полей {static}")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1] if len(sys.argv) > 1 else Path(__file__).with_name('locales'))
@@ -0,0 +1,210 @@
+import asyncio
+import contextvars
+import logging
+import time
+from collections import deque
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TimedOut
+
+from ratelimit import TokenBucket
+
+
+class OutboundSender:
+    """Очередь исходящих сообщений с соблюдением лимитов Telegram
+
+    У каждого чата своя очередь; чаты, которым можно отправлять, стоят в
+    общей очереди готовых, откуда их по одному сообщению забирают воркеры.
+    Чат обслуживает не больше одного воркера сразу, поэтому сообщения чата
+    уходят в порядке постановки, а занятый или ограниченный чат не держит
+    остальные. Все отправки проходят через общий token bucket (лимит бота)
+    и bucket чата. RetryAfter приостанавливает только чат, которому Telegram
+    его вернул, сетевые сбои повторяются с экспоненциальной задержкой —
+    тоже без воркера: чат возвращается в очередь готовых по таймеру.
+
+    Методы send_* возвращают asyncio.Future: его можно дождаться, чтобы
+    получить результат или ошибку, или не ждать — ошибки попадут в лог.
+    """
+
+    def __init__(self, bot, global_rate=30, per_chat_rate=1, per_chat_burst=3,
+                 workers=8, max_retries=5, base_backoff=0.5, max_backoff=30):
+        self.bot = bot
+        self.workers = workers
+        self.per_chat_rate = per_chat_rate
+        self.per_chat_burst = per_chat_burst
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+
+        self._global_bucket = TokenBucket(global_rate, global_rate)
+        self._chat_buckets = {}
+        # chat_id -> deque сообщений; чат есть здесь, пока у него что-то не отправлено
+        self._chats = {}
+        # chat_id -> время, до которого чат приостановлен (RetryAfter или повтор после сбоя)
+        self._paused_until = {}
+        self._ready = asyncio.Queue()
+        self._timers = set()
+        self._drained = asyncio.Event()
+        self._drained.set()
+        self._workers = []
+
+    # ----- жизненный цикл -----
+
+    async def start(self):
+        if not self._workers:
+            self._workers = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, timeout=10):
+        """Остановка с попыткой отправить то, что уже в очереди"""
+        if not self._workers:
+            return
+        try:
+            await asyncio.wait_for(self._drained.wait(), timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f"⚠️ Не отправлено сообщений при остановке: {self.depth}")
+        for timer in self._timers:
+            timer.cancel()
+        self._timers.clear()
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    @property
+    def depth(self):
+        """Сколько сообщений ждет отправки или отправляется прямо сейчас"""
+        return sum(len(queue) for queue in self._chats.values())
+
+    # ----- отправка -----
+
+    def send_message(self, chat_id, **kwargs):
+        return self.submit('send_message', chat_id, **kwargs)
+
+    def send_photo(self, chat_id, **kwargs):
+        return self.submit('send_photo', chat_id, **kwargs)
+
+    def send_media_group(self, chat_id, **kwargs):
+        return self.submit('send_media_group', chat_id, **kwargs)
+
+    def send_document(self, chat_id, **kwargs):
+        return self.submit('send_document', chat_id, **kwargs)
+
+    def submit(self, method, chat_id, **kwargs):
+        """Поставить вызов Bot API в очередь чата"""
+        future = asyncio.get_running_loop().create_future()
+        # Ошибка уже залогирована воркером, не ругаемся на «never retrieved»
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        queue = self._chats.get(chat_id)
+        if queue is None:
+            # Новый чат сразу готов; чат с очередью уже готов, обслуживается или ждет таймера
+            queue = self._chats[chat_id] = deque()
+            self._ready.put_nowait(chat_id)
+            self._drained.clear()
+        # Сообщение: [метод, аргументы, future, контекст вызывающего, сбоев, RetryAfter].
+        # Контекст (например, trace id обновления) сохраняется и для отправки
+        queue.append([method, kwargs, future, contextvars.copy_context(), 0, 0])
+        return future
+
+    async def _worker(self):
+        while True:
+            chat_id = await self._ready.get()
+            try:
+                delay = await self._serve(chat_id)
+            except asyncio.CancelledError:
+                for message in self._chats.pop(chat_id, ()):
+                    message[2].cancel()
+                raise
+            if not self._chats[chat_id]:
+                del self._chats[chat_id]
+                self._paused_until.pop(chat_id, None)
+                if not self._chats:
+                    self._drained.set()
+            elif delay > 0:
+                self._schedule(chat_id, delay)
+            else:
+                # В конец очереди готовых: чаты с длинной очередью не забирают все отправки
+                self._ready.put_nowait(chat_id)
+
+    def _schedule(self, chat_id, delay):
+        """Вернуть чат в очередь готовых через delay секунд"""
+        def ready():
+            self._timers.discard(timer)
+            self._ready.put_nowait(chat_id)
+        timer = asyncio.get_running_loop().call_later(delay, ready)
+        self._timers.add(timer)
+
+    async def _serve(self, chat_id):
+        """Попытка отправить первое сообщение чата; возвращает, сколько чату еще ждать"""
+        queue = self._chats[chat_id]
+        message = queue[0]
+        method, kwargs, future, context = message[:4]
+        if future.cancelled():
+            queue.popleft()
+            return 0
+
+        delay = await self._wait_for_slot(chat_id)
+        if delay > 0:
+            return delay
+        try:
+            result = await asyncio.create_task(self._call(method, chat_id, kwargs), context=context)
+        except RetryAfter as e:
+            message[5] += 1
+            if message[5] > self.max_retries:
+                return self._fail(queue, method, chat_id, e)
+            logging.warning(f"⚠️ Telegram просит подождать {e.retry_after} с перед отправкой в чат {chat_id}")
+            return self._pause(chat_id, e.retry_after)
+        except (BadRequest, Forbidden) as e:
+            # Повтор не поможет: неверный запрос или пользователь заблокировал бота
+            return self._fail(queue, method, chat_id, e)
+        except (TimedOut, NetworkError) as e:
+            if message[4] >= self.max_retries:
+                return self._fail(queue, method, chat_id, e)
+            delay = min(self.max_backoff, self.base_backoff * 2 ** message[4])
+            message[4] += 1
+            logging.warning(f"⚠️ Сбой отправки в чат {chat_id} ({e}), повтор через {delay:.1f} с")
+            return self._pause(chat_id, delay)
+        except Exception as e:
+            return self._fail(queue, method, chat_id, e)
+        queue.popleft()
+        if not future.done():
+            future.set_result(result)
+        return 0
+
+    async def _call(self, method, chat_id, kwargs):
+        return await getattr(self.bot, method)(chat_id=chat_id, **kwargs)
+
+    def _pause(self, chat_id, delay):
+        self._paused_until[chat_id] = time.monotonic() + delay
+        return delay
+
+    @staticmethod
+    def _fail(queue, method, chat_id, error):
+        logging.error(f"❌ Ошибка отправки {method} в чат {chat_id}: {error}")
+        future = queue.popleft()[2]
+        if not future.done():
+            future.set_exception(error)
+        return 0
+
+    async def _wait_for_slot(self, chat_id):
+        """Ожидание глобального лимита; лимит и пауза чата возвращаются как задержка чата"""
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.per_chat_rate, self.per_chat_burst)
+        now = time.monotonic()
+        delay = max(self._paused_until.get(chat_id, 0) - now, bucket.delay(now=now))
+        if delay > 0:
+            return delay
+        # Глобальный лимит общий для всех чатов — его воркер ждет сам
+        while not self._global_bucket.try_acquire(now=now):
+            await asyncio.sleep(self._global_bucket.delay(now=now))
+            now = time.monotonic()
+        bucket.try_acquire(now=now)
+        self._prune_chat_buckets(now)
+        return 0
+
+    def _prune_chat_buckets(self, now):
+        # Полные bucket'ы ничего не ограничивают — их можно забыть
+        if len(self._chat_buckets) > 10000:
+            self._chat_buckets = {
+                chat_id: bucket for chat_id, bucket in self._chat_buckets.items()
+                if bucket.delay(bucket.capacity, now) > 0
+            }
@@ -0,0 +1,100 @@
+"""Счетчики воронки пользователей
+
+Обработчики увеличивают счетчики в памяти — без обращения к базе. Фоновая
+задача сбрасывает накопленное в таблицу funnel_stats одной пачкой: строка
+на (час, событие) и на (день, событие) прибавляется к уже записанной.
+/stats читает несколько готовых строк вместо подсчета по applications.
+"""
+import threading
+from datetime import datetime, timedelta
+
+# События воронки в порядке шагов и их подписи в /stats
+EVENTS = {
+    'start': '/start',
+    'show_terms': 'Условия',
+    'get_link': 'Ссылка',
+    'instruction': 'Инструкция',
+    'screenshot': 'Скриншот',
+    'contact': 'Реквизиты',
+    'approved': 'Одобрено',
+    'rejected': 'Отклонено',
+}
+
+PERIOD_HOUR = 'hour'
+PERIOD_DAY = 'day'
+
+# Окна /stats в порядке колонок и их подписи
+WINDOW_DAY = '24h'
+WINDOW_WEEK = '7d'
+WINDOW_MONTH = '30d'
+WINDOW_ALL = 'all'
+WINDOWS = {
+    WINDOW_DAY: '24 ч',
+    WINDOW_WEEK: '7 дн',
+    WINDOW_MONTH: '30 дн',
+    WINDOW_ALL: 'всего',
+}
+
+
+def hour_start(value):
+    return value.replace(minute=0, second=0, microsecond=0)
+
+
+def day_start(value):
+    return value.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def rollup(items):
+    """(час, событие, число) → строки таблицы (период, начало периода, событие, число)"""
+    rows = {}
+    for hour, event, count in items:
+        for key in ((PERIOD_HOUR, hour, event), (PERIOD_DAY, day_start(hour), event)):
+            rows[key] = rows.get(key, 0) + count
+    return [key + (count,) for key, count in rows.items()]
+
+
+def windows(now):
+    """Окна /stats: ключ окна (WINDOW_*) → (период строк, начало окна или None — за все время)"""
+    return {
+        WINDOW_DAY: (PERIOD_HOUR, hour_start(now) - timedelta(hours=23)),
+        WINDOW_WEEK: (PERIOD_DAY, day_start(now) - timedelta(days=6)),
+        WINDOW_MONTH: (PERIOD_DAY, day_start(now) - timedelta(days=29)),
+        WINDOW_ALL: (PERIOD_DAY, None),
+    }
+
+
+class FunnelCounters:
+    """Потокобезопасные счетчики событий по часам, еще не записанные в базу"""
+
+    def __init__(self):
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._counts)
+
+    def bump(self, event, amount=1, now=None):
+        key = (hour_start(now or datetime.now()), event)
+        with self._lock:
+            self._counts[key] = self._counts.get(key, 0) + amount
+
+    def drain(self):
+        """Забрать накопленное списком (час, событие, число) и обнулить счетчики"""
+        with self._lock:
+            counts, self._counts = self._counts, {}
+        return [(hour, event, count) for (hour, event), count in counts.items()]
+
+    def restore(self, items):
+        """Вернуть пачку, которую не удалось записать: она уйдет со следующим сбросом"""
+        with self._lock:
+            for hour, event, count in items:
+                self._counts[(hour, event)] = self._counts.get((hour, event), 0) + count
+
+    def pending(self, since=None):
+        """Незаписанные счетчики {событие: число} начиная с момента since"""
+        totals = {}
+        with self._lock:
+            for (hour, event), count in self._counts.items():
+                if since is None or hour >= since:
+                    totals[event] = totals.get(event, 0) + count
+        return totals
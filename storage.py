@@ -0,0 +1,902 @@
+import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import psycopg2
+
+import metrics
+from db_pool import PoolUnavailableError
+from migrations import run_migrations, run_sqlite_migrations
+
+# Порядок колонок строки заявки, который ожидают обработчики бота
+COLUMNS = 'id, user_id, username, full_name, screenshot_file_id, contact_info, status, created_at'
+
+# Колонки с персональными данными: при анонимизации в архив они попадают пустыми
+PERSONAL_COLUMNS = 'user_id, username, full_name, screenshot_file_id, contact_info'
+ANONYMIZED_COLUMNS = 'NULL, NULL, NULL, NULL, NULL'
+
+# Текст, по которому ищет /find в PostgreSQL; совпадает с выражением триграммного индекса
+SEARCH_DOCUMENT = "(coalesce(username, '') || ' ' || coalesce(full_name, '') || ' ' || coalesce(contact_info, ''))"
+
+
+def month_start(value):
+    return value.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_months(value, months):
+    """Первое число месяца через months месяцев (может быть отрицательным)"""
+    index = value.year * 12 + value.month - 1 + months
+    return month_start(value).replace(year=index // 12, month=index % 12 + 1)
+
+
+class Storage:
+    """Хранилище заявок: общий интерфейс для PostgreSQL и встроенного SQLite
+
+    Методы выполняют ровно один запрос (кроме потокового чтения) и бросают
+    исключения базы как есть — логирование, состояние подачи и правила
+    переходов остаются в функциях работы с данными в bot.py.
+    Заявка возвращается кортежем в порядке COLUMNS, created_at — datetime.
+    """
+
+    name = None
+    # Ошибки «база временно недоступна»: запись можно отложить в журнал
+    transient_errors = ()
+
+    def is_transient(self, error):
+        """Ошибка временная: запись можно отложить в журнал и повторить позже"""
+        return isinstance(error, self.transient_errors)
+
+    def migrate(self):
+        """Применение миграций схемы, возвращает версию схемы"""
+        raise NotImplementedError
+
+    def close(self):
+        raise NotImplementedError
+
+    def create_pending(self, user_id, username, full_name, screenshot_file_id):
+        """Новая ожидающая заявка; None, если у пользователя уже есть ожидающая"""
+        raise NotImplementedError
+
+    def attach_contact(self, user_id, contact_info):
+        """Реквизиты в ожидающую заявку пользователя; id заявки или None"""
+        raise NotImplementedError
+
+    def set_status(self, app_id, status, from_status):
+        """Смена статуса, только если текущий — from_status; user_id или None"""
+        raise NotImplementedError
+
+    def set_status_many(self, app_ids, status, from_status, older_than=None):
+        """Массовая смена статуса; список (id, user_id) измененных заявок"""
+        raise NotImplementedError
+
+    def pending_page(self, cursor=None, direction='next', limit=10):
+        """Страница ожидающих заявок: (заявки, есть_еще, всего_ожидающих)"""
+        raise NotImplementedError
+
+    def iter_applications(self, status=None, date_from=None, date_to=None, batch_size=100,
+                          screenshots_only=False):
+        """Генератор пачек заявок по фильтрам, новые первыми; в памяти — одна пачка"""
+        raise NotImplementedError
+
+    def iter_with_screenshots(self, status=None, date_from=None, date_to=None, batch_size=10):
+        """Генератор пачек заявок со скриншотами, новые первыми"""
+        return self.iter_applications(status, date_from, date_to, batch_size, screenshots_only=True)
+
+    def pending_by_user(self, user_id):
+        raise NotImplementedError
+
+    def by_id(self, app_id):
+        raise NotImplementedError
+
+    def register_screenshot(self, file_unique_id, app_id):
+        """Запоминание файла скриншота; id первой заявки с этим файлом (app_id, если файл новый)"""
+        raise NotImplementedError
+
+    def set_screenshot_hash(self, file_unique_id, phash):
+        raise NotImplementedError
+
+    def screenshot_hashes(self):
+        """Генератор пар (хеш, id заявки) для заполнения индекса похожих скриншотов"""
+        raise NotImplementedError
+
+    def mark_duplicate(self, app_id, duplicate_of):
+        raise NotImplementedError
+
+    def search(self, text, limit=10, offset=0):
+        """Поиск заявок по username, full_name, contact_info и user_id
+
+        Порядок: совпадение user_id, поле целиком, начало поля, подстрока
+        (в PostgreSQL с pg_trgm — еще и похожие написания); внутри — новые
+        первыми. Возвращает (страница заявок, всего найдено).
+        """
+        raise NotImplementedError
+
+    def add_funnel_stats(self, rows):
+        """Прибавление пачки счетчиков (период, начало периода, событие, число) одной транзакцией"""
+        raise NotImplementedError
+
+    def funnel_totals(self, period, since=None):
+        """Сумма счетчиков периода period начиная с since: {событие: число}"""
+        raise NotImplementedError
+
+    def claim_update(self, update_id):
+        """Отметка обновления обработанным; False, если его уже обработал другой процесс"""
+        raise NotImplementedError
+
+    def purge_processed_updates(self, before):
+        """Удаление отметок об обновлениях, обработанных до before; число удаленных"""
+        raise NotImplementedError
+
+    def publish(self, channel, payload):
+        """Событие для других процессов бота (только PostgreSQL)"""
+        raise NotImplementedError
+
+    def prepare_archive(self, cutoff):
+        """Подготовка архива к переносу заявок, решенных до cutoff"""
+
+    def archive_batch(self, cutoff, limit, anonymize):
+        """Перенос до limit завершенных заявок, решенных до cutoff, в архив
+
+        Перенос — одна транзакция; при anonymize персональные данные не
+        сохраняются. Возвращает число перенесенных заявок.
+        """
+        raise NotImplementedError
+
+    def purge_archive(self, before):
+        """Удаление архива заявок, решенных до before; возвращает список удаленного для журнала"""
+        raise NotImplementedError
+
+    def apply_journal(self, records):
+        """Применение пачки записей журнала одной транзакцией
+
+        Повторное применение безопасно: создание заявки идет по ключу
+        идемпотентности. Возвращает id заявки (или None) для каждой записи.
+        """
+        raise NotImplementedError
+
+    @staticmethod
+    def _page(rows, cursor, direction, limit):
+        """Разбор выборки страницы: последний столбец — общее число ожидающих"""
+        total = rows[0][-1] if rows else 0
+        has_more = len(rows) > limit
+        applications = [row[:-1] for row in rows[:limit]]
+        if cursor is not None and direction == 'prev':
+            applications.reverse()
+        return applications, has_more, total
+
+    @staticmethod
+    def _search_terms(text):
+        """Запрос → (строка для сравнения, она же с экранированием для LIKE, user_id или None)
+
+        Регистр не меняется: LIKE в SQLite без учета регистра только для латиницы,
+        а кириллицу админ обычно пишет так же, как в имени.
+        """
+        term = text.strip().lstrip('@')
+        like = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        # user_id — BIGINT: длинные числа ищем только как подстроку (номер карты, телефон)
+        user_id = int(term) if term.isdigit() and len(term) <= 18 else None
+        return term, like, user_id
+
+
+class PostgresStorage(Storage):
+    """Заявки в PostgreSQL через пул подключений DatabasePool"""
+
+    name = 'postgres'
+    transient_errors = (PoolUnavailableError, psycopg2.OperationalError, psycopg2.InterfaceError)
+
+    def __init__(self, pool):
+        self.pool = pool
+        # Есть ли pg_trgm (проверяется при миграции): без него поиск без похожих написаний
+        self.trigram = False
+
+    @contextmanager
+    def connection(self):
+        """Подключение из пула; время ожидания свободного подключения идет в метрики"""
+        started = time.perf_counter()
+        with self.pool.connection() as conn:
+            waited = time.perf_counter() - started
+            metrics.DB_POOL_WAIT.observe(waited)
+            metrics.report_slow('db', 'pool_wait', waited)
+            yield conn
+
+    def migrate(self):
+        with self.connection() as conn:
+            version = run_migrations(conn)
+            cur = conn.cursor()
+            cur.execute("SELECT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm')")
+            self.trigram = cur.fetchone()[0]
+            conn.rollback()
+        return version
+
+    def close(self):
+        self.pool.close()
+
+    def create_pending(self, user_id, username, full_name, screenshot_file_id):
+        with self.connection() as conn:
+            cur = conn.cursor()
+            # Уникальный частичный индекс по ожидающим заявкам не даст создать вторую
+            cur.execute('''
+                INSERT INTO applications (user_id, username, full_name, screenshot_file_id)
+                VALUES (%s, %s, %s, %s)
+                ON CONFLICT (user_id) WHERE status = 'pending' DO NOTHING
+                RETURNING id
+            ''', (user_id, username, full_name, screenshot_file_id))
+            row = cur.fetchone()
+            conn.commit()
+        return row[0] if row else None
+
+    def attach_contact(self, user_id, contact_info):
+        with self.connection() as conn:
+            cur = conn.cursor()
+            cur.execute('''
+                UPDATE applications SET contact_info = %s
+                WHERE user_id = %s AND status = 'pending'
+                RETURNING id
+            ''', (contact_info, user_id))
+            row = cur.fetchone()
+            conn.commit()
+        return row[0] if row else None
+
+    def set_status(self, app_id, status, from_status):
+        with self.connection() as conn:
+            cur = conn.cursor()
+            cur.execute('''
+                UPDATE applications SET status = %s, decided_at = LOCALTIMESTAMP
+                WHERE id = %s AND status = %s
+                RETURNING user_id
+            ''', (status, app_id, from_status))
+            row = cur.fetchone()
+            conn.commit()
+        return row[0] if row else None
+
+    def set_status_many(self, app_ids, status, from_status, older_than=None):
+        if older_than is not None:
+            condition, param = 'created_at < LOCALTIMESTAMP - %s', older_than
+        else:
+            condition, param = 'id = ANY(%s)', list(app_ids)
+        with self.connection() as conn:
+            cur = conn.cursor()
+            cur.execute(f'''
+                UPDATE applications SET status = %s, decided_at = LOCALTIMESTAMP
+                WHERE {condition} AND status = %s
+                RETURNING id, user_id
+            ''', (status, param, from_status))
+            rows = cur.fetchall()
+            conn.commit()
+        return rows
+
+    def pending_page(self, cursor=None, direction='next', limit=10):
+        # Общее число считается в том же запросе, чтобы страница стоила один round trip
+        count_sql = "(SELECT count(*) FROM applications WHERE status = 'pending')"
+        if cursor is None:
+            sql = f'''
+                SELECT {COLUMNS}, {count_sql} FROM applications
+                WHERE status = 'pending'
+                ORDER BY created_at DESC, id DESC LIMIT %s
+            '''
+            params = (limit + 1,)
+        elif direction == 'next':
+            sql = f'''
+                SELECT {COLUMNS}, {count_sql} FROM applications
+                WHERE status = 'pending' AND (created_at, id) < (%s, %s)
+                ORDER BY created_at DESC, id DESC LIMIT %s
+            '''
+            params = (cursor[0], cursor[1], limit + 1)
+        else:
+            sql = f'''
+                SELECT {COLUMNS}, {count_sql} FROM applications
+                WHERE status = 'pending' AND (created_at, id) > (%s, %s)
+                ORDER BY created_at ASC, id ASC LIMIT %s
+            '''
+            params = (cursor[0], cursor[1], limit + 1)
+
+        with self.connection() as conn:
+            cur = conn.cursor()
+            cur.execute(sql, params)
+            rows = cur.fetchall()
+        return self._page(rows, cursor, direction, limit)
+
+    @staticmethod
+    def _filtered_select(status, date_from, date_to, screenshots_only):
+        """SELECT заявок по фильтрам и его параметры"""
+        conditions = ['screenshot_file_id IS NOT NULL'] if screenshots_only else ['TRUE']
+        params = []
+        if status:
+            conditions.append('status = %s')
+            params.append(status)
+        if date_from:
+            conditions.append('created_at >= %s')
+            params.append(date_from)
+        if date_to:
+            conditions.append('created_at < %s')
+            params.append(date_to)
+        sql = (f"SELECT {COLUMNS} FROM applications WHERE {' AND '.join(conditions)} "
+               f"ORDER BY created_at DESC, id DESC")
+        return sql, params
+
+    def iter_applications(self, status=None, date_from=None, date_to=None, batch_size=100,
+                          screenshots_only=False):
+        sql, params = self._filtered_select(status, date_from, date_to, screenshots_only)
+        with self.connection() as conn:
+            # Именованный курсор — серверный: строки приходят порциями по itersize
+            cur = conn.cursor(name='applications_stream')
+            cur.itersize = batch_size
+            cur.execute(sql, params)
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
+            cur.close()
+
+    def copy_csv(self, out, status=None, date_from=None, date_to=None):
+        """Выгрузка заявок в CSV через COPY ... TO STDOUT прямо в файл out"""
+        sql, params = self._filtered_select(status, date_from, date_to, False)
+        with self.connection() as conn:
+            cur = conn.cursor()
+            # COPY не принимает параметры — подставляем их с экранированием драйвера
+            query = cur.mogrify(sql, params).decode()
+            cur.copy_expert(f'COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER true)', out)
+            conn.rollback()
+
+    def pending_by_user(self, user_id):
+        with self.connection() as conn:
+            cur = conn.cursor()
+            cur.execute(f'SELECT {COLUMNS} FROM applications WHERE user_id = %s AND status = %s', (user_id, 'pending'))
+            return cur.fetchone()
+
+    def by_id(self, app_id):
+        with self.connection() as conn:
+            cur = conn.cursor()
+            cur.execute(f'SELECT {COLUMNS} FROM applications WHERE id = %s', (app_id,))
+            return cur.fetchone()
+
+    def register_screenshot(self, file_unique_id, app_id):
+        with self.connection() as conn:
+            cur = conn.cursor()
+            # Пустое обновление при конфликте нужно, чтобы RETURNING вернул уже существующую строку
+            cur.execute('''
+                INSERT INTO screenshot_fingerprints (file_unique_id, application_id)
+                VALUES (%s, %s)
+                ON CONFLICT (file_unique_id) DO UPDATE SET file_unique_id = EXCLUDED.file_unique_id
+                RETURNING application_id
+            ''', (file_unique_id, app_id))
+            row = cur.fetchone()
+            conn.commit()
+        return row[0]
+
+    def set_screenshot_hash(self, file_unique_id, phash):
+        with self.connection() as conn:
+            cur = conn.cursor()
+            cur.execute('UPDATE screenshot_fingerprints SET phash = %s WHERE file_unique_id = %s',
+                        (phash, file_unique_id))
+            conn.commit()
+
+    def screenshot_hashes(self):
+        with self.connection() as conn:
+            cur = conn.cursor(name='screenshot_hashes')
+            cur.execute('SELECT phash, application_id FROM screenshot_fingerprints WHERE phash IS NOT NULL')
+            yield from cur
+            cur.close()
+
+    def mark_duplicate(self, app_id, duplicate_of):
+        with self.connection() as conn:
+            cur = conn.cursor()
+            cur.execute('UPDATE applications SET duplicate_of = %s WHERE id = %s', (duplicate_of, app_id))
+            conn.commit()
+
+    def search(self, text, limit=10, offset=0):
+        term, like, user_id = self._search_terms(text)
+        # ILIKE по подстроке и оператор <% (похожее слово) используют триграммный GIN-индекс,
+        # совпадение user_id — индекс applications_user_idx
+        fuzzy = f'OR %(term)s <%% {SEARCH_DOCUMENT}' if self.trigram else ''
+        similarity = f'word_similarity(%(term)s, {SEARCH_DOCUMENT}) DESC,' if self.trigram else ''
+        with self.connection() as conn:
+            cur = conn.cursor()
+            cur.execute(f'''
+                SELECT {COLUMNS}, count(*) OVER () FROM applications
+                WHERE user_id = %(user_id)s OR {SEARCH_DOCUMENT} ILIKE %(pattern)s {fuzzy}
+                ORDER BY
+                    CASE
+                        WHEN user_id = %(user_id)s THEN 0
+                        WHEN username ILIKE %(exact)s OR full_name ILIKE %(exact)s OR contact_info ILIKE %(exact)s THEN 1
+                        WHEN username ILIKE %(prefix)s OR full_name ILIKE %(prefix)s OR contact_info ILIKE %(prefix)s THEN 2
+                        WHEN {SEARCH_DOCUMENT} ILIKE %(pattern)s THEN 3
+                        ELSE 4
+                    END,
+                    {similarity}
+                    created_at DESC, id DESC
+                LIMIT %(limit)s OFFSET %(offset)s
+            ''', {
+                'term': term, 'user_id': user_id, 'exact': like, 'prefix': like + '%', 'pattern': f'%{like}%',
+                'limit': limit, 'offset': offset,
+            })
+            rows = cur.fetchall()
+            conn.rollback()
+        return [row[:-1] for row in rows], rows[0][-1] if rows else 0
+
+    def add_funnel_stats(self, rows):
+        periods, buckets, events, counts = zip(*rows)
+        with self.connection() as conn:
+            cur = conn.cursor()
+            cur.execute('''
+                INSERT INTO funnel_stats (period, bucket, event, count)
+                SELECT * FROM unnest(%s::text[], %s::timestamp[], %s::text[], %s::bigint[])
+                ON CONFLICT (period, bucket, event) DO UPDATE SET count = funnel_stats.count + EXCLUDED.count
+            ''', (list(periods), list(buckets), list(events), list(counts)))
+            conn.commit()
+
+    def funnel_totals(self, period, since=None):
+        with self.connection() as conn:
+            cur = conn.cursor()
+            cur.execute('''
+                SELECT event, SUM(count) FROM funnel_stats
+                WHERE period = %s AND (%s::timestamp IS NULL OR bucket >= %s)
+                GROUP BY event
+            ''', (period, since, since))
+            rows = cur.fetchall()
+            conn.rollback()
+        return {event: int(count) for event, count in rows}
+
+    def claim_update(self, update_id):
+        with self.connection() as conn:
+            cur = conn.cursor()
+            cur.execute('''
+                INSERT INTO processed_updates (update_id) VALUES (%s)
+                ON CONFLICT DO NOTHING
+                RETURNING update_id
+            ''', (update_id,))
+            row = cur.fetchone()
+            conn.commit()
+        return row is not None
+
+    def purge_processed_updates(self, before):
+        with self.connection() as conn:
+            cur = conn.cursor()
+            cur.execute('DELETE FROM processed_updates WHERE processed_at < %s', (before,))
+            conn.commit()
+            return cur.rowcount
+
+    def publish(self, channel, payload):
+        with self.connection() as conn:
+            cur = conn.cursor()
+            # Уведомление уходит при фиксации транзакции
+            cur.execute('SELECT pg_notify(%s, %s)', (channel, payload))
+            conn.commit()
+
+    @staticmethod
+    def _partition_name(month):
+        return f"applications_archive_y{month.year:04d}m{month.month:02d}"
+
+    def prepare_archive(self, cutoff):
+        """Создание месячных разделов архива от самой старой решенной заявки до cutoff"""
+        with self.connection() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT min(decided_at) FROM applications WHERE status <> 'pending'")
+            oldest = cur.fetchone()[0]
+            if oldest is None or oldest >= cutoff:
+                return
+            month = month_start(oldest)
+            while month < cutoff:
+                following = add_months(month, 1)
+                # Имя и границы вычисляются здесь же из дат, а не из пользовательского ввода
+                cur.execute(f'''
+                    CREATE TABLE IF NOT EXISTS {self._partition_name(month)}
+                    PARTITION OF applications_archive
+                    FOR VALUES FROM ('{month.isoformat()}') TO ('{following.isoformat()}')
+                ''')
+                month = following
+            conn.commit()
+
+    def archive_batch(self, cutoff, limit, anonymize):
+        personal = ANONYMIZED_COLUMNS if anonymize else PERSONAL_COLUMNS
+        with self.connection() as conn:
+            cur = conn.cursor()
+            # Перенос одним запросом: удаленные строки сразу вставляются в архив
+            cur.execute(f'''
+                WITH moved AS (
+                    DELETE FROM applications
+                    WHERE id IN (
+                        SELECT id FROM applications
+                        WHERE status <> 'pending' AND decided_at < %s
+                        ORDER BY decided_at
+                        LIMIT %s
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    RETURNING *
+                )
+                INSERT INTO applications_archive
+                    (id, {PERSONAL_COLUMNS}, status, created_at, decided_at, anonymized)
+                SELECT id, {personal}, status, created_at, decided_at, %s FROM moved
+            ''', (cutoff, limit, anonymize))
+            count = cur.rowcount
+            conn.commit()
+        return count
+
+    def purge_archive(self, before):
+        """Удаление разделов архива, целиком лежащих раньше before (DROP TABLE без сканирования)"""
+        with self.connection() as conn:
+            cur = conn.cursor()
+            cur.execute('''
+                SELECT child.relname FROM pg_inherits
+                JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+                WHERE pg_inherits.inhparent = 'applications_archive'::regclass
+                ORDER BY child.relname
+            ''')
+            dropped = []
+            for (name,) in cur.fetchall():
+                month = datetime.strptime(name[-8:], 'y%Ym%m')
+                if add_months(month, 1) <= before:
+                    cur.execute(f'DROP TABLE IF EXISTS {name}')
+                    dropped.append(name)
+            conn.commit()
+        return dropped
+
+    def apply_journal(self, records):
+        results = []
+        with self.connection() as conn:
+            cur = conn.cursor()
+            for record in records:
+                if record['op'] == 'create':
+                    # Без цели конфликта: и повтор ключа, и уже существующая ожидающая заявка пропускаются
+                    cur.execute('''
+                        INSERT INTO applications
+                            (user_id, username, full_name, screenshot_file_id, created_at, idempotency_key)
+                        VALUES (%s, %s, %s, %s, %s, %s)
+                        ON CONFLICT DO NOTHING
+                        RETURNING id
+                    ''', (record['user_id'], record['username'], record['full_name'],
+                          record['screenshot_file_id'], record['created_at'], record['key']))
+                else:
+                    cur.execute('''
+                        UPDATE applications SET contact_info = %s
+                        WHERE user_id = %s AND status = 'pending'
+                        RETURNING id
+                    ''', (record['contact_info'], record['user_id']))
+                row = cur.fetchone()
+                results.append(row[0] if row else None)
+            conn.commit()
+        return results
+
+
+def sqlite_timestamp(value):
+    """datetime → текст в формате колонки created_at"""
+    return value.strftime('%Y-%m-%d %H:%M:%S.%f')
+
+
+def sqlite_row(row):
+    """Строка SQLite → кортеж заявки с created_at типа datetime"""
+    if row is None:
+        return None
+    return row[:7] + (datetime.fromisoformat(row[7]),) + row[8:]
+
+
+class SQLiteStorage(Storage):
+    """Заявки во встроенной базе SQLite (для одного процесса без сетевой БД)
+
+    WAL позволяет читать параллельно с записью, synchronous=NORMAL делает
+    запись локальной и быстрой (в WAL это безопасно для целостности: при
+    отключении питания теряются только последние транзакции). У каждого
+    потока исполнителя свое подключение; sqlite3 кэширует подготовленные
+    выражения по тексту запроса, поэтому SQL ниже — константы с параметрами.
+    """
+
+    name = 'sqlite'
+    # OperationalError — это и занятая база, и ошибки схемы или SQL; временные
+    # отбираются по коду ошибки в is_transient
+    transient_errors = (sqlite3.OperationalError,)
+    # Сравниваются с младшим байтом расширенного кода ошибки
+    transient_codes = (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+    # Класс подключения (бенчмарк подменяет его, чтобы считать запросы)
+    connection_factory = sqlite3.Connection
+
+    def __init__(self, path, busy_timeout=5.0, synchronous='NORMAL', cached_statements=256):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self.synchronous = synchronous
+        self.cached_statements = cached_statements
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        # Подключение закрывается из основного потока при остановке, поэтому check_same_thread=False;
+        # используется же оно только своим потоком (или одним потоковым чтением)
+        conn = sqlite3.connect(
+            self.path,
+            timeout=self.busy_timeout,
+            isolation_level=None,
+            check_same_thread=False,
+            cached_statements=self.cached_statements,
+            factory=self.connection_factory,
+        )
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(f'PRAGMA synchronous={self.synchronous}')
+        with self._lock:
+            self._connections.append(conn)
+        return conn
+
+    def connection(self):
+        """Подключение текущего потока (создается при первом обращении)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    def is_transient(self, error):
+        if not isinstance(error, self.transient_errors):
+            return False
+        code = getattr(error, 'sqlite_errorcode', None)
+        if code is not None:
+            return code & 0xff in self.transient_codes
+        message = str(error).lower()
+        return 'locked' in message or 'busy' in message
+
+    def _forget(self, conn):
+        with self._lock:
+            if conn in self._connections:
+                self._connections.remove(conn)
+        conn.close()
+
+    def migrate(self):
+        return run_sqlite_migrations(self.connection())
+
+    def close(self):
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
+
+    # Запросы с RETURNING дочитываются через fetchall(): пока выражение не дошло
+    # до конца, SQLite держит транзакцию открытой и не снимает блокировку записи
+
+    def create_pending(self, user_id, username, full_name, screenshot_file_id):
+        rows = self.connection().execute('''
+            INSERT INTO applications (user_id, username, full_name, screenshot_file_id)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (user_id) WHERE status = 'pending' DO NOTHING
+            RETURNING id
+        ''', (user_id, username, full_name, screenshot_file_id)).fetchall()
+        return rows[0][0] if rows else None
+
+    def attach_contact(self, user_id, contact_info):
+        rows = self.connection().execute('''
+            UPDATE applications SET contact_info = ?
+            WHERE user_id = ? AND status = 'pending'
+            RETURNING id
+        ''', (contact_info, user_id)).fetchall()
+        return rows[0][0] if rows else None
+
+    def set_status(self, app_id, status, from_status):
+        rows = self.connection().execute('''
+            UPDATE applications SET status = ?, decided_at = ?
+            WHERE id = ? AND status = ?
+            RETURNING user_id
+        ''', (status, sqlite_timestamp(datetime.now()), app_id, from_status)).fetchall()
+        return rows[0][0] if rows else None
+
+    def set_status_many(self, app_ids, status, from_status, older_than=None):
+        if older_than is not None:
+            condition, param = 'created_at < ?', sqlite_timestamp(datetime.now() - older_than)
+        else:
+            # Список id одним параметром — текст запроса не зависит от их числа
+            condition, param = 'id IN (SELECT value FROM json_each(?))', json.dumps(list(app_ids))
+        return self.connection().execute(f'''
+            UPDATE applications SET status = ?, decided_at = ?
+            WHERE {condition} AND status = ?
+            RETURNING id, user_id
+        ''', (status, sqlite_timestamp(datetime.now()), param, from_status)).fetchall()
+
+    def pending_page(self, cursor=None, direction='next', limit=10):
+        count_sql = "(SELECT count(*) FROM applications WHERE status = 'pending')"
+        if cursor is None:
+            sql = f'''
+                SELECT {COLUMNS}, {count_sql} FROM applications
+                WHERE status = 'pending'
+                ORDER BY created_at DESC, id DESC LIMIT ?
+            '''
+            params = (limit + 1,)
+        elif direction == 'next':
+            sql = f'''
+                SELECT {COLUMNS}, {count_sql} FROM applications
+                WHERE status = 'pending' AND (created_at, id) < (?, ?)
+                ORDER BY created_at DESC, id DESC LIMIT ?
+            '''
+            params = (sqlite_timestamp(cursor[0]), cursor[1], limit + 1)
+        else:
+            sql = f'''
+                SELECT {COLUMNS}, {count_sql} FROM applications
+                WHERE status = 'pending' AND (created_at, id) > (?, ?)
+                ORDER BY created_at ASC, id ASC LIMIT ?
+            '''
+            params = (sqlite_timestamp(cursor[0]), cursor[1], limit + 1)
+
+        rows = [sqlite_row(row) for row in self.connection().execute(sql, params).fetchall()]
+        return self._page(rows, cursor, direction, limit)
+
+    def iter_applications(self, status=None, date_from=None, date_to=None, batch_size=100,
+                          screenshots_only=False):
+        conditions = ['screenshot_file_id IS NOT NULL'] if screenshots_only else ['1']
+        params = []
+        if status:
+            conditions.append('status = ?')
+            params.append(status)
+        if date_from:
+            conditions.append('created_at >= ?')
+            params.append(sqlite_timestamp(date_from))
+        if date_to:
+            conditions.append('created_at < ?')
+            params.append(sqlite_timestamp(date_to))
+
+        # Генератор могут продолжать разные потоки исполнителя — у чтения свое подключение
+        conn = self._connect()
+        try:
+            cur = conn.execute(
+                f"SELECT {COLUMNS} FROM applications WHERE {' AND '.join(conditions)} "
+                f"ORDER BY created_at DESC, id DESC",
+                params
+            )
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield [sqlite_row(row) for row in rows]
+        finally:
+            self._forget(conn)
+
+    def pending_by_user(self, user_id):
+        return sqlite_row(self.connection().execute(
+            f"SELECT {COLUMNS} FROM applications WHERE user_id = ? AND status = 'pending'", (user_id,)
+        ).fetchone())
+
+    def by_id(self, app_id):
+        return sqlite_row(self.connection().execute(
+            f'SELECT {COLUMNS} FROM applications WHERE id = ?', (app_id,)
+        ).fetchone())
+
+    def register_screenshot(self, file_unique_id, app_id):
+        rows = self.connection().execute('''
+            INSERT INTO screenshot_fingerprints (file_unique_id, application_id)
+            VALUES (?, ?)
+            ON CONFLICT (file_unique_id) DO UPDATE SET file_unique_id = excluded.file_unique_id
+            RETURNING application_id
+        ''', (file_unique_id, app_id)).fetchall()
+        return rows[0][0]
+
+    def set_screenshot_hash(self, file_unique_id, phash):
+        self.connection().execute('UPDATE screenshot_fingerprints SET phash = ? WHERE file_unique_id = ?',
+                                  (phash, file_unique_id))
+
+    def screenshot_hashes(self):
+        conn = self._connect()
+        try:
+            yield from conn.execute('SELECT phash, application_id FROM screenshot_fingerprints WHERE phash IS NOT NULL')
+        finally:
+            self._forget(conn)
+
+    def mark_duplicate(self, app_id, duplicate_of):
+        self.connection().execute('UPDATE applications SET duplicate_of = ? WHERE id = ?', (duplicate_of, app_id))
+
+    def search(self, text, limit=10, offset=0):
+        term, like, user_id = self._search_terms(text)
+        # Триграммный FTS5 находит подстроки от 3 символов; фраза в кавычках — весь запрос целиком
+        match = '"' + term.replace('"', '""') + '"'
+        rows = self.connection().execute(f'''
+            WITH hits (hit_id) AS (
+                SELECT rowid FROM applications_search WHERE applications_search MATCH :match
+                UNION
+                SELECT id FROM applications WHERE user_id = :user_id
+            )
+            SELECT {COLUMNS}, count(*) OVER () FROM hits JOIN applications ON id = hit_id
+            ORDER BY
+                CASE
+                    WHEN user_id = :user_id THEN 0
+                    WHEN username LIKE :exact ESCAPE '\\' OR full_name LIKE :exact ESCAPE '\\'
+                        OR contact_info LIKE :exact ESCAPE '\\' THEN 1
+                    WHEN username LIKE :prefix ESCAPE '\\' OR full_name LIKE :prefix ESCAPE '\\'
+                        OR contact_info LIKE :prefix ESCAPE '\\' THEN 2
+                    ELSE 3
+                END,
+                created_at DESC, id DESC
+            LIMIT :limit OFFSET :offset
+        ''', {
+            'match': match, 'user_id': user_id, 'exact': like, 'prefix': like + '%',
+            'limit': limit, 'offset': offset,
+        }).fetchall()
+        return [sqlite_row(row[:-1]) for row in rows], rows[0][-1] if rows else 0
+
+    def add_funnel_stats(self, rows):
+        conn = self.connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany('''
+                INSERT INTO funnel_stats (period, bucket, event, count) VALUES (?, ?, ?, ?)
+                ON CONFLICT (period, bucket, event) DO UPDATE SET count = count + excluded.count
+            ''', [(period, sqlite_timestamp(bucket), event, count) for period, bucket, event, count in rows])
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def funnel_totals(self, period, since=None):
+        rows = self.connection().execute('''
+            SELECT event, SUM(count) FROM funnel_stats
+            WHERE period = ?1 AND (?2 IS NULL OR bucket >= ?2)
+            GROUP BY event
+        ''', (period, sqlite_timestamp(since) if since else None)).fetchall()
+        return dict(rows)
+
+    def claim_update(self, update_id):
+        rows = self.connection().execute(
+            'INSERT INTO processed_updates (update_id) VALUES (?) ON CONFLICT DO NOTHING RETURNING update_id',
+            (update_id,)
+        ).fetchall()
+        return bool(rows)
+
+    def purge_processed_updates(self, before):
+        return self.connection().execute(
+            'DELETE FROM processed_updates WHERE processed_at < ?', (sqlite_timestamp(before),)
+        ).rowcount
+
+    def archive_batch(self, cutoff, limit, anonymize):
+        personal = ANONYMIZED_COLUMNS if anonymize else PERSONAL_COLUMNS
+        conn = self.connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            ids = [row[0] for row in conn.execute('''
+                SELECT id FROM applications
+                WHERE status <> 'pending' AND decided_at < ?
+                ORDER BY decided_at
+                LIMIT ?
+            ''', (sqlite_timestamp(cutoff), limit))]
+            id_list = json.dumps(ids)
+            conn.execute(f'''
+                INSERT OR REPLACE INTO applications_archive
+                    (id, {PERSONAL_COLUMNS}, status, created_at, decided_at, anonymized)
+                SELECT id, {personal}, status, created_at, decided_at, ? FROM applications
+                WHERE id IN (SELECT value FROM json_each(?))
+            ''', (int(anonymize), id_list))
+            conn.execute('DELETE FROM applications WHERE id IN (SELECT value FROM json_each(?))', (id_list,))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return len(ids)
+
+    def purge_archive(self, before):
+        cur = self.connection().execute(
+            'DELETE FROM applications_archive WHERE decided_at < ?', (sqlite_timestamp(before),)
+        )
+        return [f"{cur.rowcount} строк"] if cur.rowcount else []
+
+    def apply_journal(self, records):
+        conn = self.connection()
+        results = []
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for record in records:
+                if record['op'] == 'create':
+                    rows = conn.execute('''
+                        INSERT INTO applications
+                            (user_id, username, full_name, screenshot_file_id, created_at, idempotency_key)
+                        VALUES (?, ?, ?, ?, ?, ?)
+                        ON CONFLICT DO NOTHING
+                        RETURNING id
+                    ''', (record['user_id'], record['username'], record['full_name'], record['screenshot_file_id'],
+                          sqlite_timestamp(datetime.fromisoformat(record['created_at'])), record['key'])).fetchall()
+                else:
+                    rows = conn.execute('''
+                        UPDATE applications SET contact_info = ?
+                        WHERE user_id = ? AND status = 'pending'
+                        RETURNING id
+                    ''', (record['contact_info'], record['user_id'])).fetchall()
+                results.append(rows[0][0] if rows else None)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return results
@@ -0,0 +1,31 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+from storage import SQLiteStorage  # noqa: E402
+
+
+@pytest.fixture
+def storage(tmp_path):
+    """Пустая база SQLite со всеми миграциями"""
+    store = SQLiteStorage(str(tmp_path / 'applications.db'))
+    store.migrate()
+    yield store
+    store.close()
+
+
+@pytest.fixture
+def create_applications(storage):
+    """Создать count ожидающих заявок с реквизитами; id в порядке создания"""
+    def create(count):
+        app_ids = []
+        for user_id in range(1, count + 1):
+            app_ids.append(storage.create_pending(user_id, f'user{user_id}', f'User {user_id}', f'file-{user_id}'))
+            storage.attach_contact(user_id, f'4111 0000 0000 {user_id:04d}')
+        return app_ids
+    return create
@@ -0,0 +1,33 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+
+@pytest.mark.parametrize('anonymize', [False, True])
+def test_archive_moves_decided_applications(storage, create_applications, anonymize):
+    app_ids = create_applications(5)
+    for app_id in app_ids[:3]:
+        storage.set_status(app_id, 'approved', 'pending')
+
+    cutoff = datetime.now() + timedelta(seconds=1)
+    storage.prepare_archive(cutoff)
+    assert storage.archive_batch(cutoff, 2, anonymize) == 2
+    assert storage.archive_batch(cutoff, 2, anonymize) == 1
+    assert storage.archive_batch(cutoff, 2, anonymize) == 0
+
+    for app_id in app_ids[:3]:
+        assert storage.by_id(app_id) is None
+    assert [row[0] for row in storage.pending_page(limit=10)[0]] == app_ids[:2:-1]
+    # Из поиска архивные заявки тоже пропадают
+    assert storage.search('user1')[1] == 0
+
+    archived = storage.connection().execute(
+        'SELECT id, user_id, contact_info, status, anonymized FROM applications_archive ORDER BY id'
+    ).fetchall()
+    if anonymize:
+        assert archived == [(app_id, None, None, 'approved', 1) for app_id in app_ids[:3]]
+    else:
+        assert [row[:2] for row in archived] == [(app_id, user_id) for user_id, app_id in enumerate(app_ids[:3], 1)]
+
+    assert storage.purge_archive(cutoff) == ['3 строк']
+    assert storage.connection().execute('SELECT count(*) FROM applications_archive').fetchone()[0] == 0
@@ -0,0 +1,48 @@
+import time
+
+from cache import MISSING, TTLCache, idle_keys
+
+
+# ----- Вытеснение состояний подачи -----
+
+def test_idle_keys_evicts_expired():
+    touched = {1: 0.0, 2: 50.0, 3: 95.0}
+    assert idle_keys(touched, ttl=60, maxsize=10, now=100.0) == [1]
+
+
+def test_idle_keys_evicts_oldest_over_maxsize():
+    touched = {user_id: float(user_id) for user_id in range(1, 11)}
+    assert sorted(idle_keys(touched, ttl=60, maxsize=7, now=10.0)) == [1, 2, 3]
+    # Просроченные уже освобождают место: из свежих сверх лимита вытесняется только 3
+    assert sorted(idle_keys(touched, ttl=7.5, maxsize=7, now=10.0)) == [1, 2, 3]
+    assert sorted(idle_keys(touched, ttl=7.5, maxsize=8, now=10.0)) == [1, 2]
+
+
+def test_idle_keys_keeps_fresh_within_limit():
+    assert idle_keys({1: 99.0, 2: 100.0}, ttl=60, maxsize=2, now=100.0) == []
+    assert idle_keys({}, ttl=60, maxsize=0, now=100.0) == []
+
+
+# ----- TTLCache (токены поиска /find) -----
+
+def test_none_is_cached():
+    cache = TTLCache()
+    assert cache.get('a') is MISSING
+    cache.set('a', None)
+    assert cache.get('a') is None
+    assert cache.stats()['hits'] == 1
+
+
+def test_expired_and_evicted_entries():
+    cache = TTLCache(maxsize=2, ttl=0.05)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    # Вытесняется давно не читанная запись
+    assert cache.get('b') is MISSING
+    assert cache.get('a') == 1
+
+    time.sleep(0.06)
+    assert cache.get('a') is MISSING
+    assert cache.get('c') is MISSING
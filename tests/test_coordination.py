@@ -0,0 +1,26 @@
+from datetime import datetime, timedelta
+
+from storage import SQLiteStorage
+
+
+def test_update_is_claimed_once(storage):
+    assert storage.claim_update(101) is True
+    assert storage.claim_update(101) is False
+    assert storage.claim_update(102) is True
+
+
+def test_claim_is_shared_between_connections(storage, tmp_path):
+    # Второй процесс над той же базой видит отметку первого
+    other = SQLiteStorage(str(tmp_path / 'applications.db'))
+    try:
+        assert storage.claim_update(7) is True
+        assert other.claim_update(7) is False
+    finally:
+        other.close()
+
+
+def test_purged_update_can_be_claimed_again(storage):
+    storage.claim_update(1)
+    assert storage.purge_processed_updates(datetime.now() - timedelta(hours=1)) == 0
+    assert storage.purge_processed_updates(datetime.now() + timedelta(seconds=1)) == 1
+    assert storage.claim_update(1) is True
@@ -0,0 +1,67 @@
+import os
+import random
+
+import pytest
+
+from fraud import BKTree, ScreenshotIndex, dhash, from_signed, hamming, to_signed
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+def fixture_hash(name):
+    pytest.importorskip('PIL')
+    with open(os.path.join(FIXTURES, name), 'rb') as f:
+        return dhash(f.read())
+
+
+def test_dhash_survives_resize_and_recompression():
+    original = fixture_hash('receipt.png')
+    assert 0 <= original < 1 << 64
+    assert hamming(original, fixture_hash('receipt_resized.jpg')) <= 6
+
+
+def test_dhash_tells_different_screenshots_apart():
+    assert hamming(fixture_hash('receipt.png'), fixture_hash('other_receipt.png')) > 6
+
+
+def test_signed_round_trip():
+    for value in (0, 1, (1 << 63) - 1, 1 << 63, (1 << 64) - 1):
+        signed = to_signed(value)
+        assert -(1 << 63) <= signed < 1 << 63
+        assert from_signed(signed) == value
+
+
+def test_bktree_matches_linear_scan():
+    rng = random.Random(7)
+    values = [rng.getrandbits(64) for _ in range(300)]
+    # Близкие к уже добавленным хеши и точные повторы
+    values += [value ^ (1 << rng.randrange(64)) for value in values[:50]] + values[:10]
+    tree = BKTree()
+    for item, value in enumerate(values):
+        tree.add(value, item)
+    assert len(tree) == len(values)
+
+    for query in values[:20] + [rng.getrandbits(64) for _ in range(20)]:
+        for max_distance in (0, 3, 10):
+            expected = sorted(
+                (hamming(query, value), item) for item, value in enumerate(values)
+                if hamming(query, value) <= max_distance
+            )
+            found = tree.search(query, max_distance)
+            assert sorted(found) == expected
+            assert [distance for distance, _item in found] == sorted(distance for distance, _item in found)
+
+
+def test_empty_bktree():
+    assert BKTree().search(0, 64) == []
+
+
+def test_screenshot_index_reports_similar_applications():
+    index = ScreenshotIndex(max_distance=6)
+    index.load([(to_signed(fixture_hash('receipt.png')), 1), (to_signed(fixture_hash('other_receipt.png')), 2)])
+
+    matches = index.check_and_add(fixture_hash('receipt_resized.jpg'), 3)
+    assert [app_id for _distance, app_id in matches] == [1]
+    assert len(index) == 3
+    # Хеш самой заявки не считается повтором
+    assert index.check_and_add(fixture_hash('other_receipt.png'), 2) == []
@@ -0,0 +1,92 @@
+import sqlite3
+from datetime import datetime
+
+import pytest
+
+from journal import Journal
+from storage import SQLiteStorage
+
+
+def journal_record(op, user_id, **fields):
+    record = {'op': op, 'user_id': user_id, 'key': f'{op}-{user_id}'}
+    if op == 'create':
+        record.update(username=f'user{user_id}', full_name=f'User {user_id}',
+                      screenshot_file_id=f'file-{user_id}', created_at=datetime.now().isoformat())
+    record.update(fields)
+    return record
+
+
+def test_journal_replay(storage, tmp_path):
+    journal = Journal(str(tmp_path / 'journal'), fsync=False)
+    for user_id in range(1, 6):
+        journal.append(journal_record('create', user_id))
+        journal.append(journal_record('contact', user_id, username=f'user{user_id}',
+                                      full_name=f'User {user_id}', contact_info=f'card {user_id}'))
+    assert journal.backlog == 10
+
+    applied = journal.replay(storage.apply_journal, batch_size=3)
+    assert journal.backlog == 0
+    assert len(applied) == 10
+    for record, app_id in applied:
+        row = storage.by_id(app_id)
+        assert row[1] == record['user_id']
+        assert row[5] == f"card {record['user_id']}"
+
+    assert journal.replay(storage.apply_journal) == []
+
+
+def test_journal_replay_resumes_after_failure(storage, tmp_path):
+    journal = Journal(str(tmp_path / 'journal'), fsync=False)
+    for user_id in range(1, 6):
+        journal.append(journal_record('create', user_id))
+
+    calls = []
+
+    def failing_apply(records):
+        calls.append(len(records))
+        if len(calls) == 2:
+            raise RuntimeError('database is down')
+        return storage.apply_journal(records)
+
+    with pytest.raises(RuntimeError):
+        journal.replay(failing_apply, batch_size=2)
+    assert journal.backlog == 3
+
+    # Журнал после перезапуска: подтвержденная пачка не применяется повторно
+    journal = Journal(str(tmp_path / 'journal'), fsync=False)
+    assert journal.backlog == 3
+    applied = journal.replay(storage.apply_journal, batch_size=2)
+    assert [record['user_id'] for record, _app_id in applied] == [3, 4, 5]
+    assert storage.pending_page(limit=10)[2] == 5
+
+
+def test_apply_journal_is_idempotent(storage):
+    records = [journal_record('create', 1), journal_record('contact', 1, contact_info='card 1')]
+    app_id, contact_id = storage.apply_journal(records)
+    assert contact_id == app_id
+    # Повтор пачки после сбоя до подтверждения не создает вторую заявку
+    assert storage.apply_journal(records) == [None, app_id]
+    assert storage.pending_page(limit=10)[2] == 1
+
+
+# ----- Какие ошибки журналируются -----
+
+def test_only_busy_database_is_transient(tmp_path):
+    path = str(tmp_path / 'busy.db')
+    store = SQLiteStorage(path, busy_timeout=0)
+    store.migrate()
+    other = sqlite3.connect(path, isolation_level=None)
+    try:
+        other.execute('BEGIN EXCLUSIVE')
+        with pytest.raises(sqlite3.OperationalError) as busy:
+            store.create_pending(1, 'user1', 'User 1', 'file-1')
+        assert store.is_transient(busy.value)
+        other.execute('ROLLBACK')
+
+        with pytest.raises(sqlite3.OperationalError) as broken:
+            store.connection().execute('SELECT missing_column FROM applications')
+        assert not store.is_transient(broken.value)
+        assert not store.is_transient(ValueError('database is locked'))
+    finally:
+        other.close()
+        store.close()
@@ -0,0 +1,26 @@
+def test_pending_page_walks_forward_and_back(storage, create_applications):
+    app_ids = create_applications(25)
+    newest_first = app_ids[::-1]
+
+    pages = []
+    rows, has_more, total = storage.pending_page(limit=10)
+    pages.append([row[0] for row in rows])
+    while has_more:
+        last = rows[-1]
+        rows, has_more, total = storage.pending_page((last[7], last[0]), 'next', limit=10)
+        pages.append([row[0] for row in rows])
+    assert total == 25
+    assert pages == [newest_first[:10], newest_first[10:20], newest_first[20:]]
+
+    first = rows[0]
+    rows, has_more, _total = storage.pending_page((first[7], first[0]), 'prev', limit=10)
+    assert [row[0] for row in rows] == newest_first[10:20]
+    assert has_more
+
+
+def test_pending_page_skips_decided(storage, create_applications):
+    app_ids = create_applications(3)
+    storage.set_status(app_ids[1], 'approved', 'pending')
+    rows, has_more, total = storage.pending_page(limit=10)
+    assert [row[0] for row in rows] == [app_ids[2], app_ids[0]]
+    assert (has_more, total) == (False, 2)
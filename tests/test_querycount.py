@@ -0,0 +1,16 @@
+import querycount
+
+
+def test_one_statement_counts_as_one_query(tmp_path):
+    storage = querycount.CountingSQLiteStorage(str(tmp_path / 'bench.db'))
+    storage.migrate()
+    try:
+        before = querycount.total_queries
+        app_id = storage.create_pending(1, 'user1', 'User One', 'file-1')
+        assert querycount.total_queries - before == 1
+
+        before = querycount.total_queries
+        assert storage.attach_contact(1, '4111 1111 1111 1111') == app_id
+        assert querycount.total_queries - before == 1
+    finally:
+        storage.close()
@@ -0,0 +1,17 @@
+import os
+
+from rendering import Catalog, code_block
+
+LOCALES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'locales')
+catalog = Catalog(LOCALES, ref_link='https://example.com/ref', support_url='https://t.me/support')
+
+
+def test_code_block_escapes_only_backticks_and_backslashes():
+    assert code_block('a_b *c* `d` \\') == '```\na_b *c* \\`d\\` \\\\\n```'
+
+
+def test_funnel_stats_is_markdown_v2():
+    text = catalog.text('funnel_stats', 'en', table=code_block('Скриншот  1_000'),
+                        start_to_screenshot='12.5%', screenshot_to_approved='—')
+    assert '```\nСкриншот  1_000\n```' in text
+    assert 'скриншот 12\\.5%' in text
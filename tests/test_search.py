@@ -0,0 +1,29 @@
+def test_search(storage, create_applications):
+    app_ids = create_applications(12)
+
+    rows, total = storage.search('@user12')
+    assert [row[0] for row in rows] == [app_ids[11]]
+    assert total == 1
+
+    # Точное совпадение выше совпадения по подстроке
+    rows, total = storage.search('user1')
+    assert rows[0][0] == app_ids[0]
+    assert total == 4
+
+    rows, _total = storage.search('0000 0007')
+    assert [row[0] for row in rows] == [app_ids[6]]
+
+    # По user_id находится и без совпадения в тексте
+    rows, _total = storage.search('5')
+    assert rows[0][0] == app_ids[4]
+
+    rows, total = storage.search('user1', limit=2, offset=2)
+    assert len(rows) == 2
+    assert total == 4
+
+
+def test_search_follows_updates(storage):
+    app_id = storage.create_pending(1, 'user1', 'User 1', 'file-1')
+    assert storage.search('4276 1234')[1] == 0
+    storage.attach_contact(1, '4276 1234 5678 9012')
+    assert [row[0] for row in storage.search('4276 1234')[0]] == [app_id]
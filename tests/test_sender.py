@@ -0,0 +1,92 @@
+import asyncio
+import time
+
+from telegram.error import BadRequest, RetryAfter
+
+from sender import OutboundSender
+
+
+class FakeBot:
+    """Запоминает отправки; first_error[chat_id] — ошибка первой отправки в чат"""
+
+    def __init__(self, first_error=None):
+        self.first_error = dict(first_error or {})
+        self.sent = []
+
+    async def send_message(self, chat_id, text):
+        error = self.first_error.pop(chat_id, None)
+        if error:
+            raise error
+        self.sent.append((time.monotonic(), chat_id, text))
+        return text
+
+
+async def run(bot, messages, **kwargs):
+    sender = OutboundSender(bot, global_rate=1000, per_chat_rate=1000, per_chat_burst=1000, **kwargs)
+    await sender.start()
+    futures = [sender.send_message(chat_id, text=text) for chat_id, text in messages]
+    results = await asyncio.gather(*futures, return_exceptions=True)
+    assert sender.depth == 0
+    await sender.stop()
+    return results
+
+
+def test_retry_after_pauses_only_that_chat():
+    bot = FakeBot({1: RetryAfter(0.3)})
+    messages = [(1, 'a1'), (1, 'a2'), (2, 'b1'), (2, 'b2'), (3, 'c1')]
+    started = time.monotonic()
+    results = asyncio.run(run(bot, messages))
+
+    assert results == ['a1', 'a2', 'b1', 'b2', 'c1']
+    by_chat = {}
+    for sent_at, chat_id, text in bot.sent:
+        by_chat.setdefault(chat_id, []).append((sent_at - started, text))
+    # Порядок внутри чата сохраняется, остальные чаты паузу не ждут
+    assert [text for _at, text in by_chat[1]] == ['a1', 'a2']
+    assert by_chat[1][0][0] >= 0.3
+    assert max(at for chat_id in (2, 3) for at, _text in by_chat[chat_id]) < 0.2
+
+
+def test_busy_chat_does_not_hold_workers():
+    bot = FakeBot()
+    messages = [(1, f'a{i}') for i in range(5)] + [(2, 'b1')]
+
+    async def scenario():
+        sender = OutboundSender(bot, global_rate=1000, per_chat_rate=5, per_chat_burst=1, workers=1)
+        await sender.start()
+        futures = [sender.send_message(chat_id, text=text) for chat_id, text in messages]
+        await futures[-1]
+        # Единственный воркер не ждал лимита чата 1, а отправил в чат 2
+        assert sender.depth > 0
+        await asyncio.gather(*futures)
+        await sender.stop()
+
+    asyncio.run(scenario())
+    assert [text for _at, chat_id, text in bot.sent if chat_id == 1] == [f'a{i}' for i in range(5)]
+
+
+def test_permanent_error_fails_only_its_message():
+    bot = FakeBot({1: BadRequest('Chat not found')})
+    results = asyncio.run(run(bot, [(1, 'a1'), (1, 'a2'), (2, 'b1')]))
+    assert isinstance(results[0], BadRequest)
+    assert results[1:] == ['a2', 'b1']
+
+
+def test_stop_waits_for_queued_messages():
+    bot = FakeBot()
+
+    async def scenario():
+        sender = OutboundSender(bot, global_rate=1000, per_chat_rate=20, per_chat_burst=1)
+        await sender.start()
+        for i in range(3):
+            sender.send_message(1, text=f'a{i}')
+        await sender.stop()
+
+    asyncio.run(scenario())
+    assert len(bot.sent) == 3
+
+
+def test_repeated_retry_after_gives_up():
+    bot = FakeBot({1: RetryAfter(0.01)})
+    results = asyncio.run(run(bot, [(1, 'a1')], max_retries=0))
+    assert isinstance(results[0], RetryAfter)
@@ -0,0 +1,33 @@
+from migrations import SQLITE_MIGRATIONS, run_sqlite_migrations
+from storage import SQLiteStorage
+
+
+# ----- Миграции -----
+
+def test_migrations_are_applied_once(storage):
+    assert storage.migrate() == len(SQLITE_MIGRATIONS)
+    versions = [row[0] for row in storage.connection().execute('SELECT version FROM schema_migrations')]
+    assert versions == sorted(number for number, _name, _sql in SQLITE_MIGRATIONS)
+
+
+def test_migrations_upgrade_existing_database(tmp_path):
+    store = SQLiteStorage(str(tmp_path / 'old.db'))
+    try:
+        assert run_sqlite_migrations(store.connection(), SQLITE_MIGRATIONS[:3]) == 3
+        app_id = store.create_pending(1, 'old_user', 'Old User', 'file-1')
+
+        assert store.migrate() == len(SQLITE_MIGRATIONS)
+        assert store.by_id(app_id)[1] == 1
+        assert [row[0] for row in store.search('old_user')[0]] == [app_id]
+    finally:
+        store.close()
+
+
+# ----- Заявки -----
+
+def test_one_pending_application_per_user(storage):
+    app_id = storage.create_pending(1, 'user1', 'User 1', 'file-1')
+    assert storage.create_pending(1, 'user1', 'User 1', 'file-2') is None
+    assert storage.set_status(app_id, 'approved', 'pending') == 1
+    assert storage.set_status(app_id, 'rejected', 'pending') is None
+    assert storage.create_pending(1, 'user1', 'User 1', 'file-3') is not None
@@ -0,0 +1,85 @@
+import asyncio
+from datetime import datetime
+
+from telegram import Chat, Message, Update, User
+
+from update_processor import PerUserUpdateProcessor
+
+
+def make_update(update_id, user_id):
+    message = Message(update_id, datetime.now(), Chat(user_id, Chat.PRIVATE), from_user=User(user_id, 'Test', False))
+    return Update(update_id, message=message)
+
+
+async def process(updates, max_concurrent):
+    processor = PerUserUpdateProcessor(max_concurrent)
+    log = []
+    running = 0
+    peak = 0
+
+    async def handle(update):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        log.append(('start', update.update_id))
+        await asyncio.sleep(0.01)
+        log.append(('end', update.update_id))
+        running -= 1
+
+    await asyncio.gather(*(processor.process_update(update, handle(update)) for update in updates))
+    return log, peak, processor
+
+
+def test_updates_of_one_user_run_in_order():
+    updates = [make_update(update_id, user_id=1 + update_id % 2) for update_id in range(8)]
+    log, peak, processor = asyncio.run(process(updates, max_concurrent=4))
+
+    for user_id in (1, 2):
+        ids = [update.update_id for update in updates if update.effective_user.id == user_id]
+        events = [event for event in log if event[1] in ids]
+        assert events == [(kind, update_id) for update_id in ids for kind in ('start', 'end')]
+    # Два пользователя — два обработчика одновременно
+    assert peak == 2
+    assert processor._locks == {}
+
+
+def test_concurrency_limit_across_users():
+    updates = [make_update(update_id, user_id=update_id) for update_id in range(10)]
+    _log, peak, _processor = asyncio.run(process(updates, max_concurrent=3))
+    assert peak == 3
+
+
+def test_reports_handler_limit():
+    assert PerUserUpdateProcessor(8).max_concurrent_updates == 8
+
+
+def test_queued_updates_do_not_hold_handler_slots():
+    # Пользователь 1 прислал пачку, пользователь 2 — одно обновление; слотов два
+    updates = [make_update(update_id, user_id=1) for update_id in range(6)] + [make_update(6, user_id=2)]
+    log, peak, processor = asyncio.run(process(updates, max_concurrent=2))
+    assert log.index(('start', 6)) < log.index(('end', 1))
+    assert peak == 2
+    assert processor._semaphore._value == 2
+
+
+def test_cancelled_waiting_update_returns_its_slot():
+    async def scenario():
+        processor = PerUserUpdateProcessor(2)
+        release = asyncio.Event()
+        first = asyncio.ensure_future(processor.process_update(make_update(0, 1), release.wait()))
+        second = asyncio.ensure_future(processor.process_update(make_update(1, 1), asyncio.sleep(0)))
+        await asyncio.sleep(0.01)
+        second.cancel()
+        await asyncio.gather(second, return_exceptions=True)
+        release.set()
+        await first
+        return processor
+
+    processor = asyncio.run(scenario())
+    assert processor._semaphore._value == 2
+    assert processor._locks == {}
+
+
+def test_process_update_is_not_overridden():
+    # BaseUpdateProcessor.process_update помечен @final
+    assert 'process_update' not in PerUserUpdateProcessor.__dict__
@@ -0,0 +1,67 @@
+import asyncio
+import json
+
+import pytest
+from telegram import Bot
+
+from webhook import SECRET_HEADER, WebhookServer
+
+SECRET = 'test-secret'
+UPDATE = {
+    'update_id': 1,
+    'message': {
+        'message_id': 1, 'date': 0, 'text': '/start',
+        'chat': {'id': 42, 'type': 'private'},
+        'from': {'id': 42, 'is_bot': False, 'first_name': 'Test'},
+    },
+}
+
+
+class FakeApplication:
+    """Ровно то, что нужно серверу от Application: bot и update_queue"""
+
+    def __init__(self):
+        self.bot = Bot('123:TEST')
+        self.update_queue = asyncio.Queue()
+
+
+async def post(port, body, headers):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    head = ''.join(f'{name}: {value}\r\n' for name, value in headers.items())
+    writer.write(
+        f'POST /telegram HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n'
+        f'Content-Length: {len(body)}\r\n{head}\r\n'.encode() + body
+    )
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    return int(response.split()[1])
+
+
+async def send(headers):
+    application = FakeApplication()
+    server = WebhookServer(application, SECRET, host='127.0.0.1', port=0)
+    await server.start()
+    try:
+        status = await post(server.port, json.dumps(UPDATE).encode(), headers)
+    finally:
+        await server.stop()
+    return status, application.update_queue
+
+
+def test_update_with_secret_is_queued():
+    status, queue = asyncio.run(send({SECRET_HEADER: SECRET}))
+    assert status == 200
+    assert queue.get_nowait().message.text == '/start'
+
+
+@pytest.mark.parametrize('headers', [{}, {SECRET_HEADER: 'wrong'}])
+def test_update_without_secret_is_forbidden(headers):
+    status, queue = asyncio.run(send(headers))
+    assert status == 403
+    assert queue.empty()
+
+
+def test_secret_is_required():
+    with pytest.raises(ValueError):
+        WebhookServer(FakeApplication(), None)
@@ -0,0 +1,98 @@
+import asyncio
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Параллельная обработка обновлений с сохранением порядка для каждого пользователя
+
+    Обновления разных пользователей обрабатываются одновременно, обновления
+    одного пользователя (например, скриншот и следующие за ним реквизиты) —
+    строго по очереди. Общее число одновременно выполняемых обработчиков
+    ограничено max_concurrent_updates, чтобы не перегружать базу данных.
+    Обновления, ожидающие своей очереди у пользователя, слот не занимают;
+    их общее число ограничено max_pending_updates.
+    """
+
+    __slots__ = ('_locks', '_pending')
+
+    def __init__(self, max_concurrent_updates, max_pending_updates=None):
+        # Семафор базового класса ограничивает выполняемые обработчики, поэтому
+        # Application.concurrent_updates показывает настоящий предел; _pending —
+        # сколько обновлений может ждать своей очереди у пользователя без слота
+        super().__init__(max_concurrent_updates)
+        if max_pending_updates is None:
+            max_pending_updates = max_concurrent_updates * 16
+        self._pending = asyncio.BoundedSemaphore(max(max_pending_updates, max_concurrent_updates))
+        # ключ -> [блокировка, число обновлений, которые ее держат или ждут]
+        self._locks = {}
+
+    @staticmethod
+    def ordering_key(update):
+        """Ключ, в пределах которого сохраняется порядок обработки"""
+        if not isinstance(update, Update):
+            return None
+        if update.effective_user:
+            return update.effective_user.id
+        if update.effective_chat:
+            return update.effective_chat.id
+        return None
+
+    async def do_process_update(self, update, coroutine):
+        # Вызывается из process_update базового класса уже со слотом обработчика (self._semaphore)
+        key = self.ordering_key(update)
+        if key is None:
+            await coroutine
+            return
+
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            if entry[1] == 1:
+                # Других обновлений пользователя нет — блокировка свободна, ждать не придется
+                await entry[0].acquire()
+            else:
+                try:
+                    async with self._pending:
+                        await self._wait_turn(entry[0])
+                except BaseException:
+                    # Отменили, пока ждали очереди: обработчик так и не запустится
+                    coroutine.close()
+                    raise
+            try:
+                await coroutine
+            finally:
+                entry[0].release()
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+    async def _wait_turn(self, lock):
+        """Ожидание очереди пользователя без слота обработчика
+
+        Слот отдается другим на время ожидания и берется обратно, когда
+        очередь подошла; при отмене тоже берется обратно — базовый класс
+        освободит его сам.
+        """
+        self._semaphore.release()
+        try:
+            await lock.acquire()
+        except BaseException:
+            await self._semaphore.acquire()
+            raise
+        try:
+            await self._semaphore.acquire()
+        except BaseException:
+            lock.release()
+            await self._semaphore.acquire()
+            raise
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
@@ -0,0 +1,187 @@
+import asyncio
+import hmac
+import json
+import logging
+from http import HTTPStatus
+
+from telegram import Update
+
+SECRET_HEADER = 'x-telegram-bot-api-secret-token'
+
+
+class HTTPRequest:
+    """Разобранный HTTP-запрос"""
+
+    __slots__ = ('method', 'path', 'query', 'headers', 'body')
+
+    def __init__(self, method, path, query, headers, body):
+        self.method = method
+        self.path = path
+        self.query = query
+        self.headers = headers
+        self.body = body
+
+
+class HTTPServer:
+    """Минимальный асинхронный HTTP/1.1 сервер на asyncio
+
+    Поддерживает keep-alive (Telegram держит соединения открытыми)
+    и простую таблицу маршрутов: (метод, путь) -> корутина-обработчик,
+    которая возвращает (статус, content-type, тело).
+    """
+
+    def __init__(self, host='0.0.0.0', port=8080, max_body_size=1024 * 1024, keepalive_timeout=75):
+        self.host = host
+        self.port = port
+        self.max_body_size = max_body_size
+        self.keepalive_timeout = keepalive_timeout
+        self.routes = {}
+        self._server = None
+        self._connections = {}
+
+    def add_route(self, method, path, handler):
+        self.routes[(method.upper(), path)] = handler
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        sockets = self._server.sockets or []
+        if sockets:
+            # Порт 0 означает «любой свободный» — запоминаем выданный
+            self.port = sockets[0].getsockname()[1]
+        logging.info(f"🌐 HTTP-сервер слушает {self.host}:{self.port}")
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            # Закрываем простаивающие keep-alive соединения, иначе wait_closed будет их ждать
+            tasks = list(self._connections.values())
+            for writer in list(self._connections):
+                writer.close()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle_connection(self, reader, writer):
+        self._connections[writer] = asyncio.current_task()
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(self._read_request(reader), self.keepalive_timeout)
+                except asyncio.TimeoutError:
+                    break
+                except ValueError as e:
+                    await self._write_response(writer, HTTPStatus.BAD_REQUEST, 'text/plain', str(e).encode(), False)
+                    break
+                if request is None:
+                    break
+                if isinstance(request, HTTPStatus):
+                    await self._write_response(writer, request, 'text/plain', request.phrase.encode(), False)
+                    break
+
+                keep_alive = request.headers.get('connection', '').lower() != 'close'
+                status, content_type, body = await self._dispatch(request)
+                await self._write_response(writer, status, content_type, body, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._connections.pop(writer, None)
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def _read_request(self, reader):
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        try:
+            method, target, _version = request_line.decode('latin-1').split()
+        except ValueError:
+            raise ValueError('Malformed request line')
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        length = int(headers.get('content-length') or 0)
+        if length > self.max_body_size:
+            return HTTPStatus.REQUEST_ENTITY_TOO_LARGE
+        body = await reader.readexactly(length) if length else b''
+
+        path, _, query = target.partition('?')
+        return HTTPRequest(method.upper(), path, query, headers, body)
+
+    async def _dispatch(self, request):
+        handler = self.routes.get((request.method, request.path))
+        if handler is None:
+            if any(path == request.path for _method, path in self.routes):
+                return HTTPStatus.METHOD_NOT_ALLOWED, 'text/plain', b'Method Not Allowed'
+            return HTTPStatus.NOT_FOUND, 'text/plain', b'Not Found'
+        try:
+            return await handler(request)
+        except Exception as e:
+            logging.error(f"❌ Ошибка обработки HTTP-запроса {request.path}: {e}")
+            return HTTPStatus.INTERNAL_SERVER_ERROR, 'text/plain', b'Internal Server Error'
+
+    @staticmethod
+    async def _write_response(writer, status, content_type, body, keep_alive):
+        status = HTTPStatus(status)
+        head = (
+            f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.write(head.encode('latin-1') + body)
+        await writer.drain()
+
+
+class WebhookServer(HTTPServer):
+    """Прием обновлений от Telegram через вебхук
+
+    Проверяет секретный токен, кладет обновление в очередь приложения
+    и сразу отвечает 200 — обработка идет уже вне HTTP-запроса.
+    Секретный токен обязателен: без него любой, кто знает адрес,
+    мог бы присылать боту поддельные обновления. Без регистрации вебхука
+    в Telegram сервер работает как локальная заглушка: обновления можно
+    отправлять POST-запросами вручную с тем же заголовком.
+    """
+
+    def __init__(self, application, secret_token, path='/telegram', **kwargs):
+        if not secret_token:
+            raise ValueError('Для вебхука нужен секретный токен')
+        super().__init__(**kwargs)
+        self.application = application
+        self.path = path
+        self.secret_token = secret_token
+        self.add_route('POST', path, self.handle_update)
+        self.add_route('GET', '/healthz', self.handle_health)
+
+    async def handle_update(self, request):
+        received = request.headers.get(SECRET_HEADER, '')
+        if not hmac.compare_digest(received.encode(), self.secret_token.encode()):
+            logging.warning("⚠️ Запрос к вебхуку с неверным секретным токеном")
+            return HTTPStatus.FORBIDDEN, 'text/plain', b'Forbidden'
+
+        try:
+            data = json.loads(request.body)
+            update = Update.de_json(data, self.application.bot)
+        except Exception as e:
+            logging.error(f"❌ Некорректное обновление в вебхуке: {e}")
+            return HTTPStatus.BAD_REQUEST, 'text/plain', b'Bad Request'
+
+        if update is None:
+            return HTTPStatus.BAD_REQUEST, 'text/plain', b'Bad Request'
+
+        self.application.update_queue.put_nowait(update)
+        return HTTPStatus.OK, 'text/plain', b'OK'
+
+    async def handle_health(self, request):
+        return HTTPStatus.OK, 'text/plain', b'OK'